@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the per vertex bone weights conversion of load_skinned:
+the former dense (vertices, MAX_BONES) table against vertex_bones.
+Run from the repository root: python3 -m benchmarks.bench_bone_weights
+"""
+from time import perf_counter
+
+import numpy as np
+
+from src.loaders import vertex_bones
+from src.scene_cache import SceneObject, load_scene
+from src.shader import MAX_BONES, MAX_VERTEX_BONES
+
+
+def dense_bones(nb_vertices, bones):
+    """ former conversion, with a MAX_BONES wide structured row per vertex """
+    v_bone = np.array([[(0, 0)]*MAX_BONES] * nb_vertices,
+                      dtype=[('weight', 'f4'), ('id', 'u4')])
+    for bone_id, bone in enumerate(bones[:MAX_BONES]):
+        for vertexid, weight in zip(bone.vertexids, bone.weights):
+            v_bone[vertexid][bone_id] = (weight, bone_id)
+    v_bone.sort(order='weight')
+    v_bone = v_bone[:, -MAX_VERTEX_BONES:]
+    return v_bone['id'], v_bone['weight']
+
+
+def synthetic_rig(nb_vertices, nb_bones=60, max_influences=6, seed=0):
+    """ each vertex influenced by 1 to max_influences distinct random bones """
+    rng = np.random.default_rng(seed)
+    influences = rng.integers(1, max_influences + 1, nb_vertices)
+    vertex = np.repeat(np.arange(nb_vertices), influences)
+    pairs = np.unique(vertex * nb_bones + rng.integers(0, nb_bones, len(vertex)))
+    vertex, bone = pairs // nb_bones, pairs % nb_bones
+    weight = rng.random(len(pairs)).astype(np.float32)
+    return [SceneObject(vertexids=vertex[bone == i].astype(np.int32),
+                        weights=weight[bone == i]) for i in range(nb_bones)]
+
+
+def timed(function, *args, repeat=3):
+    """ best wall time of 'repeat' calls, and the last result """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function(*args)
+        best = min(best, perf_counter() - start)
+    return best, result
+
+
+def compare(name, nb_vertices, bones, dense=True):
+    """ print both timings, check both conversions give the same weights """
+    fast, (ids, weights) = timed(vertex_bones, nb_vertices, bones)
+    line = '%-28s %8d vertices  vectorized %9.2f ms' % (name, nb_vertices,
+                                                       1000 * fast)
+    if dense:
+        slow, (dense_ids, dense_weights) = timed(dense_bones, nb_vertices,
+                                                 bones, repeat=1)
+        same = np.allclose(np.sort(weights, 1), np.sort(dense_weights, 1))
+        line += '  dense %9.2f ms  x%.0f  %s' % (
+            1000 * slow, slow / fast, 'same weights' if same else 'MISMATCH')
+    print(line)
+
+
+def main():
+    scene = load_scene('meshes/pterosaur.dae')
+    if scene is not None:
+        for mesh in scene.meshes:
+            if mesh.bones:
+                compare('pterosaur.dae', mesh.vertices.shape[0], mesh.bones)
+    for nb_vertices in (10000, 50000):
+        compare('synthetic rig', nb_vertices, synthetic_rig(nb_vertices))
+    compare('synthetic rig', 1000000, synthetic_rig(1000000), dense=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the BVH against object count: build time, frustum query and
+ray cast against a linear test of every box, incremental refit of the 1%
+moving objects against a full refit.
+Run from the repository root: python3 -m benchmarks.bench_bvh
+"""
+from time import perf_counter
+
+import numpy as np
+
+from src.bounds import Frustum
+from src.bvh import BVH, _classify
+from src.transform import lookat, perspective, vec
+
+
+def timed(function, *args, repeat=20):
+    """ (mean time of a call, result) """
+    start = perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return (perf_counter() - start) / repeat, result
+
+
+def linear_frustum(frustum, lower, upper):
+    outside, _ = _classify(frustum, lower, upper)
+    return np.nonzero(~outside)[0]
+
+
+def linear_ray(origin, direction, lower, upper):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        near = (lower - origin) / direction
+        far = (upper - origin) / direction
+    enter = np.fmax(np.nanmax(np.fmin(near, far), axis=1), 0)
+    leave = np.nanmin(np.fmax(near, far), axis=1)
+    distances = np.where(leave >= enter, enter, np.inf)
+    return np.argmin(distances), distances.min()
+
+
+def main():
+    rng = np.random.default_rng(0)
+    eye, target = vec(0, 50, 600), vec(0, 0, 0)
+    frustum = Frustum(perspective(35, 4 / 3, 1, 2000) @ lookat(eye, target, vec(0, 1, 0)))
+    direction = (target - eye) / np.linalg.norm(target - eye)
+    print('%8s %10s %12s %12s %12s %12s %12s %12s' % (
+        'objects', 'build', 'frustum', 'linear', 'ray', 'linear', 'refit 1%', 'full refit'))
+    for count in (100, 1000, 10000, 100000):
+        centers = rng.uniform(-1000, 1000, (count, 3))
+        extents = rng.uniform(1, 10, (count, 3))
+        lower, upper = centers - extents, centers + extents
+        build, bvh = timed(BVH, lower, upper, repeat=3)
+        times = [build]
+        found = timed(bvh.query_frustum, frustum)
+        expected = timed(linear_frustum, frustum, lower, upper)
+        assert np.array_equal(found[1], expected[1])
+        times += [found[0], expected[0]]
+        found = timed(bvh.ray_cast, eye, direction)
+        expected = timed(linear_ray, eye, direction, lower, upper)
+        assert found[1][1] == expected[1][1]
+        times += [found[0], expected[0]]
+        movers = rng.choice(count, max(1, count // 100), replace=False)
+        times.append(timed(bvh.refit, movers, lower[movers] + 1, upper[movers] + 1)[0])
+        times.append(timed(bvh.refit)[0])
+        print('%8d' % count + ''.join('%9.3f ms' % (1000 * t) for t in times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the cost per call of the hot GL functions, through PyOpenGL
+and through the fast dispatch of src.fastgl, on an offscreen context:
+raw calls, then uniform uploads through Shader.set and a whole draw as
+the render queue makes it.
+Run from the repository root: python3 -m benchmarks.bench_fastgl
+"""
+import os
+from time import perf_counter
+
+# la plateforme OpenGL doit etre choisie avant d'importer OpenGL
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+import numpy as np                  # all matrix manipulations & OpenGL args
+
+from src import fastgl
+from src.gl import GL
+from src.offscreen import OffscreenContext
+from src.shader import Shader, LAMBERTIAN_VERT, LAMBERTIAN_FRAG
+from src.vertexArray import VertexArray
+
+CALLS, REPEATS = 20000, 5
+
+
+def per_call(function, calls=CALLS, repeats=REPEATS):
+    """ time in microseconds of one call of 'function': the mean over
+        'calls' calls, best of 'repeats' runs to leave out other processes """
+    function()
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        for _ in range(calls):
+            function()
+        GL.glFinish()
+        times.append(1e6 * (perf_counter() - start) / calls)
+    return min(times)
+
+
+def cases(shader, array):
+    """ (name, function) of each measured call, looking GL functions up at
+        each call like our modules do """
+    matrix = np.identity(4, np.float32).tobytes()  # as Shader.set uploads
+    location = shader.uniforms['modelMatrix'][0]
+    values = [np.identity(4) * i for i in range(2)]  # never equal to the last
+
+    def upload():
+        shader.values.clear()
+        shader.set('modelMatrix', values[0])
+
+    def draw():
+        GL.glUseProgram(shader.glid)
+        GL.glBindVertexArray(array.glid)
+        for value in values:
+            shader.set('modelMatrix', value)
+            array.call(GL.GL_TRIANGLES)
+    return [
+        ('glUniformMatrix4fv', lambda: GL.glUniformMatrix4fv(location, 1, True,
+                                                             matrix)),
+        ('glDrawElements', lambda: GL.glDrawElements(GL.GL_TRIANGLES, 3,
+                                                     GL.GL_UNSIGNED_INT, None)),
+        ('Shader.set matrix', upload),
+        ('draw 2 objects', draw),
+    ]
+
+
+def main():
+    context = OffscreenContext(64, 64)
+    shader = Shader(LAMBERTIAN_VERT, LAMBERTIAN_FRAG)
+    vertices = np.array(((0, 0, 0), (1, 0, 0), (0, 1, 0)), np.float32)
+    array = VertexArray([vertices, vertices, vertices], np.array((0, 1, 2)))
+    GL.glUseProgram(shader.glid)
+    GL.glBindVertexArray(array.glid)
+
+    results = {}
+    for mode, switch in (('PyOpenGL', fastgl.disable), ('fast', fastgl.enable)):
+        switch()
+        for name, function in cases(shader, array):
+            results.setdefault(name, {})[mode] = per_call(function)
+    fastgl.disable()
+
+    print('%-22s %12s %12s %8s' % ('us per call', 'PyOpenGL', 'fast', 'speedup'))
+    for name, times in results.items():
+        print('%-22s %12.3f %12.3f %7.1fx' % (name, times['PyOpenGL'], times['fast'],
+                                              times['PyOpenGL'] / times['fast']))
+    context.destroy()
+
+
+if __name__ == '__main__':
+    main()
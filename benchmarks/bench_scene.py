@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark of whole frames of the main.py scene, drawn offscreen with a
+virtual clock so that every run draws the same frames: a scripted camera
+orbit with geyser triggers, or a session recorded with main.py --record.
+Prints the frame time percentiles and the time of each phase of
+Viewer.run as JSON, after the loading screen and some warm up frames,
+and can save the profiled frames as a Chrome trace. With --max-gl-calls
+it fails when frames make more GL calls than allowed, e.g. in regression
+tests run on a software GL.
+Run from the repository root: python3 -m benchmarks.bench_scene
+"""
+import argparse
+import json
+import math
+import os
+import sys
+from collections import deque
+
+# la plateforme OpenGL doit etre choisie avant d'importer OpenGL
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+import numpy as np                  # all matrix manipulations & OpenGL args
+import glfw                         # key codes of the scripted events
+
+from main import build_scene
+from src import fastgl
+from src.clock import VirtualClock, set_clock
+from src.gl import GL, GL_CALLS
+from src.profiler import PROFILER
+from src.replay import InputReplay
+from src.simulation import SIMULATION_RATE
+from src.viewer import Viewer
+
+PERCENTILES = (50, 90, 95, 99)
+GEYSER_PERIOD, GEYSER_CHARGE = 120, 30  # frames between geysers, space held
+
+
+def scripted(viewer, frames, step):
+    """ one camera orbit over 'frames' frames, zooming in and out, and a
+        geyser every GEYSER_PERIOD frames, 'step' seconds apart """
+    clock = VirtualClock()
+    set_clock(clock)
+    trackball = viewer.trackball
+    near, far = trackball.bornes_zoom
+
+    def frame_started(frame):
+        clock.now = frame * step
+        turn = frame / frames
+        trackball.angle_xy = 2 * math.pi * turn
+        trackball.distance = far - (far - near) * (1 - math.cos(2 * math.pi * turn)) / 2
+        if frame % GEYSER_PERIOD == 0:
+            viewer.key(glfw.KEY_SPACE, glfw.PRESS)
+        elif frame % GEYSER_PERIOD == GEYSER_CHARGE:
+            viewer.key(glfw.KEY_SPACE, glfw.RELEASE)
+    viewer.on_frame.append(frame_started)
+
+
+def summary(times):
+    """ mean, max and percentiles in milliseconds of 'times' seconds """
+    times = 1000 * np.asarray(times)
+    result = {'mean': times.mean(), 'max': times.max()}
+    result.update(('p%d' % p, v) for p, v in zip(PERCENTILES,
+                                                 np.percentile(times, PERCENTILES)))
+    return {key: round(float(value), 3) for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='first frames not measured')
+    parser.add_argument('--size', default='640x480',
+                        type=lambda size: tuple(map(int, size.split('x'))))
+    parser.add_argument('--step', type=float, default=1 / 60,
+                        help='virtual time between scripted frames, seconds')
+    parser.add_argument('--rate', type=float, default=SIMULATION_RATE,
+                        help='simulation steps per second')
+    parser.add_argument('--replay', metavar='JSON',
+                        help='replay a recorded session instead of the script')
+    parser.add_argument('--json', metavar='PATH', help='also save the results')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='save the frames as a Chrome trace, detailed per '
+                             'object and render queue layer')
+    parser.add_argument('--checked-gl', action='store_true',
+                        help='GL calls through PyOpenGL, not src.fastgl')
+    parser.add_argument('--gl-calls', action='store_true',
+                        help='count the GL calls per frame, slows frames down')
+    parser.add_argument('--max-gl-calls', type=float, metavar='N',
+                        help='exit with an error if frames make more than N '
+                             'GL calls on average, implies --gl-calls')
+    args = parser.parse_args()
+
+    viewer = Viewer(*args.size, offscreen=True, frames=args.warmup + args.frames)
+    viewer.simulation.step = 1 / args.rate
+    if not args.checked_gl:
+        fastgl.enable()
+    if args.replay:
+        viewer.frames = None  # as many frames as recorded
+        InputReplay(viewer, args.replay)
+    else:
+        scripted(viewer, args.warmup + args.frames, args.step)
+    build_scene(viewer)
+
+    PROFILER.frames = deque()  # every frame, the warm up ones dropped below
+    PROFILER.enable(detailed=bool(args.trace))
+    if args.gl_calls or args.max_gl_calls is not None:
+        GL_CALLS.frames = deque()
+        GL_CALLS.enable()
+    viewer.run()
+    if args.trace:
+        PROFILER.save_trace(args.trace)
+    profiled = list(PROFILER.frames)[args.warmup:]
+    stages = [PROFILER.totals(frame) for frame in profiled]
+
+    results = {
+        'renderer': GL.glGetString(GL.GL_RENDERER).decode(),
+        'size': args.size, 'frames': len(stages),
+        'gl_dispatch': 'PyOpenGL' if args.checked_gl else 'fast',
+        'simulation': {'rate': args.rate,
+                       'dropped_steps': viewer.simulation.dropped},
+        'frame_ms': summary([end - start for start, end, _ in profiled]),
+        'stages_ms': {stage: summary([times[stage] for times in stages])
+                      for stage in stages[0]},
+    }
+    if GL_CALLS.enabled:
+        per_frame = {}  # of the measured frames
+        for calls in list(GL_CALLS.frames)[args.warmup:]:
+            for name, count in calls.items():
+                per_frame[name] = per_frame.get(name, 0) + count / len(stages)
+        results['gl_calls_per_frame'] = dict(
+            total=round(sum(per_frame.values()), 1),
+            **{name: round(count, 1) for name, count in
+               sorted(per_frame.items(), key=lambda item: -item[1])})
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.max_gl_calls is not None and \
+            results['gl_calls_per_frame']['total'] > args.max_gl_calls:
+        sys.exit('%.1f GL calls per frame, more than the %g allowed' % (
+            results['gl_calls_per_frame']['total'], args.max_gl_calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the scene graph traversal cost per frame against node count:
+the former recursive Node.draw against the retained iterative one, for a
+static tree and for a tree whose root moves every frame.
+Run from the repository root: python3 -m benchmarks.bench_traversal
+"""
+from time import perf_counter
+
+import numpy as np
+
+from src.node import Node
+from src.transform import rotate, translate
+
+
+class Leaf:
+    """ drawable doing nothing, stands for a mesh """
+    def draw(self, projection, view, model, **param):
+        pass
+
+
+def recursive_draw(node, projection, view, model, time=None, **param):
+    """ former Node.draw: new parameters and world matrix at every node """
+    param = dict(param, **node.param)
+    model = model @ node.transform
+    for child in node.children:
+        if isinstance(child, Node):
+            recursive_draw(child, projection, view, model, time=time, **param)
+        else:
+            child.draw(projection, view, model, time=time, **param)
+
+
+def tree(nb_nodes, branching=4):
+    """ root of a tree of 'nb_nodes' nodes, each holding a leaf """
+    nodes = [Node(transform=translate(0, 1, 0) @ rotate((0, 1, 0), 30))]
+    for i in range(1, nb_nodes):
+        node = Node(transform=translate(0, 1, 0) @ rotate((0, 1, 0), i))
+        nodes[(i - 1) // branching].add(node)
+        nodes.append(node)
+    for node in nodes:
+        node.add(Leaf())
+    return nodes[0]
+
+
+def per_frame(draw, root, frames, move=False):
+    """ mean time of one frame traversal """
+    projection = view = model = np.identity(4)
+    start = perf_counter()
+    for frame in range(frames):
+        if move:
+            root.transform = translate(frame, 0, 0)
+        draw(root, projection, view, model)
+    return (perf_counter() - start) / frames
+
+
+def main():
+    print('%8s %14s %14s %14s' % ('nodes', 'recursive', 'retained', 'moving root'))
+    for nb_nodes in (10, 100, 1000, 10000):
+        root = tree(nb_nodes)
+        frames = max(10, 20000 // nb_nodes)
+        times = (per_frame(recursive_draw, root, frames),
+                 per_frame(Node.draw, root, frames),
+                 per_frame(Node.draw, root, frames, move=True))
+        print('%8d' % nb_nodes + ''.join('%11.3f ms' % (1000 * t) for t in times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Regression check of input recording and replay: main.py records an
+offscreen session, on the wall clock, then replays it, and the last frames
+of both runs must be identical. Only the RGB channels are compared: the
+alpha left under the UI by llvmpipe may differ by 1 from run to run.
+Exits with an error if the frames differ.
+Run from the repository root: python3 -m benchmarks.check_replay
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np                  # image comparison
+from PIL import Image               # load frames saved by main.py
+
+
+def run_main(*args):
+    """ run main.py offscreen with 'args', failing if it fails """
+    subprocess.run([sys.executable, 'main.py', '--offscreen'] + list(args),
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--size', default='320x240')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        session, recorded, replayed = (os.path.join(directory, name) for name in
+                                       ('session.json', 'recorded.png', 'replayed.png'))
+        run_main('--frames', str(args.frames), '--size', args.size,
+                 '--record', session, '--output', recorded)
+        run_main('--replay', session, '--size', args.size, '--output', replayed)
+        frames = [np.asarray(Image.open(path).convert('RGB'), np.int16)
+                  for path in (recorded, replayed)]
+
+    difference = np.abs(frames[0] - frames[1]).max(axis=-1)
+    print('%d frames of %s replayed, %d pixels differ, by %d at most' % (
+        args.frames, args.size, np.count_nonzero(difference), difference.max()))
+    if difference.any():
+        sys.exit('the replay does not draw the recorded frames')
+
+
+if __name__ == '__main__':
+    main()
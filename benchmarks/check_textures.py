@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Regression check of the texture registry eviction, on an offscreen
+context with a null memory budget: the meshes hold the textures they are
+drawn with, meshes merged by Node.freeze give theirs back, and a texture
+is destroyed once the last mesh using it is garbage collected. Images
+decoded ahead by prefetch must not outlive their acquire.
+Exits with an error if a texture or an image is kept, or destroyed too
+early.
+Run from the repository root: python3 -m benchmarks.check_textures
+"""
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+# la plateforme OpenGL doit etre choisie avant d'importer OpenGL
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+import numpy as np                  # all matrix manipulations & OpenGL args
+from PIL import Image               # textures written for the check
+
+from src.meshes import PhongMesh
+from src.node import Node
+from src.offscreen import OffscreenContext
+from src.texture import TEXTURES
+from src.transform import translate
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit('texture registry: ' + message)
+
+
+def main():
+    context = OffscreenContext(64, 64)
+    TEXTURES.budget = 0  # textures nobody uses are destroyed at once
+    vertices = np.array(((0, 0, 0), (1, 0, 0), (0, 1, 0)), np.float32)
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, 'check.png')
+        Image.new('RGB', (64, 64), (255, 0, 0)).save(file)
+        texture = TEXTURES.acquire(file)
+        meshes = [PhongMesh(texture, [vertices, vertices], np.array((0, 1, 2)), 1.)
+                  for _ in range(2)]
+        TEXTURES.release(texture)  # only the meshes use it now
+        check(texture.glid and TEXTURES.references[texture.key] == 2,
+              'meshes do not hold their texture')
+
+        root = Node(children=[Node(transform=translate(1, 0, 0),
+                                   children=[meshes[0]]), meshes[1]])
+        del meshes
+        root.freeze()
+        gc.collect()
+        check(texture.glid and TEXTURES.references[texture.key] == 1,
+              'merged meshes do not give their texture back')
+
+        memory = TEXTURES.memory
+        del root
+        gc.collect()
+        check(not texture.glid and texture.key not in TEXTURES.textures,
+              'unused texture not evicted under the budget')
+        print('texture of %d bytes evicted once unused, %d bytes kept' % (
+            memory, TEXTURES.memory))
+
+        # same content under two paths, decoded by prefetch: one texture
+        copy = os.path.join(directory, 'copy.png')
+        shutil.copy(file, copy)
+        for path in (file, copy):
+            TEXTURES.prefetch(path)
+        textures = [TEXTURES.acquire(path) for path in (file, copy)]
+        check(textures[0] is textures[1] and not TEXTURES.images,
+              'images decoded by prefetch kept after acquire')
+        TEXTURES.prefetch(copy)
+        check(not TEXTURES.images, 'prefetch decodes a texture already created')
+        print('prefetched images dropped once acquired')
+    context.destroy()
+
+
+if __name__ == '__main__':
+    main()
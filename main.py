@@ -6,10 +6,15 @@ Python OpenGL practical application.
 import os                           # os function, i.e. checking file status
 from itertools import cycle
 import sys
+import argparse                     # command line options
 from bisect import bisect_left      # search sorted keyframe lists
 
+# sans fenetre, la plateforme OpenGL doit etre choisie avant d'importer OpenGL
+if '--offscreen' in sys.argv:
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
 # External, non built-in modules
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+from src.gl import GL, GL_CALLS     # OpenGL.GL, see src.gl
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 import pyassimp                     # 3D ressource loader
@@ -27,78 +32,26 @@ from src.interaction import GLFWTrackball
 from src.loaders import load_skinned, load_skybox, load_with_hierarchy, \
     load_for_particle, load_textured
 from src.dino import Dino, Ptero
-from src.arbre import creer_arbre
-from src.herbe import creer_herbe
+from src.arbre import base_arbre, arbres_aleatoires, Foret
+from src.herbe import creer_herbe, GrassField
 from random import random
-from src.texture import Texture
+from src.texture import TEXTURES
 from src.meshes import UIMesh, ConsigneMesh
 from src.cylindre import Cylindre, Plan
+from src.loading import AssetLoader
+from src.replay import InputRecorder, InputReplay
+from src.profiler import PROFILER
+from src import fastgl
 
 
 
 # -------------- main program and scene setup --------------------------------
-def main():
-    """ create a window, add scene objects, then run rendering loop """
-    viewer = Viewer()
-
-    # Sky box :
-    viewer.set_skybox(load_skybox("meshes/sphere.dae", "textures/ciel.png"))
-
-    viewer.add(load_with_hierarchy("meshes/sol.dae")[0])
-    viewer.add_element_interacting(Dino(load_skinned("meshes/dinoPlateforme.dae", 0)[0]))
-
-    # ------ AJOUT DE LA FAMILLE DE PTERODACTYLES ---------
-    mon_pterosaure = load_skinned("meshes/pterosaur.dae", 1)[0]
-    viewer.add(Ptero(mon_pterosaure, 90, 20, 25, 0.7, 8, 0))
-    viewer.add(Ptero(mon_pterosaure))
-    viewer.add(Ptero(mon_pterosaure, 250, 45, 46, 1, 2, 1))
-    viewer.add(Ptero(mon_pterosaure, 300, 50, 30, 1.5, 5))
-    viewer.add(Ptero(mon_pterosaure, 30, 60, 40, 0.5, 1, 1))
-    viewer.add(Ptero(mon_pterosaure, 190, 70, 50, 1.2, 4))
-
-    # ------- CHARGEMENT DU CUBE (particule) POUR LE GEYSER -------
-    viewer.add_element_interacting(load_for_particle("meshes/cube_particle.dae")[0])
-
-
-    # ---------- CREATION DES ARBRES ---------
-    cylindre = Cylindre()
-    arb1 = creer_arbre(10, 2, cylindre, (-20, 0, -20))
-    viewer.add(arb1)
-    """
-    arb2 = creer_arbre(10, 3, cylindre, (0, -.5, -25))
-    viewer.add(arb2)
-
-
-    x1 = -30
-    x2 = -50
-    h = 22
-    z1 = -70cylindre
-    z2 = -90
-    for i in range(4):
-        arb = creer_arbre(8 + random() * 4, 2, cylindre,
-                          ((x2 - x1) * random() + x1, h, (z2 - z1) * random() + z1))
-        viewer.add(arb)
-
-    """
-
-    # la je fais de l'herbe
-
-    plan = Plan()
-    erb1 = creer_herbe(plan, 10.0, (0, -.5, -25))
-    viewer.add(erb1)
-
-    x1 = -30
-    x2 = -50
-    h = 22
-    z1 = -70
-    z2 = -90
-    for _ in range(5):
-        erb = creer_herbe(plan, 15, ((x2 - x1) * random() + x1, h, (z2 - z1) * random() + z1), 30.0*random())
-        viewer.add(erb)
-
-
+def build_scene(viewer):
+    """ add the scene objects to 'viewer', loaded during its first frames """
+    loader = AssetLoader()
 
     # ---- CREATION de la jauge de chargement -----
+    # (creee en premier: elle sert aussi d'ecran de chargement)
     bleu = [0,0,1]
     rouge = [1, 0, 0]
     vertices = np.array([[0.7, -0.5, 0],
@@ -118,14 +71,141 @@ def main():
                 [0.95, -0.65, 0],
                 [-0.05, -0.85, 0],
                 [-0.05, -0.65,0]])
-    texture = Texture("textures/press.png")
+    texture = TEXTURES.acquire("textures/press.png")
     consigne = ConsigneMesh(texture, [vertices2])
+    TEXTURES.release(texture)  # la consigne l'utilise, nous plus
     viewer.add_UI(consigne)
 
+    # Les fichiers sont lus par des threads, les objets OpenGL crees ensuite
+    # par le thread principal, dans l'ordre d'ajout, pendant le chargement
+
+    # Sky box :
+    loader.add('skybox', lambda: viewer.set_skybox(
+        load_skybox("meshes/sphere.dae", "textures/ciel.png")),
+               ["meshes/sphere.dae"], ["textures/ciel.png"])
+
+    # niveaux de detail simplifies, choisis selon la distance de la camera:
+    # le sol couvre l'ecran, il n'est simplifie qu'en vue eloignee
+    loader.add('sol', lambda: viewer.add(
+        load_with_hierarchy("meshes/sol.dae", lods=2,
+                            screen_sizes=(6, 3))[0].freeze()), ["meshes/sol.dae"])
+    loader.add('dino', lambda: viewer.add_element_interacting(Dino(
+        load_skinned("meshes/dinoPlateforme.dae", 0, bake_rate=60,
+                     lods=1)[0])),
+               ["meshes/dinoPlateforme.dae"])
+
+    # ------ AJOUT DE LA FAMILLE DE PTERODACTYLES ---------
+    def pteros():
+        mon_pterosaure = load_skinned("meshes/pterosaur.dae", 1, bake_rate=60,
+                                      lods=1)[0]
+        viewer.add(Ptero(mon_pterosaure, 90, 20, 25, 0.7, 8, 0))
+        viewer.add(Ptero(mon_pterosaure))
+        viewer.add(Ptero(mon_pterosaure, 250, 45, 46, 1, 2, 1))
+        viewer.add(Ptero(mon_pterosaure, 300, 50, 30, 1.5, 5))
+        viewer.add(Ptero(mon_pterosaure, 30, 60, 40, 0.5, 1, 1))
+        viewer.add(Ptero(mon_pterosaure, 190, 70, 50, 1.2, 4))
+    loader.add('pterosaures', pteros, ["meshes/pterosaur.dae"])
+
+    # ------- CHARGEMENT DU CUBE (particule) POUR LE GEYSER -------
+    loader.add('geyser', lambda: viewer.add_element_interacting(
+        load_for_particle("meshes/cube_particle.dae")[0]),
+               ["meshes/cube_particle.dae"])
+
+
+    # ---------- CREATION DES ARBRES ---------
+    # tous les arbres sont des instances du cylindre, meme graine meme foret
+    def arbres():
+        cylindre = Cylindre()
+        rng = np.random.default_rng(1)
+        bases = np.concatenate((
+            [base_arbre(10, (-20, 0, -20))],
+            arbres_aleatoires(4, ((-50, -30), 22, (-90, -70)), (8, 12), rng)))
+        viewer.add(Foret(cylindre, bases, profondeur=2, seed=1))
+    loader.add('arbres', arbres, ["meshes/cylindre.dae"])
+
+    # la je fais de l'herbe
+    def herbes():
+        plan = Plan()
+        erb1 = creer_herbe(plan, 10.0, (0, -.5, -25))
+        viewer.add(erb1.freeze())
+
+        # touffes instanciees: un seul appel de dessin quelle que soit la densite
+        viewer.add(GrassField(plan, ((-50, -30), 22, (-90, -70)), densite=0.05,
+                              tailles=(10, 15), seed=1))
+    loader.add('herbes', herbes, ["meshes/plan.dae"])
+
+    # the startup timeline is printed once the last asset is loaded
+    viewer.load(loader)
+
+
+def main(args):
+    """ create a window, add scene objects, then run rendering loop """
+    viewer = Viewer(*args.size, offscreen=args.offscreen, frames=args.frames)
+    if not args.checked_gl:
+        fastgl.enable()
+    if args.replay:  # before the scene is built, at the recorded time
+        InputReplay(viewer, args.replay)
+    recorder = args.record and InputRecorder(viewer)
+    build_scene(viewer)
+    if args.profile:
+        PROFILER.enable(detailed=True)
+    if args.gl_calls or args.gl_trace is not None:
+        GL_CALLS.enable(trace_frame=args.gl_trace)
     viewer.run()
+    if args.gl_calls:
+        print(GL_CALLS.summary())
+    if GL_CALLS.trace:
+        print('GL calls of frame %d:' % args.gl_trace)
+        print('\n'.join(GL_CALLS.trace))
+    if args.profile:
+        print(PROFILER.summary())
+        PROFILER.save_trace(args.profile)
+    if recorder:
+        recorder.save(args.record)
+    if args.output:
+        viewer.screenshot(args.output)
+
+
+def parse_args():
+    """ command line options """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--offscreen', action='store_true',
+                        help='render without window, with EGL or OSMesa '
+                             'as set by PYOPENGL_PLATFORM (default egl)')
+    parser.add_argument('--frames', type=int,
+                        help='number of frames to draw, then quit '
+                             '(default 100 offscreen, else until closed)')
+    parser.add_argument('--size', default='640x480',
+                        type=lambda size: tuple(map(int, size.split('x'))),
+                        help='window or framebuffer size, WIDTHxHEIGHT')
+    parser.add_argument('--output', metavar='IMAGE',
+                        help='save the last frame drawn offscreen, e.g. frame.png')
+    parser.add_argument('--record', metavar='JSON',
+                        help='save the key and mouse events of the session')
+    parser.add_argument('--replay', metavar='JSON',
+                        help='replay recorded events at their frame times')
+    parser.add_argument('--profile', metavar='JSON',
+                        help='profile the frames, print their summary and '
+                             'save them as a Chrome trace (P key toggles)')
+    parser.add_argument('--gl-calls', action='store_true',
+                        help='print the GL calls per frame of each function')
+    parser.add_argument('--gl-trace', type=int, metavar='FRAME',
+                        help='print the GL calls of frame FRAME')
+    parser.add_argument('--checked-gl', action='store_true',
+                        help='GL calls through PyOpenGL, checking GL errors, '
+                             'instead of src.fastgl')
+    args = parser.parse_args()
+    if args.output and not args.offscreen:
+        parser.error('--output needs --offscreen')
+    if args.offscreen and args.frames is None and not args.replay:
+        args.frames = 100
+    return args
 
 
 if __name__ == '__main__':
-    glfw.init()                # initialize window system glfw
-    main()                     # main function keeps variables locally scoped
-    glfw.terminate()           # destroy all glfw windows and GL contexts
+    args = parse_args()
+    if not args.offscreen:
+        glfw.init()            # initialize window system glfw
+    main(args)                 # main function keeps variables locally scoped
+    if not args.offscreen:
+        glfw.terminate()       # destroy all glfw windows and GL contexts
@@ -1,5 +1,10 @@
 from src.transform import lerp, vec, quaternion_slerp, quaternion_matrix, quaternion, quaternion_from_euler, translate, scale
+import numpy as np                  # vectorized clip sampling
+import os                           # os function, i.e. checking file status
+from time import perf_counter       # baking duration report
+from src.cache import cache_file, replace_atomically
 from bisect import bisect_left      # search sorted keyframe lists
+from collections import OrderedDict  # least recently used pose eviction
 
 
 class TransformKeyFrames:
@@ -47,3 +52,216 @@ class KeyFrames:
                 / (self.times[i+1] - self.times[i])
         return self.interpolate(self.values[i],
                 self.values[i+1], fraction)
+
+
+class KeyTrack:
+    """ One component (translation, rotation or scale) of all the channels
+        of a clip. Keys of every channel are concatenated in flat arrays,
+        channel c times being shifted by c * span so that the whole track
+        stays sorted and all channels are searched in one searchsorted """
+    def __init__(self, keys_per_channel):
+        times, values, starts = [], [], []
+        for keys in keys_per_channel:
+            pairs = sorted(keys.items(), key=lambda pair: pair[0])
+            starts.append(len(times))
+            times.extend(time for time, _ in pairs)
+            values.extend(value for _, value in pairs)
+        times = np.array(times, np.float64)
+        self.values = np.array(values, np.float64)
+        self.start = np.array(starts)
+        self.end = np.append(self.start[1:], len(times)) - 1  # last key
+        self.first, self.last = times[self.start], times[self.end]
+
+        self.span = times.max() - times.min() + 1
+        self.offset = np.arange(len(starts)) * self.span - times.min()
+        self.flat = times + np.repeat(self.offset, self.end - self.start + 1)
+        self.keys = np.unique(times)  # where any channel changes segment
+        self.segment = None
+
+    def locate(self, time):
+        """ per channel key indices surrounding 'time', in one pass """
+        query = np.clip(time, self.first, self.last) + self.offset
+        i = np.searchsorted(self.flat, query, 'right') - 1
+        i = np.maximum(np.minimum(i, self.end - 1), self.start)
+        self.segment = i, np.minimum(i + 1, self.end)
+
+    def sample(self, time, relocate):
+        """ (channels, size) interpolation weights and surrounding values """
+        if relocate or self.segment is None:
+            self.locate(time)
+        i, j = self.segment
+        query = np.clip(time, self.first, self.last) + self.offset
+        delta = self.flat[j] - self.flat[i]
+        fraction = np.divide(query - self.flat[i], delta,
+                             out=np.zeros_like(delta), where=delta > 0)
+        return fraction[:, None], self.values[i], self.values[j]
+
+
+def slerp_all(q0, q1, fraction):
+    """ vectorized quaternion_slerp of (n, 4) quaternion arrays """
+    q0 = q0 / np.linalg.norm(q0, axis=1, keepdims=True)
+    q1 = q1 / np.linalg.norm(q1, axis=1, keepdims=True)
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    q1, dot = np.where(dot > 0, q1, -q1), np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1, 1)) * fraction
+    q2 = q1 - q0 * dot
+    norm = np.linalg.norm(q2, axis=1, keepdims=True)
+    q2 = np.divide(q2, norm, out=q2, where=norm > 0)
+    return q0 * np.cos(theta) + q2 * np.sin(theta)
+
+
+def quaternion_matrices(q):
+    """ vectorized quaternion_matrix, (n, 3, 3) rotations of (n, 4) q """
+    w, x, y, z = (q / np.linalg.norm(q, axis=1, keepdims=True)).T
+    return np.stack((1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y),
+                     2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x),
+                     2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)),
+                    1).reshape(-1, 3, 3)
+
+
+class AnimationClip:
+    """ All transform channels of a rig packed in numpy arrays, so that the
+        local transforms of every animated node are sampled at once """
+    def __init__(self, channels):
+        """ channels: one (translate_keys, rotate_keys, scale_keys) triple of
+            {time: value} dictionaries per animated node """
+        self.tracks = [KeyTrack(keys) for keys in zip(*channels)] \
+            if channels else []
+        keys = np.unique(np.concatenate([track.keys for track in self.tracks]
+                                        or [np.zeros(1)]))
+        self.duration = keys[-1]
+        # times where some channel changes key segment, and current segment
+        self.breaks = np.concatenate(([-np.inf], keys, [np.inf]))
+        self.cursor = 0
+        self.size = len(channels)
+
+    def relocate(self, time):
+        """ move the time cursor: True if key segments must be searched """
+        breaks, cursor = self.breaks, self.cursor
+        if breaks[cursor] <= time < breaks[cursor + 1]:
+            return False
+        if breaks[cursor + 1] <= time < breaks[min(cursor + 2, len(breaks) - 1)]:
+            self.cursor += 1  # monotonic time fast path: next segment
+        else:
+            self.cursor = np.searchsorted(breaks, time, 'right') - 1
+        return True
+
+    def sample(self, time):
+        """ (n_channels, 4, 4) local TRS transforms of all channels """
+        matrices = np.zeros((self.size, 4, 4), np.float32)
+        if not self.size:
+            return matrices
+        relocate = self.relocate(time)
+        translate_track, rotate_track, scale_track = self.tracks
+
+        fraction, v0, v1 = translate_track.sample(time, relocate)
+        translation = v0 + fraction * (v1 - v0)
+        fraction, v0, v1 = rotate_track.sample(time, relocate)
+        rotation = quaternion_matrices(slerp_all(v0, v1, fraction))
+        fraction, v0, v1 = scale_track.sample(time, relocate)
+        scaling = v0 + fraction * (v1 - v0)
+
+        matrices[:, :3, :3] = rotation * scaling[:, None, :]
+        matrices[:, :3, 3] = translation
+        matrices[:, 3, 3] = 1
+        return matrices
+
+
+class BakedClip:
+    """ Clip sampled once at a fixed rate into dense (frames, channels, 4, 4)
+        matrices, so that a pose is an O(1) lookup, optionally blending the
+        two neighboring frames """
+    def __init__(self, frames, rate, blend=True, loop=False):
+        self.frames, self.rate = frames, rate
+        self.blend, self.loop = blend, loop
+        self.size = frames.shape[1]
+        self.duration = (len(frames) - 1) / rate
+
+    @staticmethod
+    def bake(clip, rate):
+        """ dense frames of 'clip' from time 0 to its last key """
+        count = int(np.ceil(clip.duration * rate)) + 1
+        return np.array([clip.sample(i / rate) for i in range(count)],
+                        np.float32).reshape(count, clip.size, 4, 4)
+
+    @classmethod
+    def load(cls, file, clip, rate, blend=True, loop=False):
+        """ baked 'clip' of asset 'file', memory-mapped from a cache file
+            stored next to the asset, baked and saved first if missing """
+        path = cache_file(file, 'bake.npy', 'bake', rate)
+        status = 'cached'
+        if not os.path.exists(path):
+            start = perf_counter()
+            frames = cls.bake(clip, rate)
+            def write(temporary):
+                with open(temporary, 'wb') as output:
+                    np.save(output, frames)
+            replace_atomically(path, write)
+            status = 'baked in %.1f ms' % (1000 * (perf_counter() - start))
+        frames = np.load(path, mmap_mode='r')
+        print('Baked %s\t(%d frames at %g Hz, %d channels, %.1f KiB, %s)' %
+              (file, frames.shape[0], rate, frames.shape[1],
+               frames.nbytes / 1024, status))
+        return cls(frames, rate, blend, loop)
+
+    def sample(self, time):
+        """ (n_channels, 4, 4) local transforms of all channels """
+        last = len(self.frames) - 1
+        position = time * self.rate
+        position = position % last if self.loop and last else \
+            min(max(position, 0), last)
+        if not self.blend:
+            return self.frames[int(round(position))]
+        i = int(position)
+        j, fraction = min(i + 1, last), position - i
+        return self.frames[i] + np.float32(fraction) * \
+            (self.frames[j] - self.frames[i])
+
+
+POSE_CACHE_SIZE = 256  # poses kept per rig when not sized from its clip
+
+
+class PoseCache:
+    """ Local poses of skinned rigs, sampled once per (rig, quantized time)
+        and shared by every instance drawing the same rig. Times are first
+        brought into the rig clip, held past its ends or wrapped if it
+        loops, so that unbounded times keep hitting the same poses. """
+    def __init__(self, step=1/60, size=None):
+        """ time is rounded to multiples of 'step' seconds (None: exact).
+            At most 'size' poses are kept per rig, by default one per step
+            of its clip: instances cycling through it at different phases
+            never evict each other's poses """
+        self.step, self.size = step, size
+        self.poses = {}  # rig -> OrderedDict time -> pose, LRU first
+
+    def capacity(self, rig):
+        """ number of poses kept for 'rig' """
+        clip = getattr(rig, 'clip', None)
+        if self.size is not None or not self.step or clip is None:
+            return self.size or POSE_CACHE_SIZE
+        return int(round(clip.duration / self.step)) + 1
+
+    def pose(self, rig, time):
+        """ (n_channels, 4, 4) local transforms of the animated rig nodes """
+        clip = getattr(rig, 'clip', None)
+        if clip is not None:
+            if getattr(clip, 'loop', False) and clip.duration:
+                time %= clip.duration
+            else:  # clips hold their first and last poses
+                time = min(max(time, 0), clip.duration)
+        if self.step:
+            time = round(time / self.step) * self.step
+        poses = self.poses.get(rig)
+        if poses is None:
+            poses = self.poses[rig] = OrderedDict()
+        pose = poses.get(time)
+        if pose is None:
+            pose = poses[time] = rig.sample(time)
+            if len(poses) > self.capacity(rig):
+                poses.popitem(last=False)
+        else:
+            poses.move_to_end(time)
+        return pose
+
+
+POSE_CACHE = PoseCache()  # default cache, shared by all rig instances
@@ -6,6 +6,7 @@ Python OpenGL dinosaurus : sweet and flying with geysers
 import glfw                         # lean window system wrapper for OpenGL
 from src.transform import rotate, translate, scale
 from src.node import Node
+from src.bounds import Bounds, visible
 from src.cylindre import Cylindre
 from random import random
 import numpy as np
@@ -28,11 +29,75 @@ def arbre(profondeur, cylindre, angle_x=0, angle_z=0):
 
     return tronc
 
-def creer_arbre(hauteur, profondeur, cylindre, position):
-    transform = (translate(position)
+def base_arbre(hauteur, position):
+    """ transform placing a tree of size 'hauteur' at 'position' """
+    return (translate(position)
             @ scale(hauteur)               # taille generale
             @ translate(0, -1, 0))
-    tronc = Node(name='arbre', transform=transform)
+
+def creer_arbre(hauteur, profondeur, cylindre, position):
+    tronc = Node(name='arbre', transform=base_arbre(hauteur, position))
     tronc.add(arbre(profondeur, cylindre))
 
     return tronc
+
+
+# ------------ generation vectorisee d'une foret -----------------------------
+def rotations(axe, angles):
+    """ (n, 4, 4) rotations of 'angles' radians around axis 0 (x) or 1 (y) """
+    cos, sin = np.cos(angles), np.sin(angles)
+    matrices = np.zeros((len(angles), 4, 4))
+    matrices[:, axe, axe] = matrices[:, 3, 3] = 1
+    i, j = (1, 2) if axe == 0 else (2, 0)
+    matrices[:, i, i] = matrices[:, j, j] = cos
+    matrices[:, i, j], matrices[:, j, i] = -sin, sin
+    return matrices
+
+def branches(bases, profondeur, rng):
+    """ (N_branches, 4, 4) transforms of every cylinder of the trees placed
+        by the (n, 4, 4) 'bases', one recursion level of arbre() at a time,
+        with the same random branch count and angles """
+    niveau = bases @ (translate(0, 1, 0) @ scale(.7))  # troncs
+    niveaux = [niveau]
+    for _ in range(profondeur):
+        nb_branches = rng.integers(3, 7, len(niveau))
+        parents = np.repeat(np.arange(len(niveau)), nb_branches)
+        nb = nb_branches[parents]
+        # index of each branch among its parent's branches
+        i = np.arange(len(parents)) - np.repeat(np.cumsum(nb_branches)
+                                                 - nb_branches, nb_branches)
+        angle_z = 6.3 * i / nb + rng.random(len(parents)) * 3.14 / nb
+        angle_x = 0.6 + rng.random(len(parents)) * 0.6
+        niveau = (niveau[parents] @ translate(0, 1, 0) @ rotations(1, angle_z)
+                  @ rotations(0, angle_x) @ scale(.7))
+        niveaux.append(niveau)
+    return np.concatenate(niveaux)
+
+def arbres_aleatoires(nb_arbres, region, hauteurs, rng):
+    """ (nb_arbres, 4, 4) bases of trees of random height in 'hauteurs'
+        (min, max), at random positions of the region ((x1, x2), y, (z1, z2)) """
+    (x1, x2), y, (z1, z2) = region
+    positions = np.column_stack((rng.uniform(x1, x2, nb_arbres),
+                                 np.full(nb_arbres, y),
+                                 rng.uniform(z1, z2, nb_arbres)))
+    return np.array([base_arbre(hauteur, position) for hauteur, position
+                     in zip(rng.uniform(*hauteurs, nb_arbres), positions)])
+
+class Foret:
+    """ Trees drawn as instances of the cylinder mesh, in one draw call per
+        cylinder material. Same 'seed', same forest. """
+    def __init__(self, cylindre, bases, profondeur=2, seed=0):
+        self.transforms = branches(np.asarray(bases), profondeur,
+                                   np.random.default_rng(seed))
+        # cylinder meshes merged in cylinder coordinates, cylindre untouched
+        self.meshes = Node(children=[cylindre]).freeze().children
+        for mesh in self.meshes:
+            mesh.set_instances(self.transforms)
+        self.bounds = Bounds.union([mesh.bounds for mesh in self.meshes])
+        self.bounds = self.bounds and self.bounds.transformed(self.transforms)
+
+    def draw(self, projection, view, model, **param):
+        if not visible(self.bounds, model, **param):
+            return
+        for mesh in self.meshes:
+            mesh.draw_instanced(projection, view, model, **param)
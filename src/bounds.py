@@ -0,0 +1,106 @@
+"""
+Bounding volumes and view frustum culling. Bounds are axis aligned boxes,
+stored as center and half extent, with their enclosing sphere radius.
+"""
+import numpy as np                  # all matrix manipulations & OpenGL args
+
+
+class Bounds:
+    """ axis aligned bounding box, and the sphere around it """
+    def __init__(self, center, extent):
+        self.center = np.asarray(center, np.float64)
+        self.extent = np.asarray(extent, np.float64)  # half sizes, >= 0
+
+    @classmethod
+    def from_points(cls, points):
+        """ bounds of the (n, 3) 'points', None if there are none """
+        points = np.asarray(points, np.float64).reshape(-1, 3)
+        if not len(points):
+            return None
+        lower, upper = points.min(axis=0), points.max(axis=0)
+        return cls((lower + upper) / 2, (upper - lower) / 2)
+
+    @classmethod
+    def union(cls, bounds):
+        """ bounds enclosing all 'bounds', None if one of them is unknown """
+        if not bounds or any(part is None for part in bounds):
+            return None
+        centers = np.array([part.center for part in bounds])
+        extents = np.array([part.extent for part in bounds])
+        lower = (centers - extents).min(axis=0)
+        upper = (centers + extents).max(axis=0)
+        return cls((lower + upper) / 2, (upper - lower) / 2)
+
+    @property
+    def lower(self):
+        return self.center - self.extent
+
+    @property
+    def upper(self):
+        return self.center + self.extent
+
+    @property
+    def radius(self):
+        """ radius of the bounding sphere, around center """
+        return float(np.linalg.norm(self.extent))
+
+    def transformed(self, matrix):
+        """ bounds of our box transformed by 4x4 'matrix', or by each of
+            the (n, 4, 4) matrices at once """
+        matrix = np.asarray(matrix, np.float64)
+        linear = matrix[..., :3, :3]
+        center = linear @ self.center + matrix[..., :3, 3]
+        extent = np.abs(linear) @ self.extent
+        if matrix.ndim == 2:
+            return Bounds(center, extent)
+        lower = (center - extent).min(axis=0)
+        upper = (center + extent).max(axis=0)
+        return Bounds((lower + upper) / 2, (upper - lower) / 2)
+
+    def scaled(self, factor):
+        """ same center, extent multiplied by 'factor' """
+        return Bounds(self.center, self.extent * factor)
+
+
+class Frustum:
+    """ the 6 clipping planes of a projection @ view matrix, in the space
+        that matrix is applied to, normals pointing inside """
+    def __init__(self, matrix):
+        matrix = np.asarray(matrix, np.float64)
+        planes = np.array([matrix[3] + matrix[0], matrix[3] - matrix[0],
+                           matrix[3] + matrix[1], matrix[3] - matrix[1],
+                           matrix[3] + matrix[2], matrix[3] - matrix[2]])
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+        self.normals, self.offsets = self.planes[:, :3], self.planes[:, 3]
+        self.abs_normals = np.abs(self.normals)
+
+    def visible(self, bounds):
+        """ False if 'bounds' is entirely outside of one of our planes """
+        distances = (self.normals @ bounds.center + self.offsets
+                     + self.abs_normals @ bounds.extent)
+        return bool((distances >= 0).all())
+
+
+class CullStats:
+    """ per frame counters of the drawables drawn and culled """
+    def __init__(self):
+        self.drawn, self.culled = 0, 0
+
+    def reset(self):
+        self.drawn, self.culled = 0, 0
+
+    def __repr__(self):
+        return '%d drawn, %d culled' % (self.drawn, self.culled)
+
+
+def visible(bounds, model, frustum=None, cull_stats=None, **_param):
+    """ True unless 'bounds' drawn with 'model' is outside 'frustum', counted
+        in 'cull_stats'. Unknown bounds or frustum are always visible. """
+    seen = (bounds is None or frustum is None
+            or frustum.visible(bounds.transformed(model)))
+    if cull_stats is not None:
+        if seen:
+            cull_stats.drawn += 1
+        else:
+            cull_stats.culled += 1
+    return seen
@@ -0,0 +1,171 @@
+"""
+Bounding volume hierarchy over axis aligned boxes. Building, queries and
+refits are done with numpy, a whole tree level at a time.
+"""
+import numpy as np                  # all matrix manipulations & OpenGL args
+
+
+def ranges(starts, counts):
+    """ concatenation of arange(start, start + count) for all pairs """
+    counts = np.asarray(counts, np.intp)
+    offsets = np.repeat(np.asarray(starts, np.intp) - np.cumsum(counts) + counts,
+                        counts)
+    return offsets + np.arange(counts.sum())
+
+
+def _classify(frustum, lower, upper):
+    """ (outside, inside) booleans of (n, 3) boxes against a Frustum """
+    centers, extents = (lower + upper) / 2, (upper - lower) / 2
+    distances = centers @ frustum.normals.T + frustum.offsets
+    radii = extents @ frustum.abs_normals.T
+    return (distances + radii < 0).any(axis=1), \
+        (distances - radii >= 0).all(axis=1)
+
+
+class BVH:
+    """ Binary tree over the boxes of n items, given by their (n, 3) lower
+        and upper corners, with at most 'leaf_size' items per leaf. Items of
+        a node are contiguous in 'order', nodes are split at the median of
+        the item centers along their widest axis. """
+    def __init__(self, lower, upper, leaf_size=4):
+        self.lower = np.array(lower, np.float64).reshape(-1, 3)
+        self.upper = np.array(upper, np.float64).reshape(-1, 3)
+        centers = (self.lower + self.upper) / 2
+        self.order = np.arange(len(self.lower))
+
+        # nodes: first item in order, item count, first child (-1 if leaf)
+        start, count = np.zeros(1, np.intp), np.full(1, len(self.lower))
+        left = np.full(1, -1)
+        self.levels = []  # node ids of each depth
+        level = np.zeros(1, np.intp)
+        while level.size:
+            self.levels.append(level)
+            split = level[count[level] > leaf_size]
+            if not split.size:
+                break
+            first, size = start[split], count[split]
+            index = ranges(first, size)
+            segment = np.repeat(np.arange(len(split)), size)
+            items = self.order[index]
+            offsets = np.cumsum(size) - size
+            spread = (np.maximum.reduceat(centers[items], offsets)
+                      - np.minimum.reduceat(centers[items], offsets))
+            key = centers[items, np.argmax(spread, axis=1)[segment]]
+            self.order[index] = items[np.lexsort((key, segment))]
+
+            half = size // 2
+            children = len(start) + 2 * np.arange(len(split))
+            left[split] = children
+            start = np.concatenate((start, np.column_stack(
+                (first, first + half)).ravel()))
+            count = np.concatenate((count, np.column_stack(
+                (half, size - half)).ravel()))
+            left = np.concatenate((left, np.full(2 * len(split), -1)))
+            level = np.column_stack((children, children + 1)).ravel()
+        self.start, self.count, self.left = start, count, left
+
+        self.parent = np.full(len(start), -1)
+        internal = np.nonzero(left >= 0)[0]
+        self.parent[left[internal]] = self.parent[left[internal] + 1] = internal
+        self.leaves = np.nonzero(left < 0)[0]
+        self.leaf = np.empty(len(self.lower), np.intp)  # leaf of each item
+        self.leaf[self.order[ranges(start[self.leaves], count[self.leaves])]] \
+            = np.repeat(self.leaves, count[self.leaves])
+
+        self.node_lower = np.full((len(start), 3), np.inf)
+        self.node_upper = np.full((len(start), 3), -np.inf)
+        self.refit()
+
+    def __len__(self):
+        return len(self.lower)
+
+    def _refit_leaves(self, leaves):
+        leaves = leaves[self.count[leaves] > 0]
+        if not leaves.size:
+            return
+        items = self.order[ranges(self.start[leaves], self.count[leaves])]
+        offsets = np.cumsum(self.count[leaves]) - self.count[leaves]
+        self.node_lower[leaves] = np.minimum.reduceat(self.lower[items], offsets)
+        self.node_upper[leaves] = np.maximum.reduceat(self.upper[items], offsets)
+
+    def _refit_nodes(self, nodes):
+        children = self.left[nodes]
+        self.node_lower[nodes] = np.minimum(self.node_lower[children],
+                                            self.node_lower[children + 1])
+        self.node_upper[nodes] = np.maximum(self.node_upper[children],
+                                            self.node_upper[children + 1])
+
+    def refit(self, items=None, lower=None, upper=None):
+        """ give new boxes to 'items' and update the boxes of their
+            ancestors only, or update every node box if items is None """
+        if items is None:
+            self._refit_leaves(self.leaves)
+            for level in reversed(self.levels):
+                self._refit_nodes(level[self.left[level] >= 0])
+            return
+        items = np.asarray(items, np.intp)
+        self.lower[items], self.upper[items] = lower, upper
+        nodes = np.unique(self.leaf[items])
+        self._refit_leaves(nodes)
+        # a node is refitted again each time one of its children changed
+        nodes = np.unique(self.parent[nodes])
+        while nodes.size and nodes[0] < 0:
+            nodes = nodes[1:]
+        while nodes.size:
+            self._refit_nodes(nodes)
+            nodes = np.unique(self.parent[nodes])
+            nodes = nodes[nodes >= 0]
+
+    def query_frustum(self, frustum):
+        """ sorted indices of the items whose box is not outside 'frustum'
+            (see src.bounds.Frustum): whole subtrees inside are accepted
+            without testing their items """
+        found, nodes = [np.zeros(0, np.intp)], np.zeros(min(len(self), 1), np.intp)
+        while nodes.size:
+            outside, inside = _classify(frustum, self.node_lower[nodes],
+                                        self.node_upper[nodes])
+            accepted = nodes[inside]
+            found.append(self.order[ranges(self.start[accepted],
+                                           self.count[accepted])])
+            partial = nodes[~(outside | inside)]
+            leaves = partial[self.left[partial] < 0]
+            items = self.order[ranges(self.start[leaves], self.count[leaves])]
+            outside, _ = _classify(frustum, self.lower[items], self.upper[items])
+            found.append(items[~outside])
+            internal = self.left[partial[self.left[partial] >= 0]]
+            nodes = np.concatenate((internal, internal + 1))
+        return np.sort(np.concatenate(found))
+
+    def ray_cast(self, origin, direction, max_distance=np.inf):
+        """ (item, distance along direction) of the nearest item box hit by
+            the ray, (None, max_distance) if none is """
+        origin = np.asarray(origin, np.float64)
+        with np.errstate(divide='ignore'):
+            inverse = 1 / np.asarray(direction, np.float64)
+
+        def entries(lower, upper):
+            """ distance where the ray enters each box, inf if missed """
+            with np.errstate(invalid='ignore'):
+                near, far = (lower - origin) * inverse, (upper - origin) * inverse
+            enter = np.fmax(np.nanmax(np.fmin(near, far), axis=1), 0)
+            leave = np.nanmin(np.fmax(near, far), axis=1)
+            return np.where(leave >= enter, enter, np.inf)
+
+        def hits(distances):
+            return (distances <= best_distance) & (distances < np.inf)
+
+        best, best_distance = None, max_distance
+        nodes = np.zeros(min(len(self), 1), np.intp)
+        while nodes.size:
+            nodes = nodes[hits(entries(self.node_lower[nodes],
+                                       self.node_upper[nodes]))]
+            leaves = nodes[self.left[nodes] < 0]
+            items = self.order[ranges(self.start[leaves], self.count[leaves])]
+            if items.size:
+                distances = entries(self.lower[items], self.upper[items])
+                nearest = np.argmin(distances)
+                if hits(distances[nearest]):
+                    best, best_distance = int(items[nearest]), float(distances[nearest])
+            internal = self.left[nodes[self.left[nodes] >= 0]]
+            nodes = np.concatenate((internal, internal + 1))
+        return best, best_distance
@@ -0,0 +1,34 @@
+"""
+On-disk caches of data derived from asset files, stored next to the asset
+and keyed by the asset content so that editing the asset invalidates them
+"""
+import hashlib                      # content hash of asset files
+import os                           # os function, i.e. checking file status
+
+
+def file_hash(file, *keys):
+    """ short hex digest of a file content and of any extra cache keys """
+    digest = hashlib.sha1()
+    with open(file, 'rb') as content:
+        for block in iter(lambda: content.read(1 << 20), b''):
+            digest.update(block)
+    for key in keys:
+        digest.update(repr(key).encode())
+    return digest.hexdigest()[:16]
+
+
+def cache_file(file, suffix, *keys):
+    """ cache file name for 'file', next to it, e.g. sol.dae.<hash>.suffix """
+    return '%s.%s.%s' % (file, file_hash(file, *keys), suffix)
+
+
+def replace_atomically(path, write):
+    """ call write(temporary_path), then move the result to 'path', so that
+        concurrent or interrupted runs never see a partial cache file """
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
@@ -0,0 +1,62 @@
+"""
+Time source of the animations and of the render loop, in seconds. Unlike
+glfw.get_time, it does not need GLFW, e.g. when rendering offscreen, and
+it can be replaced by another clock, e.g. a virtual clock for benchmarks
+drawing the same frames at every run.
+"""
+from time import perf_counter
+
+
+class Clock:
+    """ wall clock, seconds since its creation """
+    def __init__(self):
+        self.origin = perf_counter()
+
+    def time(self):
+        return perf_counter() - self.origin
+
+
+class VirtualClock:
+    """ clock only moving when told: set its time 'now' or advance it """
+    def __init__(self, now=0.):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, step):
+        self.now += step
+
+
+class FrameClock:
+    """ time of 'clock' read only by tick(), e.g. once per frame, so that
+        everything of a frame sees the same time """
+    def __init__(self, clock):
+        self.clock = clock
+        self.now = clock.time()
+
+    def time(self):
+        return self.now
+
+    def tick(self):
+        self.now = self.clock.time()
+        return self.now
+
+
+CLOCK = Clock()
+
+
+def get_time():
+    """ current time of the application clock """
+    return CLOCK.time()
+
+
+def get_clock():
+    """ the application clock """
+    return CLOCK
+
+
+def set_clock(clock):
+    """ make 'clock', any object with a time() method, the application clock """
+    global CLOCK
+    CLOCK = clock
@@ -3,28 +3,37 @@
 Python OpenGL dinosaurus : sweet and flying with geysers
 """
 
-import glfw                         # lean window system wrapper for OpenGL
-from src.transform import rotate, translate, scale
+from src.transform import rotate, translate, scale, lerp
+from src.animation import POSE_CACHE
+from src.bounds import visible
+from src.node import bounds_of
 import math
 
 class Dino:
-    """This class should make the dino fly :3 """
-    def __init__(self, node_dino):
+    """This class should make the dino fly :3
+    Advanced by simulate(dt), see src.simulation, and drawn between its two
+    last states by the 'interpolation' fraction of a step. """
+    moving = True  # world_bounds change every frame, see Viewer
+    def __init__(self, node_dino, pose_cache=POSE_CACHE):
         self.node_dino = node_dino
+        self.pose_cache = pose_cache
+        self.bounds = bounds_of(node_dino)
+        self.world_bounds = None  # bounds where last drawn
         self.pos_z = 0
         self.angle = 0
         self.vitesse_z = 0
-        self.offset_animation = glfw.get_time() - 10
-        self.time_offset = glfw.get_time()
+        self.time = 0.  # temps simule, par pas de simulation seulement
+        self.offset_animation = self.time - 10
+        self.previous = self.state()
 
-    def draw(self, projection, view, model, **param):
-        """just draw the node, passing all arguments"""
-        # --- recuperation du temps passe
-        newt = glfw.get_time()
-        dt = newt - self.time_offset
-        self.time_offset = newt
+    def state(self):
+        """ what is interpolated between two steps """
+        return self.time, self.pos_z, self.angle
 
-        # --- actualisation des donnees
+    def simulate(self, dt):
+        """ avance la simulation d'un pas de dt secondes """
+        self.previous = self.state()
+        self.time += dt
         self.vitesse_z -= 98.1 * dt
         self.pos_z += self.vitesse_z * dt
         if self.pos_z < 0:
@@ -33,10 +42,19 @@ class Dino:
         else:
             self.angle += 30 * dt
 
-        transform = rotate(axis=(0,1,0), angle=self.angle) @ translate(0,self.pos_z,0)
+    def draw(self, projection, view, model, interpolation=1., **param):
+        """just draw the node, passing all arguments"""
+        time, pos_z, angle = (lerp(previous, current, interpolation) for
+                              previous, current in zip(self.previous, self.state()))
+        transform = rotate(axis=(0,1,0), angle=angle) @ translate(0,pos_z,0)
         model = model @ transform
-        self.node_dino.draw(projection, view, model,
-                            time=(self.time_offset - self.offset_animation), **param)
+        self.world_bounds = self.bounds and self.bounds.transformed(model)
+        if not visible(self.bounds, model, **param):
+            return
+        time = max(time - self.offset_animation, 0)
+        self.node_dino.draw(projection, view, model, time=time,
+                            pose=self.pose_cache.pose(self.node_dino, time),
+                            bones={}, **param)
 
     def new_geyser(self, charge):
         """ fait voler le dino si il est au sol..."""
@@ -44,12 +62,18 @@ class Dino:
         # en fonction de sa position
         self.vitesse_z += charge / (0.1 * self.pos_z + 1)
         if self.pos_z == 0:
-            self.offset_animation = glfw.get_time()
+            self.offset_animation = self.time
 
 class Ptero:
-    """This class should make the ptero fly :3 """
-    def __init__(self, node_dino, angle=0, distance=40, hauteur=20, taille=1, decalage=0, sens=0):
+    """This class should make the ptero fly :3
+    Simulated and drawn like Dino """
+    moving = True  # world_bounds change every frame, see Viewer
+    def __init__(self, node_dino, angle=0, distance=40, hauteur=20, taille=1, decalage=0, sens=0,
+                 pose_cache=POSE_CACHE):
         self.node_dino = node_dino
+        self.pose_cache = pose_cache
+        self.bounds = bounds_of(node_dino)
+        self.world_bounds = None  # bounds where last drawn
         self.angle = angle
         self.distance = distance
         self.hauteur = hauteur
@@ -57,23 +81,34 @@ class Ptero:
         self.taille = taille
         self.decalage = decalage
         self.sens = sens
-        self.time_offset = glfw.get_time()
+        self.time = 0.  # temps simule, par pas de simulation seulement
+        self.previous = self.state()
 
-    def draw(self, projection, view, model, **param):
-        """just draw the node, passing all arguments"""
-        # --- recuperation du temps passe
-        newt = glfw.get_time()
-        dt = newt - self.time_offset
-        self.time_offset = newt
+    def state(self):
+        """ what is interpolated between two steps """
+        return self.time, self.angle
 
-        # --- actualisation des donnees
+    def simulate(self, dt):
+        """ avance la simulation d'un pas de dt secondes """
+        self.previous = self.state()
+        self.time += dt
         self.angle += self.vitesse * dt
-        time_in_animation = (self.time_offset * (1+1/self.taille) + self.decalage)%5
+
+    def draw(self, projection, view, model, interpolation=1., **param):
+        """just draw the node, passing all arguments"""
+        time, angle = (lerp(previous, current, interpolation) for
+                       previous, current in zip(self.previous, self.state()))
+        time_in_animation = (time * (1+1/self.taille) + self.decalage)%5
         real_height = self.hauteur + 7*self.taille*math.cos(-0.5+time_in_animation * 2*3.1415/5)
         #(3 - time_in_animation)
         #* (1 - 5/2 * (time_in_animation >= 3))*3
 
-        transform = rotate(axis=(0,1,0), angle=self.angle* math.cos(180*self.sens)) @ translate(self.distance,real_height,0) @ scale(self.taille) @ rotate(axis=(0,1,0), angle=180*self.sens)
+        transform = rotate(axis=(0,1,0), angle=angle* math.cos(180*self.sens)) @ translate(self.distance,real_height,0) @ scale(self.taille) @ rotate(axis=(0,1,0), angle=180*self.sens)
         model = model @ transform
-        self.node_dino.draw(projection, view, model,
-                            time=time_in_animation, **param)
+        self.world_bounds = self.bounds and self.bounds.transformed(model)
+        if not visible(self.bounds, model, **param):
+            return
+        self.node_dino.draw(projection, view, model, time=time_in_animation,
+                            pose=self.pose_cache.pose(self.node_dino,
+                                                      time_in_animation),
+                            bones={}, **param)
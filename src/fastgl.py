@@ -0,0 +1,67 @@
+"""
+Fast dispatch of the GL calls made for every draw: uniform uploads and
+draw commands go straight to the GL library through ctypes function
+pointers bound once, without PyOpenGL's argument conversion and its
+glGetError check after each call. Bindings, whose arguments are only
+integers, cost PyOpenGL about as little, see benchmarks/bench_fastgl.py.
+Arguments must already have their final types: uniform values as the
+bytes of float32 or int32 arrays, as Shader.set makes them, index offsets
+None.
+GL errors then go unnoticed: disable(), or main.py --checked-gl, gives
+back PyOpenGL's checked functions to debug.
+"""
+import ctypes
+import sys
+
+from OpenGL import platform         # the GL library PyOpenGL loaded
+from src.gl import GL
+
+_ENUM, _INT, _BOOL = ctypes.c_uint, ctypes.c_int, ctypes.c_ubyte
+_BYTES = ctypes.c_char_p  # passed without copy, see Shader.set
+# GL entry points use the stdcall convention on Windows
+_FUNCTYPE = ctypes.WINFUNCTYPE if sys.platform == 'win32' else ctypes.CFUNCTYPE
+
+# argument types of the functions dispatched fast, see the GL headers
+SIGNATURES = {
+    'glUniform1fv': (_INT, _INT, _BYTES),
+    'glUniform2fv': (_INT, _INT, _BYTES),
+    'glUniform3fv': (_INT, _INT, _BYTES),
+    'glUniform4fv': (_INT, _INT, _BYTES),
+    'glUniform1iv': (_INT, _INT, _BYTES),
+    'glUniformMatrix3fv': (_INT, _INT, _BOOL, _BYTES),
+    'glUniformMatrix4fv': (_INT, _INT, _BOOL, _BYTES),
+    'glDrawArrays': (_ENUM, _INT, _INT),
+    'glDrawArraysInstanced': (_ENUM, _INT, _INT, _INT),
+    'glDrawElements': (_ENUM, _INT, _ENUM, ctypes.c_void_p),
+    'glDrawElementsInstanced': (_ENUM, _INT, _ENUM, ctypes.c_void_p, _INT),
+}
+
+
+def entry_point(name, argtypes):
+    """ ctypes function 'name' of the GL library, or from the platform
+        procedure lookup if the library does not export it """
+    try:
+        function = platform.PLATFORM.GL[name]  # new pointer, not PyOpenGL's
+    except AttributeError:
+        address = platform.PLATFORM.getExtensionProcedure(name.encode())
+        if not address:
+            raise
+        function = _FUNCTYPE(None, *argtypes)(address)
+    function.argtypes, function.restype = argtypes, None
+    return function
+
+
+def entry_points():
+    """ {name: ctypes function} of all the fast dispatched functions """
+    return {name: entry_point(name, argtypes)
+            for name, argtypes in SIGNATURES.items()}
+
+
+def enable():
+    """ dispatch the hot GL functions fast, from their next lookup on """
+    GL._replace(entry_points())
+
+
+def disable():
+    """ back to PyOpenGL's checked functions """
+    GL._replace({})
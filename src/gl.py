@@ -0,0 +1,107 @@
+"""
+OpenGL.GL as used by our modules, through a proxy that can count the GL
+calls made per function and per frame, and record the calls of a chosen
+frame. Counting is off by default, and the proxy then hands out PyOpenGL's
+own functions: after their first lookup, GL.glFoo costs what it costs on
+the OpenGL.GL module. Some functions may be replaced, see src.fastgl.
+"""
+from collections import Counter, deque
+
+import numpy as np                  # arrays are summarized in traces
+import OpenGL.GL as _GL             # standard Python OpenGL wrapper
+
+
+class GLProxy:
+    """ attributes of 'module', or of the '_replaced' functions, cached
+        at their first lookup, functions wrapped to count their calls while
+        GL_CALLS is enabled """
+    def __init__(self, module):
+        object.__setattr__(self, '_module', module)
+        object.__setattr__(self, '_replaced', {})
+
+    def __getattr__(self, name):  # only for names not cached yet
+        value = self._replaced.get(name) or getattr(self._module, name)
+        if GL_CALLS.enabled and name.startswith('gl') and callable(value):
+            value = GL_CALLS.counted(name, value)
+        object.__setattr__(self, name, value)
+        return value
+
+    def _uncache(self):
+        """ forget cached attributes, to wrap or unwrap functions again """
+        module, replaced = self._module, self._replaced
+        self.__dict__.clear()
+        object.__setattr__(self, '_module', module)
+        object.__setattr__(self, '_replaced', replaced)
+
+    def _replace(self, functions):
+        """ use 'functions' {name: function} instead of the module's """
+        object.__setattr__(self, '_replaced', dict(functions))
+        self._uncache()
+
+
+def summarized(argument):
+    """ short text for a traced call argument """
+    if isinstance(argument, np.ndarray):
+        return '%s%s' % (argument.dtype, list(argument.shape))
+    text = repr(argument)
+    return text if len(text) <= 40 else text[:37] + '...'
+
+
+class GLCallCounter:
+    """ GL calls per function of the last 'max_frames' frames, and the
+        calls, with their arguments, of frame 'trace_frame' if not None """
+    def __init__(self, max_frames=1000):
+        self.enabled = False
+        self.calls = Counter()  # of the current frame
+        self.frames = deque(maxlen=max_frames)
+        self.frame = None       # number of the current frame
+        self.trace_frame, self.trace = None, []
+
+    def enable(self, trace_frame=None):
+        self.enabled, self.trace_frame, self.trace = True, trace_frame, []
+        GL._uncache()
+
+    def disable(self):
+        self.enabled = False
+        GL._uncache()
+
+    def counted(self, name, function):
+        """ 'function' counting its calls """
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            if self.frame is not None and self.frame == self.trace_frame:
+                self.trace.append('%s(%s)' % (name, ', '.join(
+                    summarized(argument) for argument in args)))
+            return function(*args, **kwargs)
+        return call
+
+    def begin_frame(self, frame):
+        if self.enabled:
+            self.calls.clear()
+            self.frame = frame
+
+    def end_frame(self):
+        if self.enabled and self.frame is not None:
+            self.frames.append(Counter(self.calls))
+            self.frame = None
+
+    def per_frame(self):
+        """ {function: mean calls per frame}, most called first """
+        if not self.frames:
+            return {}
+        total = sum(self.frames, Counter())
+        return {name: count / len(self.frames) for name, count in total.most_common()}
+
+    def summary(self):
+        """ table of the mean and max calls per frame of each function """
+        per_frame = self.per_frame()
+        lines = ['%d frames, %.1f GL calls per frame' % (
+            len(self.frames), sum(per_frame.values()))]
+        lines += ['%-32s %10.1f %8d' % (name, mean,
+                                        max(calls[name] for calls in self.frames))
+                  for name, mean in per_frame.items()]
+        return '\n'.join(lines)
+
+
+GL_CALLS = GLCallCounter()  # the counter of the application, disabled
+GL = GLProxy(_GL)
@@ -0,0 +1,92 @@
+"""
+Shadow of the OpenGL state this application changes: capabilities, depth
+mask, blend function, program, textures and vertex array bindings. Calls
+setting a state to its current value are dropped before reaching PyOpenGL.
+"""
+from src.gl import GL               # OpenGL.GL, see src.gl
+
+
+class GLState:
+    """ Current GL state as last set through us. Code changing the same
+        state directly must call reset(), code deleting objects calls
+        deleted() so that a reused name is bound again. """
+    def __init__(self):
+        self.calls, self.skipped = 0, 0  # GL calls made and dropped
+        self.reset()
+
+    def reset(self):
+        """ forget the shadowed state, e.g. for a new context """
+        self.capabilities = {}  # capability -> enabled
+        self.depth_write = None
+        self.blend_function = None
+        self.program = None
+        self.active_unit = None
+        self.textures = {}      # (texture unit, target) -> bound texture
+        self.vertex_array = None
+
+    def __repr__(self):
+        return '%d calls made, %d redundant calls dropped' % (self.calls,
+                                                              self.skipped)
+
+    def _changed(self, changed):
+        """ count a call, made if 'changed' """
+        if changed:
+            self.calls += 1
+        else:
+            self.skipped += 1
+        return changed
+
+    def enable(self, capability, enabled=True):
+        """ glEnable or glDisable 'capability' """
+        if self._changed(self.capabilities.get(capability) != enabled):
+            self.capabilities[capability] = enabled
+            (GL.glEnable if enabled else GL.glDisable)(capability)
+
+    def disable(self, capability):
+        self.enable(capability, False)
+
+    def depth_mask(self, write):
+        if self._changed(self.depth_write != write):
+            self.depth_write = write
+            GL.glDepthMask(GL.GL_TRUE if write else GL.GL_FALSE)
+
+    def blend_func(self, source, destination):
+        if self._changed(self.blend_function != (source, destination)):
+            self.blend_function = (source, destination)
+            GL.glBlendFunc(source, destination)
+
+    def use_program(self, glid):
+        if self._changed(self.program != glid):
+            self.program = glid
+            GL.glUseProgram(glid)
+
+    def active_texture(self, unit):
+        if self._changed(self.active_unit != unit):
+            self.active_unit = unit
+            GL.glActiveTexture(unit)
+
+    def bind_texture(self, glid, target=GL.GL_TEXTURE_2D):
+        """ bind texture 'glid' to the active texture unit """
+        key = (self.active_unit, target)
+        if self._changed(self.active_unit is None
+                         or self.textures.get(key) != glid):
+            self.textures[key] = glid
+            GL.glBindTexture(target, glid)
+
+    def bind_vertex_array(self, glid):
+        if self._changed(self.vertex_array != glid):
+            self.vertex_array = glid
+            GL.glBindVertexArray(glid)
+
+    def deleted(self, program=None, texture=None, vertex_array=None):
+        """ GL unbinds deleted objects: their bindings become unknown """
+        if program is not None and self.program == program:
+            self.program = None
+        if texture is not None:
+            self.textures = {key: glid for key, glid in self.textures.items()
+                             if glid != texture}
+        if vertex_array is not None and self.vertex_array == vertex_array:
+            self.vertex_array = None
+
+
+STATE = GLState()  # the state of the single GL context of the application
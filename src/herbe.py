@@ -5,7 +5,9 @@ Python OpenGL dinosaurus : sweet and flying with geysers
 
 from src.transform import rotate, translate, scale
 from src.node import Node
+from src.bounds import Bounds, visible
 from src.cylindre import Plan
+import numpy as np
 
 def herbe(plan, angle_z=0, ind=3):
     transform = (rotate(axis=(0, 0, 1), angle=(angle_z)))
@@ -21,3 +23,40 @@ def creer_herbe(plan, taille, position, angle_z=0):
     baseH = Node(name='arbre', transform=transform)
     baseH.add(herbe(plan))
     return baseH
+
+
+class GrassField:
+    """ Grass tufts scattered over the region ((x1, x2), y, (z1, z2)) with
+        'densite' tufts per square unit, drawn in one instanced call per
+        tuft material. y is a height, or a function of the (x, z) arrays
+        giving the ground height. Same seed, same field. """
+    def __init__(self, plan, region, densite, tailles=(10, 15), seed=0):
+        (x1, x2), y, (z1, z2) = region
+        rng = np.random.default_rng(seed)
+        nombre = int(densite * abs(x2 - x1) * abs(z2 - z1))
+        x, z = rng.uniform(x1, x2, nombre), rng.uniform(z1, z2, nombre)
+        y = y(x, z) if callable(y) else np.full(nombre, y)
+        # rows of position, angle around y and size, as creer_herbe
+        self.placements = np.column_stack((
+            x, y, z, rng.uniform(0, 2 * np.pi, nombre),
+            rng.uniform(*tailles, nombre)))
+
+        # tuft planes merged in tuft coordinates, plan untouched
+        self.meshes = Node(children=[herbe(plan)]).freeze().children
+        for mesh in self.meshes:
+            mesh.set_placements(self.placements)
+
+        # tufts are rotated around their origin: spheres of the tuft radius
+        tuft = Bounds.union([mesh.bounds for mesh in self.meshes])
+        self.bounds = None
+        if tuft is not None and nombre:
+            radius = np.linalg.norm(np.abs(tuft.center) + tuft.extent)
+            reach = radius * self.placements[:, 4:5]
+            self.bounds = Bounds.from_points(np.concatenate((
+                self.placements[:, :3] - reach, self.placements[:, :3] + reach)))
+
+    def draw(self, projection, view, model, **param):
+        if not visible(self.bounds, model, **param):
+            return
+        for mesh in self.meshes:
+            mesh.draw_instanced(projection, view, model, **param)
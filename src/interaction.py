@@ -6,8 +6,11 @@ class GLFWTrackball(Trackball):
     """ Use in Viewer for interactive viewpoint control """
 
     def __init__(self, win, bornes_zoom=(25, 190.),
-                 bornes_rotate=(0.5, 1)):
-        """ Init needs a GLFW window handler 'win' to register callbacks """
+                 bornes_rotate=(0.5, 1), on_pick=None):
+        """ Init needs a GLFW window handler 'win' to register callbacks,
+            None for a viewer without window.
+            'on_pick(origin, direction)' is called with the view ray under
+            the mouse on right click. """
         super().__init__()
 
         self.angle_z = bornes_rotate[0]
@@ -16,21 +19,41 @@ class GLFWTrackball(Trackball):
         self.bornes_zoom = bornes_zoom
         self.bornes_rotate = bornes_rotate
         self.mouse = (0, 0)
-        glfw.set_cursor_pos_callback(win, self.on_mouse_move)
-        glfw.set_scroll_callback(win, self.on_scroll)
+        self.on_pick = on_pick
+        if win is not None:
+            glfw.set_cursor_pos_callback(win, self.on_mouse_move)
+            glfw.set_scroll_callback(win, self.on_scroll)
+            glfw.set_mouse_button_callback(win, self.on_mouse_button)
 
     def on_mouse_move(self, win, xpos, ypos):
         """ Rotate on left-click & drag, pan on right-click & drag """
+        self.moved(xpos, ypos, glfw.get_window_size(win),
+                   glfw.get_mouse_button(win, glfw.MOUSE_BUTTON_LEFT))
+
+    def on_mouse_button(self, win, button, action, _mods):
+        """ Right click picks the object under the mouse """
+        if button == glfw.MOUSE_BUTTON_RIGHT and action == glfw.PRESS:
+            self.clicked(*glfw.get_cursor_pos(win), glfw.get_window_size(win))
+
+    def on_scroll(self, win, _deltax, deltay):
+        """ Scroll controls the camera distance to trackball center """
+        self.scrolled(deltay, glfw.get_window_size(win))
+
+    # events with the window state they need, see src.replay
+    def moved(self, xpos, ypos, winsize, dragging):
         old = self.mouse
-        self.mouse = (xpos, glfw.get_window_size(win)[1] - ypos)
-        if glfw.get_mouse_button(win, glfw.MOUSE_BUTTON_LEFT):
-            self.drag(old, self.mouse, glfw.get_window_size(win))
+        self.mouse = (xpos, winsize[1] - ypos)
+        if dragging:
+            self.drag(old, self.mouse, winsize)
             self.angle_z = min(max(self.bornes_rotate[0],
                                    self.angle_z), self.bornes_rotate[1])
 
-    def on_scroll(self, win, _deltax, deltay):
-        """ Scroll controls the camera distance to trackball center """
-        self.zoom(deltay, glfw.get_window_size(win)[1])
+    def clicked(self, xpos, ypos, winsize):
+        if self.on_pick is not None:
+            self.on_pick(*self.ray((xpos, winsize[1] - ypos), winsize))
+
+    def scrolled(self, deltay, winsize):
+        self.zoom(deltay, winsize[1])
         if self.bornes_zoom[0] > self.distance:
             self.distance = self.bornes_zoom[0]
         elif self.bornes_zoom[1] < self.distance:
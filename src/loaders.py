@@ -1,28 +1,81 @@
 import numpy as np
 import os
-import pyassimp
-import pyassimp.errors
-from src.texture import Texture
+from src.texture import TEXTURES
 from src.meshes import TexturedMesh, \
     PhongMesh, SkinnedMesh, SkyBoxMesh, ParticleMesh, ColorMesh, ArbreMesh, HerbeMesh
 from src.node import SkinningControlNode, Node
+from src.animation import AnimationClip, BakedClip
+from src.scene_cache import load_scene
 from src.shader import MAX_BONES, MAX_VERTEX_BONES
+from src.bounds import Bounds
+from src.lod import LODNode, LOD_SCREEN_SIZES, simplified
 
 
 # -------------- 3D resource loader -------------------------------------------
-def load_skinned(file, axe):
-    """load resources from file using pyassimp, return node hierarchy """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+def with_lods(file, index, mesh, make, lods=0, screen_sizes=LOD_SCREEN_SIZES):
+    """ make(vertices, faces, source) mesh of the assimp 'index'th 'mesh'
+        of 'file', other vertex attributes being indexed by source. With
+        'lods', also made for up to 'lods' simplifications of it, all in a
+        LODNode. """
+    full = make(mesh.vertices, mesh.faces, slice(None))
+    if not lods:
+        return full
+    levels = simplified(file, index, mesh.vertices, mesh.faces, lods)
+    return LODNode([full] + [make(*level) for level in levels], screen_sizes)
+
+
+def release_materials(scene):
+    """ the meshes made hold the material textures they use, not the scene,
+        which may be cached: textures no mesh uses can then be evicted """
+    for mat in scene.materials:
+        TEXTURES.release(getattr(mat, 'texture', None))
+        mat.texture = None
+
+
+def vertex_bones(nb_vertices, bones):
+    """ ids and weights of the MAX_VERTEX_BONES most influential bones of each
+        vertex, as two (nb_vertices, MAX_VERTEX_BONES) arrays, computed from
+        the per bone vertexids / weights arrays without any dense table """
+    bones = bones[:MAX_BONES]
+    vertex = np.concatenate([np.zeros(0, np.int64)] +
+                            [bone.vertexids for bone in bones])
+    weight = np.concatenate([np.zeros(0, np.float32)] +
+                            [bone.weights for bone in bones])
+    bone_id = np.repeat(np.arange(len(bones)),
+                        [len(bone.vertexids) for bone in bones])
+
+    # (vertex, bone, weight) triplets grouped by vertex, high weights first
+    order = np.lexsort((-weight, vertex))
+    vertex = vertex[order]
+    weight, bone_id = weight[order], bone_id[order]
+
+    # rank of each triplet in its vertex group, keep the first ones only
+    rank = np.arange(len(vertex)) - np.searchsorted(vertex, vertex)
+    keep = rank < MAX_VERTEX_BONES
+    vertex, rank = vertex[keep], rank[keep]
+
+    ids = np.zeros((nb_vertices, MAX_VERTEX_BONES), np.uint32)
+    weights = np.zeros((nb_vertices, MAX_VERTEX_BONES), np.float32)
+    ids[vertex, rank] = bone_id[keep]
+    weights[vertex, rank] = weight[keep]
+    return ids, weights
+
+
+def load_skinned(file, axe, bake_rate=None, blend=True, lods=0,
+                 screen_sizes=LOD_SCREEN_SIZES):
+    """load resources from file using pyassimp, return node hierarchy.
+    With a 'bake_rate', the animation is baked at this rate (cached on disk
+    next to the file) and poses are looked up, 'blend'ing nearby frames.
+    With 'lods', meshes get simplified levels of detail, see with_lods """
+    scene = load_scene(file)
+    if scene is None:
         return []
 
     # ----- load animations
     def conv(assimp_keys, ticks_per_second):
-        """ Conversion from assimp key struct to our dict representation """
-        return {key.time / ticks_per_second: key.value for key in assimp_keys}
+        """ Conversion from cached key arrays to our dict representation """
+        return dict(zip(assimp_keys.times / ticks_per_second,
+                        assimp_keys.values))
 
     # load first animation in scene file (could be a loop over all animations)
     transform_keyframes = {}
@@ -30,8 +83,7 @@ def load_skinned(file, axe):
         anim = scene.animations[0]
         for channel in anim.channels:
             # for each animation bone, store trs dict with {times: transforms}
-            # (pyassimp name storage bug, bytes instead of str => convert it)
-            transform_keyframes[channel.nodename.data.decode('utf-8')] = (
+            transform_keyframes[channel.nodename] = (
                 conv(channel.positionkeys, anim.tickspersecond),
                 conv(channel.rotationkeys, anim.tickspersecond),
                 conv(channel.scalingkeys, anim.tickspersecond)
@@ -42,33 +94,34 @@ def load_skinned(file, axe):
     # node creation needs to happen first as SkinnedMeshes store an array of
     # these nodes that represent their bone transforms
     nodes = {}  # nodes: string name -> node dictionary
+    channels = []  # keyframes of animated nodes, packed in the rig clip
 
     def make_nodes(pyassimp_node):
         """ Recursively builds nodes for our graph, matching pyassimp nodes """
-        trs_keyframes = transform_keyframes.get(pyassimp_node.name, (None,))
-        node = SkinningControlNode(*trs_keyframes, name=pyassimp_node.name,
+        node = SkinningControlNode(None, name=pyassimp_node.name,
                                    transform=pyassimp_node.transformation)
+        if pyassimp_node.name in transform_keyframes:
+            node.channel = len(channels)
+            channels.append(transform_keyframes[pyassimp_node.name])
         nodes[pyassimp_node.name] = node, pyassimp_node
         node.add(*(make_nodes(child) for child in pyassimp_node.children))
         return node
 
     root_node = make_nodes(scene.rootnode)
+    # all animated nodes of the rig are sampled together from one clip
+    root_node.clip = AnimationClip(channels)
+    if bake_rate and channels:
+        root_node.clip = BakedClip.load(file, root_node.clip, bake_rate, blend)
 
     for mat in scene.materials:
-        mat.texture = Texture(mat.properties[("file", 1)])
+        mat.texture = TEXTURES.acquire(mat.properties[("file", 1)])
 
     # ---- create SkinnedMesh objects
-    for mesh in scene.meshes:
+    for index, mesh in enumerate(scene.meshes):
         # -- skinned mesh: weights given per bone => convert per vertex for GPU
-        # first, populate an array with MAX_BONES entries per vertex
-        v_bone = np.array([[(0, 0)]*MAX_BONES] * mesh.vertices.shape[0],
-                          dtype=[('weight', 'f4'), ('id', 'u4')])
-        for bone_id, bone in enumerate(mesh.bones[:MAX_BONES]):
-            for entry in bone.weights:  # weight,id pairs necessary for sorting
-                v_bone[entry.vertexid][bone_id] = (entry.weight, bone_id)
-
-        v_bone.sort(order='weight')             # sort rows, high weights last
-        v_bone = v_bone[:, -MAX_VERTEX_BONES:]  # limit bone size, keep highest
+        # keeping the MAX_VERTEX_BONES highest weights of each vertex
+        bone_ids, bone_weights = vertex_bones(mesh.vertices.shape[0],
+                                              mesh.bones)
 
         # prepare bone lookup array & offset matrix, indexed by bone index (id)
         bone_nodes = [nodes[bone.name][0] for bone in mesh.bones]
@@ -80,33 +133,37 @@ def load_skinned(file, axe):
         # initialize skinned mesh and store in pyassimp_mesh for node addition
         if len(bone_nodes) == 0:
             #  not skinned
-            mesh.skinned_mesh = PhongMesh(texture,
-                    [mesh.vertices, mesh.normals], mesh.faces, 30.0)
+            def make(vertices, faces, source):
+                return PhongMesh(texture, [vertices, mesh.normals[source]],
+                                 faces, 30.0)
         else:
-            mesh.skinned_mesh = SkinnedMesh( axe,
-                [mesh.vertices, mesh.normals,
-                    v_bone['id'], v_bone['weight']],
-                bone_nodes, bone_offsets, texture, mesh.faces)
+            def make(vertices, faces, source):
+                skinned_mesh = SkinnedMesh( axe,
+                    [vertices, mesh.normals[source], bone_ids[source],
+                     bone_weights[source]],
+                    bone_nodes, bone_offsets, texture, faces)
+                # bind pose bounds, rig model coordinates
+                skinned_mesh.bounds = Bounds.from_points(vertices)
+                return skinned_mesh
+        mesh.skinned_mesh = with_lods(file, index, mesh, make, lods,
+                                      screen_sizes)
 
     # ------ add each mesh to its intended nodes as indicated by assimp
     for final_node, assimp_node in nodes.values():
         final_node.add(*(_mesh.skinned_mesh for _mesh in assimp_node.meshes))
+    release_materials(scene)
 
     nb_triangles = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded', file, '\t(%d meshes, %d faces, %d nodes, %d animations)' %
           (len(scene.meshes), nb_triangles, len(nodes), len(scene.animations)))
-    pyassimp.release(scene)
     return [root_node]
 
 
 # -------------- 3D textured mesh loader ------------------------------------
 def load_for_particle(file):
     """ load resources using pyassimp, return list of TexturedMeshes """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+    scene = load_scene(file)
+    if scene is None:
         return []  # error reading => return empty list
 
     # Note: embedded textures not supported at the moment
@@ -114,14 +171,12 @@ def load_for_particle(file):
     for mat in scene.materials:
         mat.tokens = dict(reversed(list(mat.properties.items())))
         if 'file' in mat.tokens:  # texture file token
-            tname = mat.tokens['file'].split('/')[-1].split('\\')[-1]
             # search texture in file's whole subdir since path often screwed up
-            tname = [os.path.join(d[0], f) for d in os.walk(path) for f in d[2]
-                     if tname.startswith(f) or f.startswith(tname)]
+            tname = TEXTURES.find(mat.tokens['file'], path)
             if tname:
-                mat.texture = Texture(tname[0])
+                mat.texture = TEXTURES.acquire(tname)
             else:
-                print('Failed to find texture:', tname)
+                print('Failed to find texture:', mat.tokens['file'])
 
     # prepare textured mesh
     meshes = []
@@ -133,11 +188,11 @@ def load_for_particle(file):
         # create the textured mesh object from texture, attributes, and indices
         meshes.append(ParticleMesh([mesh.vertices, mesh.normals, tex_uv],
                                    mesh.faces))
+    release_materials(scene)
 
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
 
-    pyassimp.release(scene)
     return meshes
 
 
@@ -146,16 +201,13 @@ def load_for_particle(file):
 # -------------- 3D textured mesh loader ---------------------------------------
 def load_textured(file):
     """ load resources using pyassimp, return list of TexturedMeshes """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+    scene = load_scene(file)
+    if scene is None:
         return []  # error reading => return empty list
 
     # Note: embedded textures not supported at the moment
     for mat in scene.materials:
-        mat.texture = Texture(mat.properties[("file", 1)])
+        mat.texture = TEXTURES.acquire(mat.properties[("file", 1)])
 
     # prepare textured mesh
     meshes = []
@@ -168,23 +220,22 @@ def load_textured(file):
 
         # create the textured mesh object from texture, attributes, and indices
         meshes.append(TexturedMesh(texture, [mesh.vertices, tex_uv], mesh.faces))
+        meshes[-1].bounds = Bounds.from_points(mesh.vertices)
+    release_materials(scene)
 
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
 
-    pyassimp.release(scene)
     return meshes
 
 
 
-def load_with_hierarchy(file, objet=0):
-    """ load resources from file using pyassimp, return list of ColorMesh """
+def load_with_hierarchy(file, objet=0, lods=0, screen_sizes=LOD_SCREEN_SIZES):
+    """ load resources from file using pyassimp, return list of ColorMesh.
+        With 'lods', meshes get simplified levels of detail, see with_lods """
     nodes = {}  # nodes: string name -> node dictionary
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+    scene = load_scene(file)
+    if scene is None:
         return []     # error reading => return empty list
 
     def make_nodes(pyassimp_node):
@@ -199,58 +250,46 @@ def load_with_hierarchy(file, objet=0):
 
 
     for mat in scene.materials:
-        mat.texture = Texture(mat.properties[("file", 1)])
+        mat.texture = TEXTURES.acquire(mat.properties[("file", 1)])
 
 
     # ---- create ColorMesh objects
     if objet==0:
-        for mesh in scene.meshes:
-            # prepare textured mesh
-            texture = scene.materials[mesh.materialindex].texture
-
-            # create the textured mesh object from texture, attributes, and indices
-            mesh.loaded_mesh = PhongMesh(texture, [mesh.vertices, mesh.normals],
-                                        mesh.faces, 300.0)
+        mesh_class, facteur = PhongMesh, 300.0
     elif objet==1: # Arbre
-        for mesh in scene.meshes:
-            # prepare textured mesh
-            texture = scene.materials[mesh.materialindex].texture
-
-            # create the textured mesh object from texture, attributes, and indices
-            mesh.loaded_mesh = ArbreMesh(texture, [mesh.vertices, mesh.normals],
-                                        mesh.faces, 5.0)
+        mesh_class, facteur = ArbreMesh, 5.0
     else: # Herbe
-        for mesh in scene.meshes:
-            # prepare textured mesh
-            texture = scene.materials[mesh.materialindex].texture
+        mesh_class, facteur = HerbeMesh, 100.0
+    for index, mesh in enumerate(scene.meshes):
+        # prepare textured mesh
+        texture = scene.materials[mesh.materialindex].texture
 
-            # create the textured mesh object from texture, attributes, and indices
-            mesh.loaded_mesh = HerbeMesh(texture, [mesh.vertices, mesh.normals],
-                                        mesh.faces, 100.0)
+        # create the textured mesh object from texture, attributes, and indices
+        def make(vertices, faces, source):
+            return mesh_class(texture, [vertices, mesh.normals[source]],
+                              faces, facteur)
+        mesh.loaded_mesh = with_lods(file, index, mesh, make, lods, screen_sizes)
 
 
     for final_node, assimp_node in nodes.values():
         final_node.add(*(_mesh.loaded_mesh for _mesh in assimp_node.meshes))
+    release_materials(scene)
 
     nb_triangles = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded', file, '\t(%d meshes, %d faces, %d nodes, %d animations)' %
           (len(scene.meshes), nb_triangles, len(nodes), len(scene.animations)))
-    pyassimp.release(scene)
     return [root_node]
 
 def load_skybox(sphere, ma_texture):
     """ load skybox 'sphere' with sky texture 'texture' """
 
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(sphere, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', sphere)
+    scene = load_scene(sphere)
+    if scene is None:
         return []  # error reading => return empty list
 
     # Ajout de la texture
     for mat in scene.materials:
-        mat.texture = Texture(ma_texture)
+        mat.texture = TEXTURES.acquire(ma_texture)
 
 
     # prepare textured mesh
@@ -259,26 +298,22 @@ def load_skybox(sphere, ma_texture):
         texture = scene.materials[mesh.materialindex].texture
         # create the textured mesh object from texture, attributes, and indices
         meshes.append(SkyBoxMesh(texture, [mesh.vertices], mesh.faces))
+    release_materials(scene)
 
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (sphere, len(scene.meshes), size))
 
-    pyassimp.release(scene)
     return meshes[0]
 
 
 
 def load(file):
     """ load resources from file using pyassimp, return list of ColorMesh """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+    scene = load_scene(file)
+    if scene is None:
         return []  # error reading => return empty list
 
     meshes = [ColorMesh([m.vertices, m.normals], m.faces) for m in scene.meshes]
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
-    pyassimp.release(scene)
     return meshes
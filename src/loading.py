@@ -0,0 +1,114 @@
+"""
+Startup asset loading. Scene parsing and image decoding run in a pool of
+worker threads, while the OpenGL part of each asset (VertexArray, Texture
+uploads, scene graph) runs on the main thread a few assets per frame, so
+that the viewer can show a loading screen meanwhile.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter       # startup timeline
+
+from src.scene_cache import load_scene
+from src.texture import TEXTURES
+
+
+def prefetch_scene(file):
+    """ worker side of a scene: parsed scene and decoded material textures """
+    scene = load_scene(file)
+    for mat in scene.materials if scene is not None else []:
+        try:
+            TEXTURES.prefetch(mat.properties[("file", 1)])
+        except KeyError:  # material without texture file
+            pass
+    return scene
+
+
+class Asset:
+    """ one startup asset, with its worker and main thread timings """
+    def __init__(self, name, finish):
+        self.name = name
+        self.finish = finish
+        self.future = None
+        self.prefetch = [None, None]  # worker start, end
+        self.upload = [None, None]    # main thread start, end
+
+
+class AssetLoader:
+    """ Loads startup assets: add() queues them, pump() is called once per
+        frame by the viewer until everything is loaded """
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(workers)
+        self.assets = []
+        self.queue = deque()  # assets waiting for their main thread part
+        self.start = perf_counter()
+
+    def add(self, name, finish, scenes=(), images=()):
+        """ queue asset 'name': 'scenes' and 'images' files are prefetched by
+            a worker, then finish() runs on the main thread, in add order """
+        asset = Asset(name, finish)
+
+        def prefetch():
+            asset.prefetch[0] = perf_counter()
+            for file in scenes:
+                prefetch_scene(file)
+            for file in images:
+                TEXTURES.prefetch(file)
+            asset.prefetch[1] = perf_counter()
+
+        asset.future = self.pool.submit(prefetch)
+        self.assets.append(asset)
+        self.queue.append(asset)
+
+    def progress(self):
+        """ fraction of the assets completely loaded, from 0 to 1 """
+        return 1 - len(self.queue) / max(len(self.assets), 1)
+
+    def pump(self, budget=1/60):
+        """ run the main thread part of prefetched assets for about 'budget'
+            seconds (at least one asset). Returns True while assets remain """
+        deadline = perf_counter() + budget
+        while self.queue and self.queue[0].future.done():
+            asset = self.queue.popleft()
+            asset.future.result()  # raise worker errors on the main thread
+            asset.upload[0] = perf_counter()
+            asset.finish()
+            asset.upload[1] = perf_counter()
+            if perf_counter() > deadline:
+                break
+        if not self.queue and self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.report()
+        return bool(self.queue)
+
+    def wait(self):
+        """ load everything now, without any loading screen """
+        while self.pump(float('inf')):
+            self.queue[0].future.result()
+
+    def critical_path(self):
+        """ chain of steps which bounded the startup time: an upload starts
+            when both its prefetch and the previous upload are done """
+        path, index = [], len(self.assets) - 1
+        while index >= 0:
+            asset = self.assets[index]
+            path.append((asset.name, 'upload'))
+            previous = self.assets[index - 1].upload[1] if index else 0
+            if asset.prefetch[1] >= previous:  # waited for the worker
+                path.append((asset.name, 'prefetch'))
+                break
+            index -= 1
+        return path[::-1]
+
+    def report(self):
+        """ print the per asset startup timeline and its critical path """
+        def span(interval):
+            return '%7.0f -%7.0f ms' % tuple(1000 * (time - self.start)
+                                            for time in interval)
+        print('Startup timeline\t%-20s %-20s %s' % ('asset', 'prefetch', 'upload'))
+        for asset in self.assets:
+            print('\t\t\t%-20s %s %s' % (asset.name, span(asset.prefetch),
+                                         span(asset.upload)))
+        print('Critical path:', ' -> '.join('%s %s' % step
+                                            for step in self.critical_path()))
+        print('Startup in %.2f s' % (perf_counter() - self.start))
@@ -0,0 +1,171 @@
+"""
+Levels of detail: meshes simplified by quadric error vertex clustering,
+cached next to their asset, and a node drawing the level matching the
+size of its subtree on screen.
+"""
+import os                           # os function, i.e. checking file status
+from time import perf_counter
+
+import numpy as np                  # all matrix manipulations & OpenGL args
+from src.cache import cache_file, replace_atomically
+from src.node import Node
+
+LOD_SCREEN_SIZES = (0.5, 0.25, 0.125, 0.0625)  # see LODNode
+
+
+def quadrics(vertices, faces):
+    """ (n, 4, 4) sum of the area weighted plane quadrics of the faces
+        around each of the n vertices """
+    corners = vertices[faces]
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    area = np.linalg.norm(cross, axis=1)
+    normals = cross / np.maximum(area, 1e-12)[:, None]
+    planes = np.column_stack((normals, -(normals * corners[:, 0]).sum(axis=1)))
+    face_quadrics = (area / 2)[:, None, None] * planes[:, :, None] * planes[:, None, :]
+    weights = np.repeat(face_quadrics.reshape(-1, 16), 3, axis=0)
+    return np.column_stack([np.bincount(faces.ravel(), weights[:, k], len(vertices))
+                            for k in range(16)]).reshape(-1, 4, 4)
+
+
+def clusters(vertices, cell):
+    """ cluster id of each vertex in a grid of 'cell' sized cubes, and count """
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell).astype(np.int64)
+    _, inverse = np.unique(cells[:, 0] * (1 << 42) + cells[:, 1] * (1 << 21)
+                           + cells[:, 2], return_inverse=True)
+    inverse = inverse.reshape(-1)
+    return inverse, inverse.max() + 1
+
+
+def decimate(vertices, faces, target, vertex_quadrics=None):
+    """ (vertices, faces, source) of a mesh simplified to about 'target'
+        vertices: vertices of each grid cell are collapsed to the position
+        minimizing their quadric error, and faces that became degenerate
+        are removed. 'source' gives the original vertex whose other
+        attributes each new vertex uses. """
+    vertices = np.asarray(vertices, np.float64)
+    faces = np.asarray(faces, np.int64).reshape(-1, 3)
+    if vertex_quadrics is None:
+        vertex_quadrics = quadrics(vertices, faces)
+
+    # grid cell size giving about 'target' clusters, by bisection
+    small, large = 1e-6, np.ptp(vertices, axis=0).max() + 1e-6
+    for _ in range(20):
+        cell = np.sqrt(small * large)
+        inverse, count = clusters(vertices, cell)
+        if count > target:
+            small = cell
+        else:
+            large = cell
+    inverse, count = clusters(vertices, large)
+
+    # optimal position of each cluster, kept inside its vertices box
+    summed = np.column_stack([np.bincount(inverse, vertex_quadrics[:, i, j], count)
+                              for i in range(4) for j in range(4)]).reshape(-1, 4, 4)
+    sizes = np.bincount(inverse, minlength=count)[:, None]
+    positions = np.column_stack([np.bincount(inverse, vertices[:, k], count)
+                                 for k in range(3)]) / sizes
+    solvable = np.linalg.cond(summed[:, :3, :3]) < 1e6
+    positions[solvable] = np.linalg.solve(summed[solvable, :3, :3],
+                                          -summed[solvable, :3, 3:])[..., 0]
+    order = np.argsort(inverse, kind='stable')
+    offsets = np.searchsorted(inverse[order], np.arange(count))
+    positions = np.clip(positions,
+                        np.minimum.reduceat(vertices[order], offsets),
+                        np.maximum.reduceat(vertices[order], offsets))
+
+    # original vertex nearest to each position, for the other attributes
+    distances = ((vertices - positions[inverse]) ** 2).sum(axis=1)
+    source = np.lexsort((distances, inverse))[offsets]
+
+    faces = inverse[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2])
+                  & (faces[:, 0] != faces[:, 2])]
+    _, unique = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    faces = faces[np.sort(unique)]
+
+    # drop clusters no face uses anymore
+    used = np.zeros(count, bool)
+    used[faces] = True
+    renumber = np.cumsum(used) - 1
+    return (positions[used].astype(np.float32), renumber[faces].astype(np.uint32),
+            source[used])
+
+
+def simplified(file, name, vertices, faces, levels=3, ratio=0.25):
+    """ up to 'levels' (vertices, faces, source) simplifications of mesh
+        'name' of asset 'file', each with 'ratio' times the vertices of the
+        previous one, see decimate. Cached in a file next to the asset. """
+    path = cache_file(file, 'lod.npz', 'lod', name, levels, ratio)
+    status = 'cached'
+    if not os.path.exists(path):
+        start = perf_counter()
+        arrays, vertex_quadrics = {}, quadrics(np.asarray(vertices, np.float64),
+                                               np.asarray(faces).reshape(-1, 3))
+        nb_vertices, nb_faces = len(vertices), len(faces)
+        for level in range(levels):
+            result = decimate(vertices, faces, nb_vertices * ratio ** (level + 1),
+                              vertex_quadrics)
+            if not len(result[1]) or len(result[1]) >= nb_faces:
+                break  # nothing left, or no simpler than the previous level
+            nb_faces = len(result[1])
+            for key, array in zip(('vertices', 'faces', 'source'), result):
+                arrays['%s%d' % (key, level)] = array
+        def write(temporary):
+            with open(temporary, 'wb') as output:
+                np.savez(output, **arrays)
+        replace_atomically(path, write)
+        status = 'simplified in %.1f ms' % (1000 * (perf_counter() - start))
+    with np.load(path) as arrays:
+        result = [(arrays['vertices%d' % level], arrays['faces%d' % level],
+                   arrays['source%d' % level])
+                  for level in range(len(arrays.files) // 3)]
+    print('LODs %s\t(mesh %s, %s faces, %s)' % (
+        file, name, ' > '.join(str(len(f)) for f in [faces] + [r[1] for r in result]),
+        status))
+    return result
+
+
+class LODNode(Node):
+    """ Draws one of its children, the levels of detail of a same object
+        from finest to coarsest: level i + 1 is drawn once the object
+        bounding sphere, seen from the trackball 'distance' drawing
+        parameter, is smaller on screen than screen_sizes[i] half heights """
+    traversed = False  # draws only the chosen level, see draw
+
+    def __init__(self, levels, screen_sizes=LOD_SCREEN_SIZES, **kwargs):
+        super().__init__(children=levels, **kwargs)
+        self.screen_sizes = np.array(screen_sizes)
+
+    def level(self, projection, view, model, distance=None):
+        """ index of the level to draw """
+        bounds = self.local_bounds()
+        if bounds is None or len(self.children) == 1:
+            return 0
+        model = np.asarray(model)
+        radius = bounds.radius * np.linalg.norm(model[:3, :3], axis=0).max()
+        if distance is None:  # depth of our center in the camera space
+            distance = -(np.asarray(view) @ model @ (*bounds.center, 1))[2]
+        size = radius * projection[1, 1] / max(distance, 1e-6)
+        return min(int((size < self.screen_sizes).sum()), len(self.children) - 1)
+
+    def merge_key(self):
+        """ levels of the same kinds can be merged level by level """
+        keys = [getattr(level, 'merge_key', lambda: None)() for level in self.children]
+        if None in keys:
+            return None
+        return type(self), tuple(self.screen_sizes), tuple(keys)
+
+    @classmethod
+    def merged(cls, placed):
+        """ one LODNode whose levels merge the same level of all 'placed' """
+        first = placed[0][1]
+        return cls([type(level).merged([(matrix, lod.children[i])
+                                        for matrix, lod in placed])
+                    for i, level in enumerate(first.children)],
+                   first.screen_sizes)
+
+    def draw(self, projection, view, model, distance=None, **param):
+        level = self.level(projection, view, model, distance)
+        if self.param:
+            param = dict(param, **self.param)
+        self.children[level].draw(projection, view, model, distance=distance, **param)
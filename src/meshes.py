@@ -1,35 +1,38 @@
 from src.vertexArray import VertexArray
-import glfw                         # lean window system wrapper for OpenGL
+from src.clock import get_time
 from src.shader import *
 import src
 from src.node import Node, SkinningControlNode
-from src.texture import Texture
+from src.texture import Texture, TEXTURES
+from src.bounds import Bounds
+from src.render_queue import RenderItem, submit, BACKGROUND, CUTOUT, \
+    TRANSPARENT, OVERLAY
+
+class TextureHolder:
+    """ mesh drawn with a shared texture: one of its users in TEXTURES from
+        hold() until garbage collected, e.g. once merged by Node.freeze """
+    texture = None
+
+    def hold(self, texture):
+        self.texture = TEXTURES.retain(texture)
+
+    def __del__(self):  # texture may be evicted once nobody uses it
+        TEXTURES.release(self.texture)
+
 
 # -------------- Sky box mesh -------------------------------------------------
-class SkyBoxMesh():
+class SkyBoxMesh(TextureHolder):
     """ skybox """
     def __init__(self, texture, attributes, index=None):
         self.vertex_array = VertexArray(attributes, index)
-        self.texture = texture
-
-    def draw(self, projection, view, model, shaders, win=None, **_kwargs):
-        shader = shaders[SKYBOX_SHADER_ID]
-        GL.glUseProgram(shader.glid)
+        self.hold(texture)
 
-        # projection geometry
-        loc = GL.glGetUniformLocation(shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
-
-        # texture access setups
-        loc = GL.glGetUniformLocation(shader.glid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
-        self.vertex_array.draw(GL.GL_TRIANGLES)
-
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
+    def draw(self, projection, view, model, shaders, win=None, queue=None,
+             **_kwargs):
+        # projection geometry, texture access setups
+        submit(RenderItem(shaders[SKYBOX_SHADER_ID], self.vertex_array, {
+            'modelviewprojection': projection @ view @ model,
+            'diffuseMap': 0}, self.texture, layer=BACKGROUND), queue)
 
 
 # -------------- Deformable Cylinder Mesh  ------------------------------------
@@ -97,7 +100,7 @@ class SkinnedCylinder(SkinningControlNode):
 
 
 
-class SkinnedMesh:
+class SkinnedMesh(TextureHolder):
     """class of skinned mesh nodes in scene graph """
     def __init__(self, axe, attributes, bone_nodes, bone_offsets, texture, index=None):
 
@@ -106,166 +109,174 @@ class SkinnedMesh:
 
         # feel free to move this up in Viewer as shown in previous practicals
 
-        # store skinning data
+        # store skinning data, offsets stacked as one (n_bones, 4, 4) array
         self.bone_nodes = bone_nodes
-        self.bone_offsets = bone_offsets
-        self.texture = texture
+        self.bone_offsets = np.array(bone_offsets, np.float32)
+        self.hold(texture)
         self.axe = axe
 
-    def draw(self, projection, view, _model, shaders=None, **_kwargs):
+    def palette(self, view, bones=None):
+        """ bone matrices and their view space normal matrices, computed
+            for all bones at once from the bone nodes world transforms,
+            read from the per instance 'bones' dictionary if given """
+        if bones is None:
+            world = [node.world_transform for node in self.bone_nodes]
+        else:
+            world = [bones.get(node, node.world_transform)
+                     for node in self.bone_nodes]
+        world = np.array(world, np.float32)
+        bone_matrices = world @ self.bone_offsets
+        linear = view[:3, :3] @ bone_matrices[:, :3, :3]
+        try:
+            normal_matrices = np.linalg.inv(linear).transpose(0, 2, 1)
+        except np.linalg.LinAlgError:  # degenerate bone, e.g. null scale
+            normal_matrices = np.linalg.pinv(linear).transpose(0, 2, 1)
+        return bone_matrices, normal_matrices
+
+    def draw(self, projection, view, _model, shaders=None, bones=None,
+             queue=None, **_kwargs):
         """ skinning object draw method """
 
-        shid = shaders[SKINNING_SHADER_ID].glid
-        GL.glUseProgram(shid)
-
-        # setup camera geometry parameters
-        loc = GL.glGetUniformLocation(shid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
-        loc = GL.glGetUniformLocation(shid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
-        loc = GL.glGetUniformLocation(shid, 'axe')
-        GL.glUniform1i(loc, self.axe)
-        texture_location = GL.glGetUniformLocation(shid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-
         # bone world transform matrices need to be passed for skinning
-        for bone_id, node in enumerate(self.bone_nodes):
-            bone_matrix = node.world_transform @ self.bone_offsets[bone_id]
+        bone_matrices, normal_matrices = self.palette(view, bones)
 
-            bone_loc = GL.glGetUniformLocation(shid, 'boneMatrix[%d]' % bone_id)
-            GL.glUniformMatrix4fv(bone_loc, 1, True, bone_matrix)
+        # camera geometry parameters, texture and bones
+        submit(RenderItem(shaders[SKINNING_SHADER_ID], self.vertex_array, {
+            'projection': projection, 'view': view, 'axe': self.axe,
+            'diffuseMap': 0, 'boneMatrix': bone_matrices,
+            'boneNormalMatrix': normal_matrices}, self.texture), queue)
 
-        # draw mesh vertex array
-        self.vertex_array.draw(GL.GL_TRIANGLES)
 
-        # leave with clean OpenGL state, to make it easier to detect problems
-        GL.glUseProgram(0)
+INSTANCE_MATRIX_LAYOUT = ((3, 4), (4, 4), (5, 4), (6, 4))  # mat4, by column
+PLACEMENT_LAYOUT = ((3, 4), (4, 1))  # position and angle, size
 
 
-class PhongMesh:
-    """ Mesh Object, loaded from obj file"""
+class StaticMesh(TextureHolder):
+    """ Textured mesh whose shader computes texture coordinates from the
+        object space 'texPosition' attribute (location 2, the vertex
+        positions by default), so that Node.freeze() can merge placed
+        copies of it without changing their look """
 
     def __init__(self, texture, attributes, index, facteur_texture):
+        if len(attributes) == 2:  # vertices, normals
+            attributes = [*attributes, attributes[0]]
+        self.attributes, self.index = attributes, index  # kept for merging
+        self.bounds = Bounds.from_points(attributes[0])
         self.vertexArray = VertexArray(attributes, index)
-        self.texture = texture
+        self.hold(texture)
         self.facteur = facteur_texture
 
-    def draw(self, projection, view, model, shaders=None,
-             color=(1, 1, 1, 1), view_vector=(0, 0, 1), **param):
-        shader = shaders[LAMBERTIAN_SHADER_ID]
-        GL.glUseProgram(shader.glid)
-        viewMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'viewMatrix')
-        projMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'projMatrix')
-        modelMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'modelMatrix')
-
-        texture_location = GL.glGetUniformLocation(shader.glid, 'diffuseMap')
-        facteur_texture = GL.glGetUniformLocation(shader.glid, 'facteur')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-
-        GL.glUniformMatrix4fv(modelMatrix_location, 1, True,
-                              model)
-        GL.glUniformMatrix4fv(viewMatrix_location, 1, True, view)
-        GL.glUniformMatrix4fv(projMatrix_location, 1, True, projection)
-
-        # texture access setups
-
-        GL.glUniform1f(facteur_texture, self.facteur)
-        GL.glUniform1i(texture_location, 0)
-
-        # draw triangle as GL_TRIANGLE vertex array, draw array call
-        self.vertexArray.draw(GL.GL_TRIANGLES)
-
-class ArbreMesh:
+    def uniforms(self, projection, view, model):
+        """ camera and texture access uniforms of our shaders """
+        return {'modelMatrix': model, 'viewMatrix': view,
+                'projMatrix': projection, 'facteur': self.facteur,
+                'diffuseMap': 0}
+
+    def merge_key(self):
+        """ meshes with the same key can be drawn as a single one """
+        return type(self), self.texture, self.facteur
+
+    @classmethod
+    def merged(cls, placed):
+        """ one mesh from the (matrix, mesh) pairs of 'placed', all with the
+            same merge key: vertices and normals are transformed by their
+            matrix, texture positions are kept in object space """
+        vertices, normals, positions, index, offset = [], [], [], [], 0
+        for matrix, mesh in placed:
+            matrix = np.asarray(matrix, np.float32)
+            linear = matrix[:3, :3]
+            vertex, normal, position = (np.asarray(attribute, np.float32)
+                                        for attribute in mesh.attributes)
+            vertices.append(vertex @ linear.T + matrix[:3, 3])
+            # normals use the inverse transpose: (inv(L).T @ n.T).T
+            normals.append(normal @ np.linalg.inv(linear))
+            positions.append(position)
+            faces = np.arange(len(vertex)) if mesh.index is None else mesh.index
+            index.append(np.asarray(faces, np.int32).reshape(-1) + offset)
+            offset += len(vertex)
+        _, texture, facteur = placed[0][1].merge_key()
+        return cls(texture, [np.concatenate(vertices), np.concatenate(normals),
+                             np.concatenate(positions)],
+                   np.concatenate(index), facteur)
+
+
+class PhongMesh(StaticMesh):
     """ Mesh Object, loaded from obj file"""
 
-    def __init__(self, texture, attributes, index, facteur_texture):
-        self.vertexArray = VertexArray(attributes, index)
-        self.texture = texture
-        self.facteur = facteur_texture
-
     def draw(self, projection, view, model, shaders=None,
-             color=(1, 1, 1, 1), view_vector=(0, 0, 1), **param):
-        shader = shaders[ARBRE_SHADER_ID]
-        GL.glUseProgram(shader.glid)
-        viewMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'viewMatrix')
-        projMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'projMatrix')
-        modelMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'modelMatrix')
-        viewVec_location = \
-            GL.glGetUniformLocation(shader.glid, 'view')
-
-        texture_location = GL.glGetUniformLocation(shader.glid, 'diffuseMap')
-        facteur_texture = GL.glGetUniformLocation(shader.glid, 'facteur')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-
-        GL.glUniformMatrix4fv(modelMatrix_location, 1, True,
-                              model)
-        GL.glUniformMatrix4fv(viewMatrix_location, 1, True, view)
-        GL.glUniformMatrix4fv(projMatrix_location, 1, True, projection)
-        GL.glUniform3fv(viewVec_location, 1, view_vector)
-
-        # texture access setups
-
-        GL.glUniform1f(facteur_texture, self.facteur)
-        GL.glUniform1i(texture_location, 0)
-
-        # draw triangle as GL_TRIANGLE vertex array, draw array call
-        self.vertexArray.draw(GL.GL_TRIANGLES)
-
-class HerbeMesh():
-    """ Mesh Object, loaded from obj file"""
+             color=(1, 1, 1, 1), view_vector=(0, 0, 1), queue=None, **param):
+        submit(RenderItem(shaders[LAMBERTIAN_SHADER_ID], self.vertexArray,
+                          self.uniforms(projection, view, model),
+                          self.texture), queue)
 
-    def __init__(self, texture, attributes, index, facteur_texture):
-        self.vertexArray = VertexArray(attributes, index)
-        self.texture = texture
-        self.facteur = facteur_texture
+class ArbreMesh(StaticMesh):
+    """ Mesh Object, loaded from obj file"""
+    instance_buffer, instances = None, 0
 
     def draw(self, projection, view, model, shaders=None,
-             color=(1, 1, 1, 1), view_vector=(0, 0, 1), **param):
-        shader = shaders[HERBE_SHADER_ID]
-
-        GL.glEnable(GL.GL_BLEND)
-        # GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
-        # GL.glDepthMask(GL.GL_FALSE);
-        GL.glUseProgram(shader.glid)
-
-        viewMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'viewMatrix')
-        projMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'projMatrix')
-        modelMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'modelMatrix')
-
-        texture_location = GL.glGetUniformLocation(shader.glid, 'diffuseMap')
-        facteur_texture = GL.glGetUniformLocation(shader.glid, 'facteur')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-
-        GL.glUniformMatrix4fv(modelMatrix_location, 1, True,
-                              model)
-        GL.glUniformMatrix4fv(viewMatrix_location, 1, True, view)
-        GL.glUniformMatrix4fv(projMatrix_location, 1, True, projection)
-
-        # texture access setups
-
-        GL.glUniform1f(facteur_texture, self.facteur)
-        GL.glUniform1i(texture_location, 0)
-
-        # draw triangle as GL_TRIANGLE vertex array, draw array call
-        self.vertexArray.draw(GL.GL_TRIANGLES)
+             color=(1, 1, 1, 1), view_vector=(0, 0, 1), queue=None, **param):
+        submit(self.item(shaders[ARBRE_SHADER_ID], projection, view, model,
+                         view_vector), queue)
+
+    def item(self, shader, projection, view, model, view_vector,
+             instances=None):
+        """ RenderItem of our texture with the camera uniforms """
+        uniforms = self.uniforms(projection, view, model)
+        uniforms['view'] = view_vector
+        return RenderItem(shader, self.vertexArray, uniforms, self.texture,
+                          instances)
+
+    def set_instances(self, matrices):
+        """ (instances, 4, 4) transforms for draw_instanced, applied before
+            the model matrix """
+        # a GLSL mat4 attribute is read column by column
+        columns = np.ascontiguousarray(np.transpose(matrices, (0, 2, 1)),
+                                       np.float32).reshape(-1, 16)
+        if self.instance_buffer is None:
+            self.instance_buffer = self.vertexArray.add_instance_buffer(
+                INSTANCE_MATRIX_LAYOUT, columns, usage=GL.GL_STATIC_DRAW)
+        else:
+            VertexArray.update_buffer(self.instance_buffer, columns,
+                                      GL.GL_STATIC_DRAW)
+        self.instances = len(columns)
+
+    def draw_instanced(self, projection, view, model, shaders=None,
+                       view_vector=(0, 0, 1), queue=None, **param):
+        """ every instance given to set_instances in one draw call """
+        submit(self.item(shaders[ARBRE_INSTANCED_SHADER_ID], projection, view,
+                         model, view_vector, self.instances), queue)
+
+class HerbeMesh(StaticMesh):
+    """ Mesh Object, loaded from obj file"""
+    placement_buffer, instances = None, 0
+
+    def set_placements(self, placements):
+        """ (instances, 5) rows of tuft position, angle around y (radians)
+            and size, for draw_instanced """
+        placements = np.ascontiguousarray(placements, np.float32)
+        if self.placement_buffer is None:
+            self.placement_buffer = self.vertexArray.add_instance_buffer(
+                PLACEMENT_LAYOUT, placements, usage=GL.GL_STATIC_DRAW)
+        else:
+            VertexArray.update_buffer(self.placement_buffer, placements,
+                                      GL.GL_STATIC_DRAW)
+        self.instances = len(placements)
+
+    def draw_instanced(self, projection, view, model, shaders=None,
+                       queue=None, **param):
+        """ every tuft given to set_placements in one draw call """
+        self.draw(projection, view, model, shaders=shaders, queue=queue,
+                  shader_id=HERBE_INSTANCED_SHADER_ID)
 
-        # GL.glDisable(GL.GL_CULL_FACE)
-        # GL.glDepthMask(GL.GL_TRUE);
-        GL.glDisable(GL.GL_BLEND)
-        
+    def draw(self, projection, view, model, shaders=None,
+             color=(1, 1, 1, 1), view_vector=(0, 0, 1),
+             shader_id=HERBE_SHADER_ID, queue=None, **param):
+        # blended, drawn after opaque meshes
+        instances = (self.instances if shader_id == HERBE_INSTANCED_SHADER_ID
+                     else None)
+        submit(RenderItem(shaders[shader_id], self.vertexArray,
+                          self.uniforms(projection, view, model), self.texture,
+                          instances, layer=CUTOUT), queue)
 
 
 class UIMesh:
@@ -275,43 +286,27 @@ class UIMesh:
         self.vertexArray = VertexArray(attributes, index)
         self.charge = 0 # en pourcentage de 0 à 1
 
-    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1), **param):
-        shader = shaders[UI_SHADER_ID]
-        charge_location = GL.glGetUniformLocation(shader.glid, 'charge')
-        GL.glUseProgram(shader.glid)
-        GL.glUniform1f(charge_location, self.charge)
-        GL.glEnable(GL.GL_BLEND)
-        GL.glDisable(GL.GL_DEPTH_TEST)
-
-        self.vertexArray.draw(GL.GL_TRIANGLES)
-        GL.glDisable(GL.GL_BLEND)
-        GL.glEnable(GL.GL_DEPTH_TEST)
+    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1),
+             queue=None, **param):
+        submit(RenderItem(shaders[UI_SHADER_ID], self.vertexArray,
+                          {'charge': self.charge}, layer=OVERLAY), queue)
 
     def set_charge(self, charge):
         self.charge = charge
 
-class ConsigneMesh:
+class ConsigneMesh(TextureHolder):
     """ Mesh Object, not loaded but created"""
 
     def __init__(self, texture, attributes, index=None):
         self.vertexArray = VertexArray(attributes, index)
         self.charge = 0 # en pourcentage de 0 à 1
-        self.texture = texture
-
-    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1), **param):
-        shader = shaders[CONSIGNE_SHADER_ID]
-        charge_location = GL.glGetUniformLocation(shader.glid, 'charge')
-        GL.glUseProgram(shader.glid)
-        GL.glUniform1f(charge_location, self.charge)
-        GL.glEnable(GL.GL_BLEND)
-        GL.glDisable(GL.GL_DEPTH_TEST)
-        texture_location = GL.glGetUniformLocation(shader.glid, 'textureC')
-
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        self.vertexArray.draw(GL.GL_TRIANGLES)
-        GL.glDisable(GL.GL_BLEND)
-        GL.glEnable(GL.GL_DEPTH_TEST)
+        self.hold(texture)
+
+    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1),
+             queue=None, **param):
+        submit(RenderItem(shaders[CONSIGNE_SHADER_ID], self.vertexArray,
+                          {'charge': self.charge, 'textureC': 0}, self.texture,
+                          layer=OVERLAY), queue)
 
     def set_charge(self, charge):
         self.charge = charge
@@ -324,96 +319,121 @@ class ColorMesh:
     def __init__(self, attributes, index):
         self.vertexArray = VertexArray(attributes, index)
 
-    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1), **param):
-        shader = shaders[COLOR_SHADER_ID]
-        GL.glUseProgram(shader.glid)
-        matrix_location = GL.glGetUniformLocation(shader.glid, 'matrix')
-
-        GL.glUniformMatrix4fv(matrix_location, 1, True,
-                              projection * view * model)
+    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1),
+             queue=None, **param):
+        submit(RenderItem(shaders[COLOR_SHADER_ID], self.vertexArray, {
+            'modelviewprojection': projection @ view @ model}), queue)
+
+# instance attributes of the instanced geyser shader: (location, size)
+PARTICLE_LAYOUT = ((3, 4), (4, 3), (5, 3), (6, 3), (7, 3))
+GEYSER_LAYOUT = ((8, 2),)
+
+
+def particle_attributes(number):
+    """ per particle constants of the geyser shader, one row per particle:
+        id, horizontal speed, height ratio, rising speed, scale, rotation """
+    ids = np.arange(number, dtype=np.float64)
+    particle = np.stack((ids, 8.5 + 4 * np.sin(ids * 28),
+                         (number - ids) / number, np.abs(np.sin(91 * ids))), 1)
+    base_scale = np.stack((np.sin(ids) + 1.1, np.cos(ids) + 1.1,
+                           np.sin(ids + 3.14/4) + 1.2), 1)
+
+    # rotation of angle 0.8 around a "random" axis, as GLSL mat3 columns
+    axis = np.stack((np.sin(ids * 100), np.cos(ids * 100),
+                     np.sin(ids * 200)), 1)
+    x, y, z = (axis / np.linalg.norm(axis, axis=1, keepdims=True)).T
+    s, c = np.sin(0.8), np.cos(0.8)
+    oc = 1 - c
+    rotation = np.stack((oc*x*x + c, oc*x*y - z*s, oc*z*x + y*s,
+                         oc*x*y + z*s, oc*y*y + c, oc*y*z - x*s,
+                         oc*z*x - y*s, oc*y*z + x*s, oc*z*z + c), 1)
+    return np.hstack((particle, base_scale, rotation)).astype(np.float32)
 
-        # draw triangle as GL_TRIANGLE vertex array, draw array call
-        self.vertexArray.draw(GL.GL_TRIANGLES)
 
 class ParticleMesh:
     """ Mesh object to draw the geyser"""
 
-    def __init__(self, attributes, index):
+    def __init__(self, attributes, index, instanced=True):
         self.vertexArray = VertexArray(attributes, index)
         self.number_particle = NUMBER_PARTICLES
         self.geysers = []
+        self.instanced = instanced
+        if instanced:
+            # particle rows are repeated for each geyser slot (capacity)
+            self.particles = particle_attributes(self.number_particle)
+            self.capacity = 1
+            self.particle_buffer = self.vertexArray.add_instance_buffer(
+                PARTICLE_LAYOUT, self.particles)
+            self.geyser_buffer = self.vertexArray.add_instance_buffer(
+                GEYSER_LAYOUT, np.zeros((1, 2)), self.number_particle)
+            self.geysers_changed = False
 
     """def set_number_of_particles(n):
         self.number_particle = n
     """
 
     def new_geyser(self, charge):
-        self.geysers += [(glfw.get_time(), charge)]
-
-    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1), **param):
+        self.geysers += [(get_time(), charge)]
+        self.geysers_changed = True
+
+    def draw(self, projection, view, model, shaders=None, color=(1,1,1,1),
+             queue=None, **param):
+        if self.instanced:
+            self.draw_instanced(projection, view, shaders, queue)
+            return
         shader = shaders[GEYSER_SHADER_ID]
-        time = glfw.get_time()
-        GL.glEnable(GL.GL_BLEND)
-        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
-        GL.glDepthMask(GL.GL_FALSE);
-        GL.glUseProgram(shader.glid)
-
-        viewMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'viewMatrix')
-        projMatrix_location = \
-            GL.glGetUniformLocation(shader.glid, 'projMatrix')
-        time_location = \
-            GL.glGetUniformLocation(shader.glid, 'time')
-        id_location = \
-            GL.glGetUniformLocation(shader.glid, 'id_particle')
-        height_location = \
-            GL.glGetUniformLocation(shader.glid, 'height_geyser')
-
-        GL.glUniformMatrix4fv(viewMatrix_location, 1, True, view)
-        GL.glUniformMatrix4fv(projMatrix_location, 1, True, projection)
+        time = get_time()
 
         to_remove = []
 
         for index, (offset, charge) in enumerate(self.geysers):
-            GL.glUniform1f(time_location, time - offset)
-            GL.glUniform1f(height_location, charge)
-
             for i in range(self.number_particle):
-                GL.glUniform1f(id_location, i)
-                self.vertexArray.draw(GL.GL_TRIANGLES)
+                submit(RenderItem(shader, self.vertexArray, {
+                    'viewMatrix': view, 'projMatrix': projection,
+                    'time': time - offset, 'height_geyser': charge,
+                    'id_particle': i}, layer=TRANSPARENT), queue)
             if time- offset > 5:
                 to_remove += [index]
         for j, i in enumerate(to_remove):
             self.geysers.pop(i - j)
 
-        GL.glDisable(GL.GL_CULL_FACE)
-        GL.glDepthMask(GL.GL_TRUE);
-        GL.glDisable(GL.GL_BLEND)
-        GL.glEnable(GL.GL_DEPTH_TEST)
+    def update_instances(self):
+        """ upload geyser data, growing the repeated particle rows if needed """
+        if len(self.geysers) > self.capacity:
+            self.capacity = max(2 * self.capacity, len(self.geysers))
+            self.vertexArray.update_buffer(
+                self.particle_buffer, np.tile(self.particles, (self.capacity, 1)))
+        self.vertexArray.update_buffer(self.geyser_buffer,
+                                       np.array(self.geysers, np.float32))
+        self.geysers_changed = False
+
+    def draw_instanced(self, projection, view, shaders, queue=None):
+        """ every particle of every live geyser in one instanced draw call """
+        time = get_time()
+        live = [geyser for geyser in self.geysers if time - geyser[0] <= 5]
+        if len(live) != len(self.geysers):
+            self.geysers, self.geysers_changed = live, True
+        if not self.geysers:
+            return
+        if self.geysers_changed:
+            self.update_instances()
+
+        submit(RenderItem(shaders[GEYSER_INSTANCED_SHADER_ID], self.vertexArray,
+                          {'viewMatrix': view, 'projMatrix': projection,
+                           'time': time}, None,
+                          len(self.geysers) * self.number_particle,
+                          layer=TRANSPARENT), queue)
 
 # mesh with a texture
-class TexturedMesh:
+class TexturedMesh(TextureHolder):
 
     def __init__(self, texture, attributes, index=None):
         self.vertex_array = VertexArray(attributes, index)
         self.shader = Shader(TEXTURE_VERT, TEXTURE_FRAG)
-        self.texture = texture
-
-    def draw(self, projection, view, model, win=None, **_kwargs):
-
-        GL.glUseProgram(self.shader.glid)
-
-        # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
-
-        # texture access setups
-        loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
-        self.vertex_array.draw(GL.GL_TRIANGLES)
+        self.hold(texture)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
+    def draw(self, projection, view, model, win=None, queue=None, **_kwargs):
+        # projection geometry, texture access setups
+        submit(RenderItem(self.shader, self.vertex_array, {
+            'modelviewprojection': projection @ view @ model,
+            'diffuseMap': 0}, self.texture), queue)
@@ -1,61 +1,271 @@
 import numpy as np                  # all matrix manipulations & OpenGL args
-import glfw                         # lean window system wrapper for OpenGL
+from src.clock import get_time
 from src.transform import identity
 from src.animation import TransformKeyFrames
+from src.bounds import Bounds
+
+POSE_MARGIN = 1.5  # animated rigs may leave their bind pose bounds
+
+
+def bounds_of(drawable):
+    """ bounds of 'drawable' in the coordinates it is drawn in, or None if
+        unknown, which means it is never culled """
+    if isinstance(drawable, Node):
+        return drawable.parent_bounds()
+    return getattr(drawable, 'bounds', None)
+
 
 # ------------  node classes ------------------------------------------
+class RenderContext:
+    """ Retained traversal of a root node, built with an explicit stack and
+        reused every frame until the graph structure changes: node
+        occurrences and drawables in draw order, and the world matrix of
+        every node occurrence, only recomputed when its transform or its
+        parent matrix changed. Shared nodes get one cached matrix per
+        occurrence. Subtrees whose bounds are outside the view frustum are
+        skipped, their bounds being computed again when a static node moved. """
+    def __init__(self, root):
+        self.structure = Node.structure  # graph version this was built for
+        self.moved = None                # static transforms version of bounds
+        self.nodes = []      # (node, index of parent world) in preorder
+        self.drawables = []  # (drawable, index of world, inherited params)
+        stack = [(root, 0, {})]
+        while stack:
+            drawable, parent, params = stack.pop()
+            if not (isinstance(drawable, Node) and drawable.traversed):
+                self.drawables.append((drawable, parent, params))
+                continue
+            self.nodes.append((drawable, parent))
+            if drawable.param:
+                params = dict(params, **drawable.param)
+            index = len(self.nodes)
+            stack.extend((child, index, params)
+                         for child in reversed(drawable.children))
+        # world matrices, index 0 being the model matrix given to the root
+        self.worlds = [None] * (len(self.nodes) + 1)
+        self.parents = [None] * len(self.worlds)   # parent matrix used
+        self.versions = [None] * len(self.worlds)  # node transform used
+        self.visible = [True] * len(self.worlds)
+
+    def update_bounds(self):
+        """ bounds of each node occurrence, in node and in world coordinates,
+            if a static node moved since they were computed """
+        if self.moved != Node.moved:
+            self.moved = Node.moved
+            self.bounds = [None] + [node.local_bounds() for node, _ in self.nodes]
+            self.world_bounds = [None] * len(self.worlds)
+
+    def update(self, model, time, frustum=None):
+        """ world matrices under 'model', recomputing only changed ones, and
+            visibility of each node occurrence in 'frustum' """
+        self.update_bounds()
+        worlds, parents, versions = self.worlds, self.parents, self.versions
+        visible, bounds = self.visible, self.bounds
+        worlds[0] = model
+        for index, (node, parent) in enumerate(self.nodes, 1):
+            if not visible[parent]:  # whole subtree culled
+                visible[index] = False
+                continue
+            if node.animated:
+                node.animate(time)
+            parent = worlds[parent]
+            if parent is not parents[index] or node.version != versions[index]:
+                parents[index], versions[index] = parent, node.version
+                # a new object: makes our children recompute theirs too
+                worlds[index] = parent @ node.transform
+                self.world_bounds[index] = None
+            if frustum is None or bounds[index] is None:
+                visible[index] = True
+                continue
+            if self.world_bounds[index] is None:
+                self.world_bounds[index] = bounds[index].transformed(worlds[index])
+            visible[index] = frustum.visible(self.world_bounds[index])
+        return worlds, visible
+
+
 class Node:
-    """ Scene graph transform and parameter broadcast node """
+    """ Scene graph transform and parameter broadcast node. Drawn as a root,
+        it retains its subtree traversal and world matrices, see
+        RenderContext. Assign transforms, do not modify them in place. """
+    animated = False   # True if animate(time) updates our transform
+    traversed = True   # False to be drawn by our own draw() as a drawable
+    structure = 0      # version of the graph structure, for all nodes
+    moved = 0          # version of the transforms of static nodes, for all nodes
+
     def __init__(self, name='', children=(), transform=np.identity(4), **param):
         self.transform, self.param, self.name = transform, param, name
         self.children = list(iter(children))
+        self.context = None  # RenderContext, when drawn as a root
+        self._bounds = (None, None)  # graph and transforms versions, local bounds
+
+    @property
+    def transform(self):
+        """ local transform of this node """
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform):
+        self._transform = transform
+        self.version = getattr(self, 'version', 0) + 1  # dirty flag
+        if not self.animated:  # the bounds of our ancestors depend on it
+            Node.moved += 1
+
+    def animate(self, time):
+        """ update our transform for 'time' before drawing, if animated """
+
+    def local_bounds(self):
+        """ bounds of our children in our coordinates, None if unknown.
+            Computed again only when the graph structure has changed, or
+            a static node moved. """
+        versions = (Node.structure, Node.moved)
+        if self._bounds[0] != versions:
+            self._bounds = (versions, Bounds.union(
+                [bounds_of(child) for child in self.children]))
+        return self._bounds[1]
+
+    def parent_bounds(self):
+        """ bounds of our subtree in our parent coordinates, None if unknown
+            or moving """
+        bounds = self.local_bounds()
+        if bounds is None or self.animated:
+            return None
+        return bounds.transformed(self.transform)
 
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.extend(drawables)
+        Node.structure += 1
+
+    def placed(self):
+        """ (matrix in our children coordinates, drawable) of our subtree,
+            static nodes without named parameters being flattened away """
+        stack = [(identity(), child) for child in reversed(self.children)]
+        while stack:
+            matrix, drawable = stack.pop()
+            if isinstance(drawable, Node) and drawable.traversed \
+                    and not drawable.animated and not drawable.param:
+                matrix = matrix @ drawable.transform
+                stack.extend((matrix, child)
+                             for child in reversed(drawable.children))
+            else:
+                yield matrix, drawable
+
+    def freeze(self):
+        """ Make our subtree static: meshes sharing a merge_key() are merged
+            into one, pre-transformed to our coordinates, so that each
+            material draws in one call. Other drawables are kept under a
+            node with their former relative transform. Returns self. """
+        groups, kept = {}, []
+        for matrix, drawable in self.placed():
+            key = drawable.merge_key() if hasattr(drawable, 'merge_key') else None
+            if key is not None:
+                groups.setdefault(key, []).append((matrix, drawable))
+            else:
+                kept.append(Node(transform=matrix, children=[drawable]))
+        self.children = [placed[0][1].merged(placed)
+                         for placed in groups.values()] + kept
+        Node.structure += 1
+        return self
 
     def draw(self, projection, view, model, time=None, **param):
-        """ Recursive draw, passing down named parameters & model matrix. """
-        # merge named parameters given at initialization with those given here
-        param = dict(param, **self.param)
-        model = model @ self.transform
-        for child in self.children:
-            child.draw(projection, view, model, time=time, **param)
+        """ Draw our subtree, passing down named parameters & model matrix """
+        context = self.context
+        if context is None or context.structure != Node.structure:
+            context = self.context = RenderContext(self)
+        worlds, visible = context.update(model, time, param.get('frustum'))
+        cull_stats = param.get('cull_stats')
+        for drawable, index, params in context.drawables:
+            if cull_stats is not None:
+                if not visible[index]:
+                    cull_stats.culled += 1
+                    continue
+                cull_stats.drawn += 1
+            elif not visible[index]:
+                continue
+            # named parameters given at initialization override those given here
+            drawable.draw(projection, view, worlds[index], time=time,
+                          **(dict(param, **params) if params else param))
 
 
 class KeyFrameControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    animated = True
+
     def __init__(self, translate_keys, rotate_keys, scale_keys, **kwargs):
         super().__init__(**kwargs)
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
 
-    def draw(self, projection, view, model, time=None, **param):
+    def animate(self, time):
         """ When redraw requested, interpolate our node transform from keys """
         if time is None:
-            time = glfw.get_time()
+            time = get_time()
         self.transform = self.keyframes.value(time)
-        super().draw(projection, view, model, time=time, **param)
 
 
 # -------- Skinning Control for Keyframing Skinning Mesh Bone Transforms ------
 class SkinningControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    traversed = False  # world transforms are per rig instance, see draw
+    animated = True    # transform from keys when drawn, see parent_bounds
     def __init__(self, *keys, **kwargs):
         super().__init__(**kwargs)
         self.keyframes = TransformKeyFrames(*keys) if keys[0] else None
         self.world_transform = identity()
+        self.channel = None  # index of our local transform in rig poses
+        self.clip = None     # rig root only: AnimationClip of all channels
 
-    def draw(self, projection, view, model, time=None, **param):
-        """ When redraw requested, interpolate our node transform from keys """
-        if self.keyframes:  # no keyframe update should happens if no keyframes
+    def sample(self, time):
+        """ Rig root only: local transforms of all channels at 'time' """
+        return self.clip.sample(time)
+
+    def parent_bounds(self):
+        """ skinned meshes are drawn where their bones place them: their
+            bounds placed by the node transforms down to them, our own
+            first, as in the bind pose, with a margin for poses """
+        meshes = []
+        stack = [(self.transform, child) for child in self.children]
+        while stack:
+            matrix, drawable = stack.pop()
+            if isinstance(drawable, Node):
+                matrix = matrix @ drawable.transform
+                stack.extend((matrix, child) for child in drawable.children)
+            else:
+                bounds = getattr(drawable, 'bounds', None)
+                meshes.append(bounds and bounds.transformed(matrix))
+        bounds = Bounds.union(meshes)
+        return bounds and bounds.scaled(POSE_MARGIN)
+
+    def draw(self, projection, view, model, time=None, pose=None, bones=None,
+             **param):
+        """ When redraw requested, interpolate our node transform from keys.
+            Given a rig 'pose', the transform is read from it instead, and
+            world transforms go to the per instance 'bones' dictionary. """
+        if pose is None and self.clip is not None:  # rig drawn without cache
             if time is None:
-                time = glfw.get_time()
-            self.transform = self.keyframes.value(time)
+                time = get_time()
+            pose = self.clip.sample(time)
+
+        if pose is not None and self.channel is not None:
+            transform = pose[self.channel]
+        elif self.keyframes:  # no keyframe update should happens if no keyframes
+            if time is None:
+                time = get_time()
+            transform = self.transform = self.keyframes.value(time)
+        else:
+            transform = self.transform
 
         # store world transform for skinned meshes using this node as bone
-        self.world_transform = model @ self.transform
+        world_transform = model @ transform
+        if bones is None:
+            self.world_transform = world_transform
+        else:
+            bones[self] = world_transform
 
         # default node behaviour (call children's draw method)
-        super().draw(projection, view, model, time=time, **param)
+        if self.param:
+            param = dict(param, **self.param)
+        for child in self.children:
+            child.draw(projection, view, world_transform, time=time,
+                       pose=pose, bones=bones, **param)
 
 
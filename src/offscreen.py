@@ -0,0 +1,140 @@
+"""
+Offscreen OpenGL 3.3 core context, without window system: the viewer draws
+into a framebuffer object, e.g. for batch jobs and performance tests on
+machines without display. Uses EGL, or OSMesa, Mesa's software rasterizer,
+as selected by the PYOPENGL_PLATFORM environment variable which must be set
+before OpenGL is first imported, see main.py.
+"""
+import ctypes
+import os
+
+import numpy as np                  # all matrix manipulations & OpenGL args
+from src.gl import GL               # OpenGL.GL, see src.gl
+
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+
+def egl_context():
+    """ current EGL context with no surface, Mesa's surfaceless platform
+        when available, else the default display """
+    from OpenGL import EGL
+    try:
+        from OpenGL.EGL.EXT.platform_base import eglGetPlatformDisplayEXT
+        display = eglGetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA,
+                                           None, None)
+    except Exception:  # extension not exposed by this EGL library
+        display = EGL.EGL_NO_DISPLAY
+    if not display:
+        display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError('EGL initialization failed')
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+    config, count = EGL.EGLConfig(), EGL.EGLint()
+    attributes = (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                  EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                  EGL.EGL_NONE)
+    EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1,
+                        ctypes.pointer(count))
+    if not count.value:
+        raise RuntimeError('no EGL configuration for OpenGL')
+    attributes = (EGL.EGLint * 7)(
+        EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+        EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+        EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, attributes)
+    if not context or not EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE,
+                                             EGL.EGL_NO_SURFACE, context):
+        raise RuntimeError('no EGL OpenGL 3.3 core context')
+
+    def destroy():
+        EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE,
+                           EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(display, context)
+        EGL.eglTerminate(display)
+    return destroy
+
+
+def osmesa_context(width, height):
+    """ current OSMesa context, drawing in a buffer we never read: frames
+        are drawn into our framebuffer object """
+    from OpenGL import osmesa
+    attributes = (ctypes.c_int * 11)(
+        osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA, osmesa.OSMESA_DEPTH_BITS, 24,
+        osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+        osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+        osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3, 0)
+    context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+    buffer = np.zeros((height, width, 4), np.uint8)
+    if not context or not osmesa.OSMesaMakeCurrent(
+            context, buffer, GL.GL_UNSIGNED_BYTE, width, height):
+        raise RuntimeError('no OSMesa OpenGL 3.3 core context')
+
+    def destroy():
+        osmesa.OSMesaDestroyContext(context)
+    destroy.buffer = buffer  # kept alive with the context: OSMesa draws in it
+    return destroy
+
+
+class OffscreenContext:
+    """ GL context drawing into a 'width' x 'height' framebuffer object,
+        multisampled with 'samples' samples per pixel if not 0 """
+    def __init__(self, width=640, height=480, samples=0):
+        self.size = (width, height)
+        platform = os.environ.get('PYOPENGL_PLATFORM')
+        if platform == 'osmesa':
+            self.destroy = osmesa_context(width, height)
+        elif platform == 'egl':
+            self.destroy = egl_context()
+        else:
+            raise RuntimeError('offscreen rendering needs PYOPENGL_PLATFORM '
+                               'set to egl or osmesa, not %s' % platform)
+
+        samples = min(samples, GL.glGetIntegerv(GL.GL_MAX_SAMPLES))
+        self.framebuffer = self.attach(samples)
+        # multisampled pixels are resolved in a second framebuffer to be read
+        self.resolved = self.attach(0) if samples else self.framebuffer
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer)
+        GL.glViewport(0, 0, width, height)
+
+    def attach(self, samples):
+        """ new complete framebuffer with color and depth renderbuffers """
+        framebuffer = GL.glGenFramebuffers(1)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+        for attachment, storage in ((GL.GL_COLOR_ATTACHMENT0, GL.GL_RGBA8),
+                                    (GL.GL_DEPTH_ATTACHMENT, GL.GL_DEPTH_COMPONENT24)):
+            renderbuffer = GL.glGenRenderbuffers(1)
+            GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, renderbuffer)
+            GL.glRenderbufferStorageMultisample(GL.GL_RENDERBUFFER, samples,
+                                                storage, *self.size)
+            GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, attachment,
+                                         GL.GL_RENDERBUFFER, renderbuffer)
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('incomplete framebuffer, status %s' % status)
+        return framebuffer
+
+    def swap_buffers(self):
+        """ end of a frame: resolve its samples, wait for it to be drawn so
+            that frame times measure the rendering """
+        if self.resolved != self.framebuffer:
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.framebuffer)
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.resolved)
+            GL.glBlitFramebuffer(0, 0, *self.size, 0, 0, *self.size,
+                                 GL.GL_COLOR_BUFFER_BIT, GL.GL_NEAREST)
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer)
+        GL.glFinish()
+
+    def read(self):
+        """ last frame as a (height, width, 4) RGBA array, top row first """
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.resolved)
+        pixels = GL.glReadPixels(0, 0, *self.size, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer)
+        width, height = self.size
+        return np.frombuffer(pixels, np.uint8).reshape(height, width, 4)[::-1]
+
+    def save(self, path):
+        """ save the last frame as an image file, format from its extension """
+        from PIL import Image
+        Image.fromarray(self.read()).save(path)
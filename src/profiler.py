@@ -0,0 +1,155 @@
+"""
+Hierarchical CPU frame profiler: timed scopes nested in the phases of
+Viewer.run, kept per frame, summarized per scope or exported as a Chrome
+trace (chrome://tracing, or ui.perfetto.dev). Disabled, a scope is a
+shared object doing nothing, so instrumentation costs about one call.
+"""
+import json                         # Chrome trace_event format
+from collections import deque
+from time import perf_counter
+
+
+class NullScope:
+    """ scope of a disabled profiler """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+NULL_SCOPE = NullScope()
+
+
+class Scope:
+    """ times its 'with' block, nested in the current scope """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.profiler.push(self.name)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.profiler.pop(self.start, perf_counter())
+        return False
+
+
+class Profiler:
+    """ scopes of the last 'max_frames' frames. Frames are split in phases,
+        see phase(); 'detailed' also times the optional scopes of detail() """
+    def __init__(self, max_frames=1000):
+        self.enabled, self.detailed = False, False
+        self.frames = deque(maxlen=max_frames)  # (start, end, events)
+        self.events = []   # (path, depth, start, end) of the current frame
+        self.stack = []    # paths of the open scopes
+        self.phase_start = None
+        self.frame_start = None
+
+    def enable(self, detailed=False):
+        self.enabled, self.detailed = True, detailed
+
+    def disable(self):
+        self.enabled = False
+        self.frame_start = None
+
+    def scope(self, name):
+        """ context manager timing its block as scope 'name' """
+        return Scope(self, name) if self.enabled else NULL_SCOPE
+
+    def detail(self, name):
+        """ scope timed only by a detailed profiler, e.g. one per object """
+        return Scope(self, name) if self.enabled and self.detailed else NULL_SCOPE
+
+    def push(self, name):
+        self.stack.append(self.stack[-1] + '/' + name if self.stack else name)
+
+    def pop(self, start, end):
+        self.events.append((self.stack.pop(), len(self.stack), start, end))
+
+    def begin_frame(self):
+        if self.enabled:
+            self.events, self.stack = [], []
+            self.phase_start = None
+            self.frame_start = perf_counter()
+
+    def phase(self, name):
+        """ end the current phase of the frame, if any, and start 'name' """
+        if self.frame_start is None:
+            return
+        now = perf_counter()
+        if self.phase_start is not None:
+            self.pop(self.phase_start, now)
+        self.push(name)
+        self.phase_start = now
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        end = perf_counter()
+        if self.phase_start is not None:
+            self.pop(self.phase_start, end)
+        self.frames.append((self.frame_start, end, self.events))
+        self.frame_start = None
+
+    def totals(self, frame, depth=0):
+        """ {path: seconds} of the scopes at 'depth' of 'frame' """
+        totals = {}
+        for path, level, start, end in frame[2]:
+            if level == depth:
+                totals[path] = totals.get(path, 0) + end - start
+        return totals
+
+    def summary(self):
+        """ table of each scope per frame: calls, mean and max times """
+        if not self.frames:
+            return 'no frame profiled'
+        scopes = {}  # path -> [calls, total, max per frame]
+        for frame in self.frames:
+            per_frame = {}
+            for path, _, start, end in frame[2]:
+                calls, total = per_frame.get(path, (0, 0))
+                per_frame[path] = (calls + 1, total + end - start)
+            for path, (calls, total) in per_frame.items():
+                stats = scopes.setdefault(path, [0, 0, 0])
+                stats[0] += calls
+                stats[1] += total
+                stats[2] = max(stats[2], total)
+        count = len(self.frames)
+        frame_time = sum(end - start for start, end, _ in self.frames) / count
+        lines = ['%d frames, %.3f ms per frame' % (count, 1000 * frame_time),
+                 '%-40s %8s %10s %10s %6s' % ('scope', 'calls', 'mean ms',
+                                              'max ms', '%')]
+        for path in sorted(scopes):
+            calls, total, most = scopes[path]
+            name = '  ' * path.count('/') + path.rsplit('/', 1)[-1]
+            lines.append('%-40s %8.1f %10.3f %10.3f %6.1f' % (
+                name, calls / count, 1000 * total / count, 1000 * most,
+                100 * total / count / max(frame_time, 1e-12)))
+        return '\n'.join(lines)
+
+    def save_trace(self, path):
+        """ save the frames as Chrome trace_event JSON """
+        if not self.frames:
+            return
+        origin = self.frames[0][0]
+        events = []
+        for number, (start, end, scopes) in enumerate(self.frames):
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': 1e6 * (start - origin),
+                           'dur': 1e6 * (end - start), 'args': {'frame': number}})
+            events.extend({'name': name.rsplit('/', 1)[-1], 'cat': name,
+                           'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': 1e6 * (begin - origin),
+                           'dur': 1e6 * (finish - begin)}
+                          for name, _, begin, finish in scopes)
+        with open(path, 'w') as output:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, output)
+
+
+PROFILER = Profiler()  # the profiler of the application, disabled
@@ -0,0 +1,128 @@
+"""
+Render queue: meshes submit what they draw as RenderItems instead of making
+GL calls, the viewer sorts them once per frame so that consecutive items
+share their program, texture and vertex array, and draws them.
+"""
+from src.gl import GL               # OpenGL.GL, see src.gl
+from src.glstate import STATE
+from src.profiler import PROFILER
+
+# layers, drawn in this order, and their (blending, depth test, depth write)
+BACKGROUND, OPAQUE, CUTOUT, TRANSPARENT, OVERLAY = range(5)
+LAYER_NAMES = ('background', 'opaque', 'cutout', 'transparent', 'overlay')
+LAYER_STATES = {
+    BACKGROUND: (False, True, True),  # skybox
+    OPAQUE: (False, True, True),
+    CUTOUT: (True, True, True),       # alpha tested, e.g. grass
+    TRANSPARENT: (True, True, False),  # e.g. geyser particles
+    OVERLAY: (True, False, True),     # user interface
+}
+DEFAULT_STATE = LAYER_STATES[OPAQUE]
+
+
+class RenderItem:
+    """ one draw call: 'vertex_array' drawn with 'shader' given 'uniforms'
+        values, and 'texture' bound to unit 0 if any. 'instances' copies are
+        drawn in one call if not None. """
+    __slots__ = ('shader', 'vertex_array', 'uniforms', 'texture', 'instances',
+                 'layer', 'primitive')
+
+    def __init__(self, shader, vertex_array, uniforms, texture=None,
+                 instances=None, layer=OPAQUE, primitive=GL.GL_TRIANGLES):
+        self.shader, self.vertex_array = shader, vertex_array
+        self.uniforms, self.texture = uniforms, texture
+        self.instances, self.layer, self.primitive = instances, layer, primitive
+
+    def key(self):
+        """ sort key: layer first, then the most expensive state switches """
+        return (self.layer, self.shader.glid,
+                self.texture.glid if self.texture else 0, self.vertex_array.glid)
+
+
+class RenderStats:
+    """ per frame counters of the items drawn and of the state switches
+        made, against one switch per item when drawn unsorted """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.items, self.textured = 0, 0
+        self.programs, self.textures, self.arrays = 0, 0, 0
+
+    def __repr__(self):
+        return ('%d items, switches: %d programs (%d removed), %d textures '
+                '(%d removed), %d vertex arrays (%d removed)' % (
+                    self.items, self.programs, self.items - self.programs,
+                    self.textures, self.textured - self.textures,
+                    self.arrays, self.items - self.arrays))
+
+
+def set_state(state):
+    """ set the (blending, depth test, depth write) 'state' """
+    blend, depth_test, depth_write = state
+    STATE.enable(GL.GL_BLEND, blend)
+    STATE.enable(GL.GL_DEPTH_TEST, depth_test)
+    STATE.depth_mask(depth_write)
+
+
+class RenderQueue:
+    """ items submitted during a frame, drawn sorted by flush() """
+    def __init__(self):
+        self.items = []
+        self.stats = RenderStats()  # of the last flush
+
+    def submit(self, item):
+        self.items.append(item)
+
+    def flush(self):
+        """ draw the submitted items sorted by state, binding a program,
+            texture or vertex array only when it differs from the previous
+            item's, then forget them and leave the default layer state.
+            Bindings are kept for the next frame, see src.glstate. """
+        self.items.sort(key=RenderItem.key)  # stable: ties keep their order
+        stats = self.stats
+        stats.reset()
+        STATE.active_texture(GL.GL_TEXTURE0)
+        STATE.blend_func(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        layer, shader, texture, array = None, None, None, None
+        scope = None  # detailed profiling of each layer, see src.profiler
+        for item in self.items:
+            if item.layer != layer:
+                layer = item.layer
+                if scope is not None:
+                    scope.__exit__()
+                scope = PROFILER.detail(LAYER_NAMES[layer]).__enter__()
+                set_state(LAYER_STATES[layer])
+            if item.shader is not shader:
+                shader = item.shader
+                STATE.use_program(shader.glid)
+                stats.programs += 1
+            if item.texture is not None:
+                stats.textured += 1
+                if item.texture.glid != texture:
+                    texture = item.texture.glid
+                    STATE.bind_texture(texture)
+                    stats.textures += 1
+            if item.vertex_array is not array:
+                array = item.vertex_array
+                STATE.bind_vertex_array(array.glid)
+                stats.arrays += 1
+            # Shader.set skips values equal to the last ones uploaded
+            for name, value in item.uniforms.items():
+                shader.set(name, value)
+            array.call(item.primitive, item.instances)
+            stats.items += 1
+        if scope is not None:
+            scope.__exit__()
+        self.items = []
+        set_state(DEFAULT_STATE)  # glClear needs depth writes
+
+
+def submit(item, queue=None):
+    """ add 'item' to the frame 'queue', or draw it at once without one """
+    if queue is not None:
+        queue.submit(item)
+        return
+    queue = RenderQueue()
+    queue.submit(item)
+    queue.flush()
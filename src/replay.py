@@ -0,0 +1,81 @@
+"""
+Input recording and replay: the key and trackball events of a viewer are
+saved with the frame they happened before and the clock time, then fed
+again to a viewer whose virtual clock gives each frame its recorded time,
+so that a replay draws the frames of the recorded session. While recording
+the clock is read once per frame, as a replay sees it.
+The loading screen is not replayed, its events happen before frame 0: the
+replay loads at the clock time the recording started at, and what is
+built during loading must not depend on how long loading took.
+"""
+import json                         # recordings are saved as JSON
+
+from src.clock import FrameClock, get_clock, get_time, set_clock, VirtualClock
+
+
+def targets(viewer):
+    """ object handling each kind of event: the viewer keys, the trackball
+        mouse events, with the window state they depend on """
+    return {'key': viewer, 'moved': viewer.trackball,
+            'clicked': viewer.trackball, 'scrolled': viewer.trackball}
+
+
+class InputRecorder:
+    """ records the events handled by 'viewer' from now on, to be created
+        before viewer.run() loads the scene """
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.clock = FrameClock(get_clock())
+        set_clock(self.clock)
+        self.start = self.clock.now  # clock time the session starts at
+        self.events = []  # [frame, time, kind, arguments]
+        self.times = []   # clock time at the start of each frame
+        viewer.on_frame.insert(0, self.frame_started)
+        for kind, target in targets(viewer).items():
+            setattr(target, kind, self.recording(kind, getattr(target, kind)))
+
+    def recording(self, kind, handler):
+        """ 'handler' of 'kind' events, recording them first """
+        def record(*args):
+            self.events.append([self.viewer.frame, get_time(), kind,
+                                [getattr(arg, 'tolist', lambda: arg)()
+                                 for arg in args]])
+            handler(*args)
+        return record
+
+    def frame_started(self, frame):
+        self.times.append(self.clock.tick())
+
+    def save(self, path):
+        with open(path, 'w') as output:
+            json.dump({'start': self.start, 'times': self.times,
+                       'events': self.events}, output)
+
+
+class InputReplay:
+    """ feeds 'viewer' the events of a recording, and the recorded frame
+        times through a virtual clock, at the recorded start time until
+        frame 0. The viewer stops after the last recorded frame unless
+        told otherwise. """
+    def __init__(self, viewer, recording):
+        if isinstance(recording, str):
+            with open(recording) as content:
+                recording = json.load(content)
+        self.times, self.events = recording['times'], recording['events']
+        self.handlers = targets(viewer)
+        self.next = 0  # index of the next event to replay
+        self.clock = VirtualClock(recording.get('start', 0.))
+        set_clock(self.clock)
+        if viewer.frames is None:
+            viewer.frames = len(self.times)
+        viewer.on_frame.insert(0, self.frame_started)
+
+    def frame_started(self, frame):
+        """ replay the events happening before 'frame', at their times """
+        while self.next < len(self.events) and self.events[self.next][0] <= frame:
+            _, time, kind, args = self.events[self.next]
+            self.next += 1
+            self.clock.now = time
+            getattr(self.handlers[kind], kind)(*args)
+        if frame < len(self.times):
+            self.clock.now = self.times[frame]
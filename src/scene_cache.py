@@ -0,0 +1,231 @@
+"""
+Persistent cache of pyassimp scene parsing. The post-processed scene
+(meshes, bones, materials, node hierarchy, animation keys) is stored next
+to the asset as a JSON index and one binary blob of arrays, keyed by the
+asset content and postprocess flags, and memory-mapped back on load.
+"""
+import json                         # scene structure of the cache index
+import os                           # os function, i.e. checking file status
+import threading                    # scenes may be loaded by worker threads
+from collections import defaultdict
+from time import perf_counter       # cold / warm load timings
+
+import numpy as np                  # all matrix manipulations & OpenGL args
+import pyassimp                     # 3D ressource loader
+import pyassimp.errors              # assimp error management + exceptions
+
+from src.cache import cache_file, replace_atomically
+
+DEFAULT_OPTION = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
+SCENE_CACHE_VERSION = 1   # bump whenever the cached layout changes
+ALIGNMENT = 16            # byte alignment of arrays in the binary blob
+
+_SCENES = {}  # already loaded scenes of this run: (path, option) -> scene
+_LOCKS = defaultdict(threading.Lock)  # (path, option) -> lock, one per scene
+_LOCKS_LOCK = threading.Lock()
+
+
+# ------------ cached scene structures, mimicking the pyassimp ones ----------
+class MaterialProperties(dict):
+    """ material properties, indexed by (key, semantic) or key like pyassimp """
+    def __getitem__(self, key):
+        key, semantic = key if isinstance(key, tuple) else (key, 0)
+        return dict.__getitem__(self, (key, semantic))
+
+    def items(self):
+        for (key, _semantic), value in dict.items(self):
+            yield key, value
+
+
+class SceneObject:
+    """ plain attribute holder for cached scenes, meshes, nodes... """
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+# ------------ conversion from pyassimp to storable arrays + JSON ------------
+class _BlobWriter:
+    """ accumulates arrays into one aligned blob, returns their references """
+    def __init__(self):
+        self.chunks, self.size = [], 0
+
+    def add(self, array, dtype=np.float32):
+        array = np.ascontiguousarray(array, dtype)
+        padding = -self.size % ALIGNMENT
+        self.chunks.append(b'\0' * padding)
+        reference = {'offset': self.size + padding, 'dtype': array.dtype.str,
+                     'shape': list(array.shape)}
+        self.chunks.append(array.tobytes())
+        self.size += padding + array.nbytes
+        return reference
+
+
+def _property_value(value):
+    """ JSON friendly material property value """
+    if isinstance(value, bytes):
+        return {'bytes': value.hex()}
+    return value.tolist() if hasattr(value, 'tolist') else value
+
+
+def _node_name(name):
+    """ pyassimp stores some names as aiString with bytes data """
+    return name.data.decode('utf-8') if hasattr(name, 'data') else str(name)
+
+
+def _keys(blob, keys):
+    """ (times, values) references of a pyassimp key list """
+    return (blob.add([key.time for key in keys], np.float64),
+            blob.add([key.value for key in keys], np.float64))
+
+
+def _convert(scene):
+    """ JSON index and binary blob of a pyassimp scene """
+    blob = _BlobWriter()
+    index = {'version': SCENE_CACHE_VERSION, 'meshes': [], 'materials': [],
+             'animations': []}
+
+    for mesh in scene.meshes:
+        index['meshes'].append({
+            'vertices': blob.add(mesh.vertices),
+            'normals': blob.add(mesh.normals),
+            'faces': blob.add(mesh.faces, np.int32),
+            'texturecoords': blob.add(mesh.texturecoords),
+            'materialindex': int(mesh.materialindex),
+            'bones': [{'name': bone.name,
+                       'offsetmatrix': blob.add(bone.offsetmatrix),
+                       'vertexids': blob.add([w.vertexid for w in bone.weights],
+                                             np.int32),
+                       'weights': blob.add([w.weight for w in bone.weights])}
+                      for bone in mesh.bones]})
+    mesh_ids = {id(mesh): i for i, mesh in enumerate(scene.meshes)}
+
+    for mat in scene.materials:
+        properties = dict.items(mat.properties)
+        index['materials'].append([[key, semantic, _property_value(value)]
+                                   for (key, semantic), value in properties])
+
+    def convert_node(node):
+        return {'name': node.name,
+                'transformation': blob.add(node.transformation),
+                'meshes': [mesh_ids[id(mesh)] for mesh in node.meshes],
+                'children': [convert_node(child) for child in node.children]}
+    index['rootnode'] = convert_node(scene.rootnode)
+
+    for anim in scene.animations:
+        index['animations'].append({
+            'tickspersecond': anim.tickspersecond,
+            'channels': [{'nodename': _node_name(channel.nodename),
+                          'positionkeys': _keys(blob, channel.positionkeys),
+                          'rotationkeys': _keys(blob, channel.rotationkeys),
+                          'scalingkeys': _keys(blob, channel.scalingkeys)}
+                         for channel in anim.channels]})
+    return index, b''.join(blob.chunks)
+
+
+# ------------ cached scene loading -------------------------------------------
+def _read(index_file, blob_file):
+    """ scene objects whose arrays are views on the memory-mapped blob """
+    with open(index_file) as content:
+        index = json.load(content)
+    if os.path.getsize(blob_file):
+        data = np.memmap(blob_file, dtype=np.uint8, mode='r')
+    else:
+        data = np.zeros(0, np.uint8)
+
+    def array(reference):
+        dtype = np.dtype(reference['dtype'])
+        count = int(np.prod(reference['shape']))
+        start = reference['offset']
+        return data[start:start + count * dtype.itemsize].view(dtype) \
+            .reshape(reference['shape'])
+
+    meshes = [SceneObject(
+        vertices=array(mesh['vertices']), normals=array(mesh['normals']),
+        faces=array(mesh['faces']), texturecoords=array(mesh['texturecoords']),
+        materialindex=mesh['materialindex'],
+        bones=[SceneObject(name=bone['name'],
+                           offsetmatrix=array(bone['offsetmatrix']),
+                           vertexids=array(bone['vertexids']),
+                           weights=array(bone['weights']))
+               for bone in mesh['bones']])
+        for mesh in index['meshes']]
+
+    materials = [SceneObject(properties=MaterialProperties(
+        ((key, semantic), bytes.fromhex(value['bytes'])
+         if isinstance(value, dict) else value)
+        for key, semantic, value in properties))
+        for properties in index['materials']]
+
+    def make_node(node):
+        return SceneObject(name=node['name'],
+                           transformation=array(node['transformation']),
+                           meshes=[meshes[i] for i in node['meshes']],
+                           children=[make_node(child)
+                                     for child in node['children']])
+
+    def keys(pair):
+        return SceneObject(times=array(pair[0]), values=array(pair[1]))
+
+    animations = [SceneObject(
+        tickspersecond=anim['tickspersecond'],
+        channels=[SceneObject(nodename=channel['nodename'],
+                              positionkeys=keys(channel['positionkeys']),
+                              rotationkeys=keys(channel['rotationkeys']),
+                              scalingkeys=keys(channel['scalingkeys']))
+                  for channel in anim['channels']])
+        for anim in index['animations']]
+
+    return SceneObject(meshes=meshes, materials=materials,
+                       rootnode=make_node(index['rootnode']),
+                       animations=animations)
+
+
+def load_scene(file, option=DEFAULT_OPTION):
+    """ post-processed scene of 'file', from this run's scenes, else from the
+        disk cache next to it, else parsed by pyassimp and then cached.
+        Returns None if pyassimp cannot load the file. """
+    key = (os.path.abspath(file), option)
+    with _LOCKS_LOCK:
+        lock = _LOCKS[key]
+    with lock:  # a scene requested by several threads is only loaded once
+        if key not in _SCENES:
+            _SCENES[key] = _load_scene(file, option)
+        return _SCENES[key]
+
+
+def _load_scene(file, option):
+    """ cached scene of 'file' from disk, created first if needed """
+    start = perf_counter()
+    try:
+        index_file = cache_file(file, 'scene.json', option, SCENE_CACHE_VERSION)
+    except OSError:
+        print('ERROR: pyassimp unable to load', file)
+        return None
+    blob_file = index_file[:-len('json')] + 'bin'
+    status = 'cache'
+    if not (os.path.exists(index_file) and os.path.exists(blob_file)):
+        try:
+            scene = pyassimp.load(file, option)
+        except pyassimp.errors.AssimpError:
+            print('ERROR: pyassimp unable to load', file)
+            return None
+        index, blob = _convert(scene)
+        pyassimp.release(scene)
+
+        def write_blob(temporary):
+            with open(temporary, 'wb') as output:
+                output.write(blob)
+
+        def write_index(temporary):
+            with open(temporary, 'w') as output:
+                json.dump(index, output)
+
+        # the index is written last: its presence means the blob is complete
+        replace_atomically(blob_file, write_blob)
+        replace_atomically(index_file, write_index)
+        status = 'assimp'
+
+    scene = _read(index_file, blob_file)
+    print('Scene %s\t(%s, %.1f ms)' %
+          (file, status, 1000 * (perf_counter() - start)))
+    return scene
@@ -1,5 +1,7 @@
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+from src.gl import GL               # OpenGL.GL, see src.gl
+import numpy as np                  # all matrix manipulations & OpenGL args
 import os                           # os function, i.e. checking file status
+from src.glstate import STATE
 
 # ------------ low level OpenGL object wrappers ----------------------------
 GEYSER_SHADER_ID = 0
@@ -11,6 +13,34 @@ SKINNING_SHADER_ID = 5
 ARBRE_SHADER_ID = 6
 CONSIGNE_SHADER_ID = 7
 HERBE_SHADER_ID = 8
+GEYSER_INSTANCED_SHADER_ID = 9
+ARBRE_INSTANCED_SHADER_ID = 10
+HERBE_INSTANCED_SHADER_ID = 11
+
+
+def _setter(function, matrix=False):
+    """ upload with GL 'function', looked up at each call so that src.gl
+        may count it. Our matrices are row major numpy arrays => always
+        ask to transpose """
+    if matrix:
+        return lambda location, count, value: getattr(GL, function)(
+            location, count, True, value)
+    return lambda location, count, value: getattr(GL, function)(
+        location, count, value)
+
+# GLSL uniform type -> (upload function, components per element, numpy type)
+UNIFORM_SETTERS = {
+    GL.GL_FLOAT: (_setter('glUniform1fv'), 1, np.float32),
+    GL.GL_FLOAT_VEC2: (_setter('glUniform2fv'), 2, np.float32),
+    GL.GL_FLOAT_VEC3: (_setter('glUniform3fv'), 3, np.float32),
+    GL.GL_FLOAT_VEC4: (_setter('glUniform4fv'), 4, np.float32),
+    GL.GL_FLOAT_MAT3: (_setter('glUniformMatrix3fv', True), 9, np.float32),
+    GL.GL_FLOAT_MAT4: (_setter('glUniformMatrix4fv', True), 16, np.float32),
+    GL.GL_INT: (_setter('glUniform1iv'), 1, np.int32),
+    GL.GL_BOOL: (_setter('glUniform1iv'), 1, np.int32),
+    GL.GL_SAMPLER_2D: (_setter('glUniform1iv'), 1, np.int32),
+}
+
 
 class Shader:
     """ Helper class to create and automatically destroy shader program """
@@ -49,10 +79,51 @@ class Shader:
                 GL.glDeleteProgram(self.glid)
                 self.glid = None
 
+        # uniform name -> (location, setter, components, type), queried once
+        self.uniforms = {}
+        self.values = {}  # bytes of the last value uploaded per uniform name
+        if self.glid:
+            self._record_uniforms()
+
+    def _record_uniforms(self):
+        """ Store location and upload function of every active uniform """
+        count = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)
+        for index in range(count):
+            name, size, uniform_type = GL.glGetActiveUniform(self.glid, index)
+            name = name.decode('ascii')
+            if uniform_type not in UNIFORM_SETTERS:
+                continue
+            setter = UNIFORM_SETTERS[uniform_type]
+            location = GL.glGetUniformLocation(self.glid, name)
+            if name.endswith('[0]'):  # arrays: whole array and each element
+                base = name[:-3]
+                self.uniforms[base] = (location,) + setter
+                for i in range(1, size):
+                    element = '%s[%d]' % (base, i)
+                    element_loc = GL.glGetUniformLocation(self.glid, element)
+                    self.uniforms[element] = (element_loc,) + setter
+            self.uniforms[name] = (location,) + setter
+
+    def set(self, name, value):
+        """ Upload uniform 'name' of this (in use) program, if it is active
+            and if 'value' differs from the last value uploaded. Arrays
+            are uploaded whole when given a stack of values. """
+        uniform = self.uniforms.get(name)
+        if uniform is None:  # unknown, or optimized out by the GLSL compiler
+            return
+        location, setter, components, dtype = uniform
+        value = np.ascontiguousarray(value, dtype)
+        data = value.tobytes()  # cheaper to compare, and uploaded as is
+        if self.values.get(name) == data:
+            return
+        self.values[name] = data
+        setter(location, max(value.size // components, 1), data)
+
     def __del__(self):
-        GL.glUseProgram(0)
+        STATE.use_program(0)
         if self.glid:                      # if this is a valid shader object
             GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
+            STATE.deleted(program=self.glid)
 
 
 # ------------  Simple illumination shaders ----------------------
@@ -60,6 +131,7 @@ LAMBERTIAN_VERT = """#version 330 core
 uniform float facteur;
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
+layout(location = 2) in vec3 texPosition;  // object space, for texturing
 uniform mat4 viewMatrix;
 uniform mat4 modelMatrix;
 uniform mat4 projMatrix;
@@ -70,7 +142,7 @@ void main() {
     mat4 modV = viewMatrix * modelMatrix;
     mat3 M = mat3(vec3(modV[0]), vec3(modV[1]), vec3(modV[2]));
     outNormal = transpose(inverse(M)) * normal;
-    fragTexCoord = vec2(position[0], position[1])/facteur;
+    fragTexCoord = vec2(texPosition[0], texPosition[1])/facteur;
 }"""
 
 LAMBERTIAN_FRAG = """#version 330 core
@@ -190,6 +262,69 @@ void main() {
     color = col;
 }
 
+""" % {"particle_per_time" : PARTICLE_PER_TIME,
+        "time_rising" : TIME_RISING}
+
+# same geyser, but every particle of every geyser is an instance of one draw
+# call. Per particle constants (see ParticleMesh) and per geyser data
+# (start time, charge) come from instance attributes instead of uniforms
+GEYSER_INSTANCED_VERT = """#version 330 core
+layout(location = 0) in vec3 position;
+// id, horizontal speed, height ratio, rising speed
+layout(location = 3) in vec4 particle;
+layout(location = 4) in vec3 base_scale;
+layout(location = 5) in mat3 rotation;      // uses locations 5, 6 and 7
+layout(location = 8) in vec2 geyser;        // start time, charge
+uniform mat4 viewMatrix;
+uniform mat4 projMatrix;
+uniform float time;
+out vec3 cubePos;
+flat out float id_particle;
+flat out float time_geyser;
+
+void main() {
+    cubePos = position;
+    id_particle = particle.x;
+    time_geyser = time - geyser.x;
+
+    float temps_propre = max(time_geyser - particle.x/%(particle_per_time)f, 0);
+    vec3 pos = rotation * (position * base_scale * pow(1.5 + temps_propre, 1.3));
+
+    const vec2 dir_vent = vec2(0.3, 0.2);
+    vec2 depl_h = particle.y * dir_vent * temps_propre;
+    const float time_rising = %(time_rising)f;
+    float time_borne = min(temps_propre, time_rising) / time_rising;
+    float pos_z = time_borne * particle.w * geyser.y * particle.z
+            * (0.9 - time_borne*time_borne/3) - 4;
+
+    gl_Position = projMatrix * viewMatrix * vec4(pos + vec3(depl_h, pos_z), 1);
+}
+""" % {"particle_per_time" : PARTICLE_PER_TIME,
+        "time_rising" : TIME_RISING}
+
+GEYSER_INSTANCED_FRAG = """#version 330 core
+in vec3 cubePos;
+flat in float id_particle;
+flat in float time_geyser;
+out vec4 color;
+
+float transparence(vec3 pos){
+    float rayon = 0.5 + sin(id_particle + time_geyser) / 5;
+    float distance_centre = (length(pos) - 1) / (sqrt(3.) - 1);
+    if (distance_centre > rayon) {
+        return 0.0;
+    } else {
+        float fading = max(0, time_geyser - %(time_rising)f);
+        return exp(-fading - 1 - 1/(1 - distance_centre/rayon));
+    }
+}
+
+void main() {
+    if (time_geyser < id_particle/%(particle_per_time)f) {
+        discard;
+    }
+    color = vec4(0.8, 1, 0.8, transparence(cubePos));
+}
 """ % {"particle_per_time" : PARTICLE_PER_TIME,
         "time_rising" : TIME_RISING}
 
@@ -278,6 +413,7 @@ uniform int axe;
 // ---- skinning globals and attributes
 const int MAX_VERTEX_BONES=%d, MAX_BONES=%d;
 uniform mat4 boneMatrix[MAX_BONES];
+uniform mat3 boneNormalMatrix[MAX_BONES];  // view space, computed on the CPU
 out vec3 outNormal;
 out vec2 fragTexCoord;
 
@@ -302,9 +438,11 @@ void main() {
     vec4 wPosition4 = skinMatrix * vec4(position, 1.0);
     gl_Position = projection * view * wPosition4;
 
-    mat4 modV = view * skinMatrix;
-    mat3 M = mat3(vec3(modV[0]), vec3(modV[1]), vec3(modV[2]));
-    outNormal = transpose(inverse(M)) * normale;
+    mat3 normalMatrix = weight.x*boneNormalMatrix[int(bone_ids[0])]
+                      + weight.y*boneNormalMatrix[int(bone_ids[1])]
+                      + weight.z*boneNormalMatrix[int(bone_ids[2])]
+                      + weight.w*boneNormalMatrix[int(bone_ids[3])];
+    outNormal = normalMatrix * normale;
 
     float latitude =  - (position[1+axe]/2 - 0.5);
     float longitude = atan(abs(position[2-axe])/abs((position[0])))*2 ;
@@ -360,6 +498,7 @@ ARBRE_VERT = """#version 330 core
 uniform float facteur;
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
+layout(location = 2) in vec3 texPosition;  // object space, for texturing
 uniform mat4 viewMatrix;
 uniform mat4 modelMatrix;
 uniform mat4 projMatrix;
@@ -370,8 +509,28 @@ void main() {
     mat4 modV = viewMatrix * modelMatrix;
     mat3 M = mat3(vec3(modV[0]), vec3(modV[1]), vec3(modV[2]));
     outNormal = transpose(inverse(M)) * normal;
-    float longitude = atan(abs(position[1])/abs((position[0])))*2 ;
-    fragTexCoord = vec2(longitude, position[2])/facteur;
+    float longitude = atan(abs(texPosition[1])/abs((texPosition[0])))*2 ;
+    fragTexCoord = vec2(longitude, texPosition[2])/facteur;
+}"""
+
+ARBRE_INSTANCED_VERT = """#version 330 core
+uniform float facteur;
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec3 normal;
+layout(location = 2) in vec3 texPosition;  // object space, for texturing
+layout(location = 3) in mat4 instanceMatrix;  // uses locations 3 to 6
+uniform mat4 viewMatrix;
+uniform mat4 modelMatrix;
+uniform mat4 projMatrix;
+out vec3 outNormal;
+out vec2 fragTexCoord;
+void main() {
+    mat4 modV = viewMatrix * modelMatrix * instanceMatrix;
+    gl_Position = projMatrix * modV * vec4(position, 1);
+    mat3 M = mat3(vec3(modV[0]), vec3(modV[1]), vec3(modV[2]));
+    outNormal = transpose(inverse(M)) * normal;
+    float longitude = atan(abs(texPosition[1])/abs((texPosition[0])))*2 ;
+    fragTexCoord = vec2(longitude, texPosition[2])/facteur;
 }"""
 
 # ------------  Herbe shaders ----------------------
@@ -379,6 +538,7 @@ HERBE_VERT = """#version 330 core
 uniform float facteur;
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
+layout(location = 2) in vec3 texPosition;  // object space, for texturing
 uniform mat4 viewMatrix;
 uniform mat4 modelMatrix;
 uniform mat4 projMatrix;
@@ -389,7 +549,27 @@ void main() {
     //mat4 modV = viewMatrix * modelMatrix;
     //mat3 M = mat3(vec3(modV[0]), vec3(modV[1]), vec3(modV[2]));
     //outNormal = transpose(inverse(M)) * normal;
-    fragTexCoord = 60.0*vec2((position[0]+1)/1.2, (position[1]-1)/1.25)/facteur;
+    fragTexCoord = 60.0*vec2((texPosition[0]+1)/1.2, (texPosition[1]-1)/1.25)/facteur;
+}"""
+
+HERBE_INSTANCED_VERT = """#version 330 core
+uniform float facteur;
+layout(location = 0) in vec3 position;
+layout(location = 2) in vec3 texPosition;  // object space, for texturing
+layout(location = 3) in vec4 placement;    // tuft position, angle around y
+layout(location = 4) in float size;
+uniform mat4 viewMatrix;
+uniform mat4 modelMatrix;
+uniform mat4 projMatrix;
+out vec2 fragTexCoord;
+void main() {
+    // same placement as creer_herbe: translate @ rotate y @ rotate x 90 @ scale
+    vec3 tuft = size * vec3(position.x, -position.z, position.y);
+    float c = cos(placement.w), s = sin(placement.w);
+    tuft = vec3(c*tuft.x + s*tuft.z, tuft.y, c*tuft.z - s*tuft.x);
+    gl_Position = projMatrix * viewMatrix * modelMatrix
+                * vec4(tuft + placement.xyz, 1);
+    fragTexCoord = 60.0*vec2((texPosition[0]+1)/1.2, (texPosition[1]-1)/1.25)/facteur;
 }"""
 
 HERBE_FRAG = """#version 330 core
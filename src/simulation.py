@@ -0,0 +1,46 @@
+"""
+Fixed timestep simulation: interactive objects are advanced by constant
+steps, whatever the frame rate, and drawn interpolated between their last
+two states. Long frames are caught up with several steps, up to a limit
+past which the simulation slows down rather than spending ever more time
+catching up.
+"""
+from src.clock import get_time
+
+SIMULATION_RATE = 120  # steps per second
+MAX_STEPS = 8          # steps per frame at most
+
+
+class Simulation:
+    """ advances the objects added, having a simulate(dt) method, by steps
+        of 1 / 'rate' seconds. 'interpolation' is the fraction of a step
+        elapsed since the last one, to draw objects between their previous
+        and current states. """
+    def __init__(self, rate=SIMULATION_RATE, max_steps=MAX_STEPS):
+        self.step = 1 / rate
+        self.max_steps = max_steps
+        self.objects = []
+        self.last = None         # clock time of the last advance
+        self.accumulator = 0     # time not simulated yet, less than a step
+        self.interpolation = 1.
+        self.steps, self.dropped = 0, 0  # in the last advance, and in total
+
+    def add(self, simulated):
+        self.objects.append(simulated)
+
+    def advance(self, now=None):
+        """ simulate up to time 'now', the clock time by default. The first
+            call only starts the simulation. """
+        now = get_time() if now is None else now
+        if self.last is not None:
+            self.accumulator += now - self.last
+        self.last = now
+        self.steps = min(int(self.accumulator / self.step), self.max_steps)
+        for _ in range(self.steps):
+            for simulated in self.objects:
+                simulated.simulate(self.step)
+        self.accumulator -= self.steps * self.step
+        if self.accumulator >= self.step:  # too far behind: give up the rest
+            self.dropped += int(self.accumulator / self.step)
+            self.accumulator %= self.step
+        self.interpolation = self.accumulator / self.step
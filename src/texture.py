@@ -1,19 +1,25 @@
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+from src.gl import GL               # OpenGL.GL, see src.gl
 import numpy as np                  # all matrix manipulations & OpenGL args
+import os                           # os function, i.e. checking file status
+from collections import OrderedDict  # least recently used eviction order
 from PIL import Image
+from src.cache import file_hash
+from src.glstate import STATE
 
 # -------------- OpenGL Texture Wrapper ---------------------------------------
 class Texture:
     """ Helper class to create and automatically destroy textures """
     def __init__(self, file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
-                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, image=None):
         self.glid = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+        self.size = 0  # estimated GPU memory, in bytes
+        STATE.bind_texture(self.glid)
         # helper array stores texture format for every pixel size 1..4
         format = [GL.GL_LUMINANCE, GL.GL_LUMINANCE_ALPHA, GL.GL_RGB, GL.GL_RGBA]
         try:
-            # imports image as a numpy array in exactly right format
-            tex = np.array(Image.open(file))
+            # imports image as a numpy array in exactly right format,
+            # unless already decoded (e.g. by a loading thread)
+            tex = np.array(Image.open(file)) if image is None else image
             format = format[0 if len(tex.shape) == 2 else tex.shape[2] - 1]
             GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tex.shape[1],
                             tex.shape[0], 0, format, GL.GL_UNSIGNED_BYTE, tex)
@@ -23,11 +29,125 @@ class Texture:
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, min_filter)
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
             GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+            self.size = tex.shape[0] * tex.shape[1] * 4 * 4 // 3  # + mipmaps
             message = 'Loaded texture %s\t(%s, %s, %s, %s)'
             print(message % (file, tex.shape, wrap_mode, min_filter, mag_filter))
         except FileNotFoundError:
             print("ERROR: unable to load texture file %s" % file)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        STATE.bind_texture(0)
+
+    def delete(self):
+        """ destroy the GL texture now, even if the object stays alive """
+        if self.glid:
+            GL.glDeleteTextures(self.glid)
+            STATE.deleted(texture=self.glid)
+            self.glid = 0
 
     def __del__(self):  # delete GL texture from GPU when object dies
-        GL.glDeleteTextures(self.glid)
+        self.delete()
+
+
+# -------------- Shared textures ----------------------------------------------
+class TextureRegistry:
+    """ Textures shared by all loaders: files are deduplicated by resolved
+        path and content hash, and reference counted, the meshes drawn with
+        them being their users (see src.meshes.TextureHolder). Textures
+        nobody uses anymore are kept for reuse until the estimated GPU
+        memory exceeds 'budget' bytes, then destroyed least recently used
+        first. """
+    def __init__(self, budget=512 << 20):
+        self.budget = budget
+        self.memory = 0          # estimated memory of all textures kept
+        self.hashes = {}         # real path -> content hash
+        self.images = {}         # real path -> image decoded by prefetch
+        self.textures = {}       # (content hash, options) -> Texture
+        self.contents = set()    # content hashes of the textures created
+        self.references = {}     # texture key -> number of users
+        self.unused = OrderedDict()  # texture key -> Texture, LRU first
+        self.indexes = {}        # root directory -> {file name: path}
+
+    def index(self, root):
+        """ file name -> path of every file under 'root', walked once """
+        if root not in self.indexes:
+            index = self.indexes[root] = {}
+            for directory, _, files in os.walk(root):
+                for name in files:
+                    index.setdefault(name, os.path.join(directory, name))
+        return self.indexes[root]
+
+    def find(self, name, root):
+        """ path of the file 'name' under 'root', as exported paths are
+            often broken: exact file name first, then a name prefix match """
+        name = name.split('/')[-1].split('\\')[-1]
+        index = self.index(root)
+        if name in index:
+            return index[name]
+        return next((path for file, path in index.items()
+                     if name.startswith(file) or file.startswith(name)), None)
+
+    def prefetch(self, file):
+        """ hash and decode 'file' ahead of acquire(), from any thread: only
+            single dict assignments, atomic in CPython, touch the registry """
+        path = os.path.realpath(file)
+        try:
+            self.hashes[path] = file_hash(file)
+            if self.hashes[path] in self.contents:  # already on the GPU
+                return
+            self.images[path] = np.array(Image.open(file))
+        except OSError:  # Texture reports the missing file
+            pass
+
+    def acquire(self, file, **options):
+        """ shared Texture of 'file' (Texture options as keywords), created
+            on first use. Call release(texture) once it is not used anymore """
+        path = os.path.realpath(file)
+        if path not in self.hashes:
+            try:
+                self.hashes[path] = file_hash(file)
+            except OSError:  # Texture reports the missing file
+                self.hashes[path] = path
+        key = (self.hashes[path], tuple(sorted(options.items())))
+        image = self.images.pop(path, None)  # not kept once acquired
+        texture = self.textures.get(key)
+        if texture is None:
+            texture = self.textures[key] = Texture(file, image=image, **options)
+            self.contents.add(key[0])
+            self.memory += texture.size
+            texture.key = key
+        self.unused.pop(key, None)
+        self.references[key] = self.references.get(key, 0) + 1
+        self.evict()
+        return texture
+
+    def retain(self, texture):
+        """ one user more for 'texture', already acquired. Returns it """
+        key = getattr(texture, 'key', None)
+        if key is not None:  # textures not made by a registry are not counted
+            self.unused.pop(key, None)
+            self.references[key] = self.references.get(key, 0) + 1
+        return texture
+
+    def release(self, texture):
+        """ one user less for 'texture', kept for reuse if within budget """
+        key = getattr(texture, 'key', None)
+        if key is None or key not in self.references:
+            return
+        self.references[key] -= 1
+        if self.references[key] == 0:
+            del self.references[key]
+            self.unused[key] = texture
+            self.evict()
+
+    def evict(self):
+        """ destroy unused textures, least recently used first, until the
+            memory budget is respected """
+        while self.memory > self.budget and self.unused:
+            key, texture = self.unused.popitem(last=False)
+            del self.textures[key]
+            if not any(other[0] == key[0] for other in self.textures):
+                self.contents.discard(key[0])
+            self.memory -= texture.size
+            texture.delete()
+
+
+TEXTURES = TextureRegistry()  # default registry, used by the loaders
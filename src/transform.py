@@ -232,6 +232,15 @@ class Trackball:
         z_range = vec(0.1, 100) * self.distance  # proportion to dist
         return perspective(35, winsize[0] / winsize[1], *z_range)
 
+    def ray(self, position2d, winsize):
+        """ (origin, unit direction) in world coordinates of the view ray
+            through window position 'position2d', y axis pointing up """
+        ndc = 2 * vec(position2d) / vec(winsize) - 1
+        inverse = np.linalg.inv(self.projection_matrix(winsize) @ self.view_matrix())
+        near, far = (inverse @ vec(*ndc, depth, 1) for depth in (-1, 1))
+        near, far = near[:3] / near[3], far[:3] / far[3]
+        return near, normalized(far - near)
+
     def matrix(self):
         """ Rotational component of trackball position """
         return quaternion_matrix(self.rotation)
@@ -1,5 +1,7 @@
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+import ctypes                       # byte offsets of interleaved attributes
+from src.gl import GL               # OpenGL.GL, see src.gl
 import numpy as np                  # all matrix manipulations & OpenGL args
+from src.glstate import STATE
 
 
 class VertexArray:
@@ -10,7 +12,7 @@ class VertexArray:
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
+        STATE.bind_vertex_array(self.glid)
         self.buffers = []  # we will store buffers in a list
         nb_primitives, size = 0, 0
 
@@ -21,7 +23,7 @@ class VertexArray:
 
             # bind a new vbo, upload its data to GPU, declare its size and type
             self.buffers += [GL.glGenBuffers(1)]
-            data = np.array(data, np.float32, copy=False)
+            data = np.ascontiguousarray(data, dtype=np.float32)
             nb_primitives, size = data.shape
             GL.glEnableVertexAttribArray(loc)  # activates for current vao only
             GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
@@ -29,28 +31,77 @@ class VertexArray:
             GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
 
         # optionally create and upload an index buffer for this object
-        self.draw_command = GL.glDrawArrays
+        self.draw_command = 'glDrawArrays'  # GL functions, see call
+        self.instanced_command = 'glDrawArraysInstanced'
         self.arguments = (0, nb_primitives)
         if index is not None:
             self.buffers += [GL.glGenBuffers(1)]
-            index_buffer = np.array(index, np.int32, copy=False)
+            index_buffer = np.ascontiguousarray(index, dtype=np.int32)
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
-            self.draw_command = GL.glDrawElements
+            self.draw_command = 'glDrawElements'
+            self.instanced_command = 'glDrawElementsInstanced'
             self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
 
         # cleanup and unbind so no accidental subsequent state update
-        GL.glBindVertexArray(0)
+        STATE.bind_vertex_array(0)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
         GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
 
+    def add_instance_buffer(self, layout, data, divisor=1,
+                            usage=GL.GL_DYNAMIC_DRAW):
+        """ Interleaved per-instance attributes. 'layout' lists the
+            (location, size) of each attribute, in the column order of the
+            (instances, sum of sizes) 'data' array. Each row is used by
+            'divisor' consecutive instances. Returns the buffer id. """
+        STATE.bind_vertex_array(self.glid)
+        self.buffers += [GL.glGenBuffers(1)]
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
+
+        stride, offset = 4 * sum(size for _, size in layout), 0
+        for loc, size in layout:
+            GL.glEnableVertexAttribArray(loc)
+            GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, stride,
+                                     ctypes.c_void_p(offset))
+            GL.glVertexAttribDivisor(loc, divisor)
+            offset += 4 * size
+
+        STATE.bind_vertex_array(0)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        return self.buffers[-1]
+
+    @staticmethod
+    def update_buffer(buffer, data, usage=GL.GL_DYNAMIC_DRAW):
+        """ replace the whole content of a buffer, its size may change """
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER,
+                        np.ascontiguousarray(data, dtype=np.float32), usage)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
     def draw(self, primitive):
         """draw a vertex array, either as direct array or indexed array"""
-        GL.glBindVertexArray(self.glid)
-        self.draw_command(primitive, *self.arguments)
-        # GL.glBindVertexArray(0)
+        STATE.bind_vertex_array(self.glid)
+        self.call(primitive)
+
+    def draw_instanced(self, primitive, instances):
+        """draw 'instances' copies of the vertex array in a single call"""
+        STATE.bind_vertex_array(self.glid)
+        self.call(primitive, instances)
+
+    def call(self, primitive, instances=None):
+        """draw call only, this vertex array being already bound, of
+        'instances' copies if not None. GL functions are looked up at each
+        call so that src.gl may count them"""
+        if instances is None:
+            getattr(GL, self.draw_command)(primitive, *self.arguments)
+        else:
+            getattr(GL, self.instanced_command)(primitive, *self.arguments,
+                                                instances)
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
         GL.glDeleteVertexArrays(1, [self.glid])
+        STATE.deleted(vertex_array=self.glid)
         GL.glDeleteBuffers(len(self.buffers), self.buffers)
 
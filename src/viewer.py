@@ -7,41 +7,59 @@ import os                           # os function, i.e. checking file status
 import sys
 
 # External, non built-in modules
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+from src.gl import GL, GL_CALLS     # OpenGL.GL, see src.gl
 import glfw                         # lean window system wrapper for OpenGL
+from src.clock import get_time
 import numpy as np                  # all matrix manipulations & OpenGL args
 from itertools import cycle
 from src.transform import translate, rotate, scale, vec, frustum, perspective, Trackball, identity
 from src.interaction import GLFWTrackball
 from src.shader import *
+from src.bounds import Frustum, CullStats
+from src.bvh import BVH
+from src.render_queue import RenderQueue
+from src.glstate import STATE
+from src.node import Node, bounds_of
+from src.simulation import Simulation
+from src.profiler import PROFILER
 
 
 # ------------  Viewer class & window management ------------------------------
 class Viewer:
-    """ GLFW viewer window, with classic initialization & graphics loop """
+    """ GLFW viewer window, with classic initialization & graphics loop.
+        An 'offscreen' viewer has no window: it draws 'frames' frames, or
+        until closed, into a framebuffer, see src.offscreen """
 
-    def __init__(self, width=640, height=480):
+    def __init__(self, width=640, height=480, offscreen=False, frames=None):
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
         self.vitesse_charge = 50
-        glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
-        glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
-        glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
-        glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
-        glfw.window_hint(glfw.RESIZABLE, False)
         new_sample = 32
-        glfw.window_hint(glfw.SAMPLES, new_sample) # MSAA: color buffer contains 4 subsamples per screen coordinate (all buffers size are increased by 4)
-        self.win = glfw.create_window(width, height, 'Viewer', None, None)
         self.offset_time_for_loading = 0
         self.is_charging_geyser = False
         self.skybox = None
+        self.frames, self.frame = frames, 0  # frames to draw, frames drawn
+        self.win, self.context = None, None
+        if offscreen:
+            from src.offscreen import OffscreenContext
+            self.context = OffscreenContext(width, height, samples=new_sample)
+        else:
+            glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+            glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+            glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
+            glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+            glfw.window_hint(glfw.RESIZABLE, False)
+            glfw.window_hint(glfw.SAMPLES, new_sample) # MSAA: color buffer contains 4 subsamples per screen coordinate (all buffers size are increased by 4)
+            self.win = glfw.create_window(width, height, 'Viewer', None, None)
 
-        self.trackball = GLFWTrackball(self.win)
-        # make win's OpenGL context current; no OpenGL calls can happen before
-        glfw.make_context_current(self.win)
+        # no callbacks are registered without window
+        self.trackball = GLFWTrackball(self.win, on_pick=self.pick)
+        if self.win is not None:
+            # make win's OpenGL context current; no OpenGL calls can happen before
+            glfw.make_context_current(self.win)
 
-        # register event handlers
-        glfw.set_key_callback(self.win, self.on_key)
+            # register event handlers
+            glfw.set_key_callback(self.win, self.on_key)
 
         # useful message to check OpenGL renderer characteristics
         print('OpenGL', GL.glGetString(GL.GL_VERSION).decode() + ', GLSL',
@@ -52,21 +70,27 @@ class Viewer:
         GL.glClearColor(0.1, 0.1, 0.1, 0.1)
 
         # GL.glEnable(GL.GL_CULL_FACE)
-        GL.glEnable(GL.GL_MULTISAMPLE) # MSAA: Enable multisampling
-        GL.glEnable(GL.GL_DEPTH_TEST)
+        STATE.enable(GL.GL_MULTISAMPLE) # MSAA: Enable multisampling
+        STATE.enable(GL.GL_DEPTH_TEST)
 
         # compile and initialize shader programs once globally
         self.color_shader = Shader(COLOR_VERT, COLOR_FRAG)
         self.lambertian_shader = Shader(LAMBERTIAN_VERT, LAMBERTIAN_FRAG)
         self.geyser_shader = Shader(GEYSER_PARTICLE_VERT, GEYSER_PARTICLE_FRAG)
+        self.geyser_instanced_shader = Shader(GEYSER_INSTANCED_VERT,
+                                              GEYSER_INSTANCED_FRAG)
         self.skybox_shader = Shader(SKYBOX_VERT, SKYBOX_FRAG)
         self.ui_shader = Shader(UI_VERT, UI_FRAG)
         self.consigne_shader = Shader(CONSIGNE_VERT, CONSIGNE_FRAG)
         self.skinnning_shader = Shader(SKINNING_VERT, LAMBERTIAN_FRAG)
         self.arbre_shader = Shader(ARBRE_VERT, LAMBERTIAN_FRAG)
+        self.arbre_instanced_shader = Shader(ARBRE_INSTANCED_VERT,
+                                             LAMBERTIAN_FRAG)
         self.herbe_shader = Shader(HERBE_VERT, HERBE_FRAG)
+        self.herbe_instanced_shader = Shader(HERBE_INSTANCED_VERT, HERBE_FRAG)
         self.shaders = {}
         self.shaders[GEYSER_SHADER_ID] = self.geyser_shader
+        self.shaders[GEYSER_INSTANCED_SHADER_ID] = self.geyser_instanced_shader
         self.shaders[LAMBERTIAN_SHADER_ID] = self.lambertian_shader
         #  self.shaders[COLOR_SHADER_ID] = self.color_shader
         self.shaders[SKYBOX_SHADER_ID] = self.skybox_shader
@@ -74,24 +98,156 @@ class Viewer:
         self.shaders[CONSIGNE_SHADER_ID] = self.consigne_shader
         self.shaders[SKINNING_SHADER_ID] = self.skinnning_shader
         self.shaders[ARBRE_SHADER_ID] = self.arbre_shader
+        self.shaders[ARBRE_INSTANCED_SHADER_ID] = self.arbre_instanced_shader
         self.shaders[HERBE_SHADER_ID] = self.herbe_shader
+        self.shaders[HERBE_INSTANCED_SHADER_ID] = self.herbe_instanced_shader
         self.particle_system = None
         self.elements_interacting = []
         self.elements_UI = []
 
         # initially empty list of object to draw
         self.drawables = []
+        # constant root matrix: an unchanged object lets nodes keep their
+        # cached world matrices from one frame to the next
+        self.model = np.matrix(rotate(angle=90))
+        self.cull_stats = CullStats()  # drawables drawn and culled last frame
+        self.queue = RenderQueue()  # draw calls of a frame, sorted by state
+        self.loader = None  # startup assets still loading, see load()
+        self.index = None    # BVH over the world bounds of scene objects
+        self.indexed = []    # scene objects of the BVH, in item order
+        self.index_key = None  # scene state the BVH was built for
+        self.picked = None   # scene object under the last right click
+        self.on_frame = []   # functions called with the frame number first
+        self.simulation = Simulation()  # objects with a simulate(dt) method
+
+    def load(self, loader, budget=1/60):
+        """ show a loading screen while 'loader' finishes its assets, using
+            about 'budget' seconds of each frame for their uploads """
+        self.loader, self.loading_budget = loader, budget
+
+    def draw_loading(self):
+        """ loading screen: the UI gauge shows the loading progress """
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        for elem_ui in self.elements_UI:
+            elem_ui.set_charge(self.loader.progress())
+            elem_ui.draw(identity(), identity(), identity(), shaders=self.shaders,
+                         win=self.win)
+
+    def update_index(self):
+        """ (re)build the BVH when scene objects were added or changed.
+            Objects without bounds are never culled nor picked. """
+        key = (len(self.drawables), len(self.elements_interacting),
+               Node.structure, Node.moved)
+        if key == self.index_key:
+            return
+        self.index_key, self.indexed, boxes = key, [], []
+        for drawable in self.drawables + self.elements_interacting:
+            bounds = getattr(drawable, 'world_bounds', None)
+            if bounds is None:  # movers not drawn yet: placed at model origin
+                bounds = bounds_of(drawable)
+                bounds = bounds and bounds.transformed(self.model)
+            if bounds is not None:
+                self.indexed.append(drawable)
+                boxes.append((bounds.lower, bounds.upper))
+        self.movers = [i for i, drawable in enumerate(self.indexed)
+                       if getattr(drawable, 'moving', False)]
+        boxes = np.array(boxes).reshape(-1, 2, 3)
+        self.index = BVH(boxes[:, 0], boxes[:, 1])
+
+    def hidden(self, frustum):
+        """ ids of the static scene objects outside 'frustum'. Moving ones
+            are always drawn, they update their position when drawn. """
+        self.update_index()
+        seen = np.zeros(len(self.indexed), bool)
+        seen[self.index.query_frustum(frustum)] = True
+        seen[self.movers] = True
+        return {id(self.indexed[i]) for i in np.nonzero(~seen)[0]}
+
+    def refit_movers(self):
+        """ move the boxes of moving objects to where they were drawn """
+        movers = [i for i in self.movers
+                  if self.indexed[i].world_bounds is not None]
+        if movers:
+            bounds = [self.indexed[i].world_bounds for i in movers]
+            self.index.refit(movers, [b.lower for b in bounds],
+                             [b.upper for b in bounds])
+
+    def pick(self, origin, direction):
+        """ select the scene object whose box is first hit by the ray """
+        if self.index is None:
+            return
+        item, distance = self.index.ray_cast(origin, direction)
+        self.picked = None if item is None else self.indexed[item]
+        if self.picked is not None:
+            print('Picked %s at %.1f' % (type(self.picked).__name__, distance))
+
+    def window_size(self):
+        """ size in pixels of the window, or of the offscreen framebuffer """
+        if self.context is not None:
+            return self.context.size
+        return glfw.get_window_size(self.win)
+
+    def close(self):
+        """ stop drawing frames: close the window, or end offscreen runs """
+        if self.win is not None:
+            glfw.set_window_should_close(self.win, True)
+        else:
+            self.frames = self.frame
+
+    def should_close(self):
+        """ window closed, or all the requested frames drawn """
+        if self.frames is not None and self.frame >= self.frames:
+            return True
+        return self.win is not None and glfw.window_should_close(self.win)
+
+    def end_frame(self):
+        """ show the frame drawn and process events """
+        if self.context is not None:
+            self.context.swap_buffers()
+            return
+        # flush render commands, and swap draw buffers
+        glfw.swap_buffers(self.win)
+
+        # Poll for and process events
+        glfw.poll_events()
+
+    def screenshot(self, path):
+        """ save the last frame drawn offscreen as an image file """
+        self.context.save(path)
 
     def run(self):
-        """ Main render loop for this OpenGL window """
-        while not glfw.window_should_close(self.win):
+        """ Main render loop for this OpenGL window. Loading screen frames
+            do not count in the offscreen frames. """
+        while not self.should_close():
+            if self.loader is not None:
+                if self.loader.pump(self.loading_budget):
+                    self.draw_loading()
+                    self.end_frame()
+                    continue
+                self.loader = None
+
+            for function in self.on_frame:
+                function(self.frame)
+            PROFILER.begin_frame()
+            GL_CALLS.begin_frame(self.frame)
+
+            # advance the simulation to now, by fixed steps
+            PROFILER.phase('simulate')
+            self.simulation.advance()
+            interpolation = self.simulation.interpolation
+
             # clear draw buffer
-            ModelMat = np.matrix(rotate(angle=90))
-            winsize = glfw.get_window_size(self.win)
+            PROFILER.phase('cull')
+            ModelMat = self.model
+            winsize = self.window_size()
             view = self.trackball.view_matrix()
             view_vec = self.trackball.view_vector()
             projection = self.trackball.projection_matrix(winsize)
+            frustum = Frustum(projection @ view)
+            self.cull_stats.reset()
+            hidden = self.hidden(frustum)
 
+            PROFILER.phase('skybox')
             if self.skybox is None:
                 GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
             else:
@@ -100,22 +256,39 @@ class Viewer:
                 #TODO mettre la distance ici
                 self.skybox.draw(projection, view_skybox, ModelMat,
                               shaders=self.shaders, win=self.win,
-                              view_vector=view_vec)
+                              view_vector=view_vec, queue=self.queue)
 
-            # draw our scene objects
+            # submit our scene objects draw calls
+            PROFILER.phase('scene')
             for drawable in self.drawables:
-                drawable.draw(projection, view, ModelMat,
-                              shaders=self.shaders, win=self.win,
-                              view_vector=view_vec)
+                if id(drawable) in hidden:
+                    self.cull_stats.culled += 1
+                    continue
+                with PROFILER.detail(type(drawable).__name__):
+                    drawable.draw(projection, view, ModelMat,
+                                  shaders=self.shaders, win=self.win,
+                                  view_vector=view_vec, frustum=frustum,
+                                  cull_stats=self.cull_stats,
+                                  distance=self.trackball.distance,
+                                  interpolation=interpolation, queue=self.queue)
 
             for elem_interact in self.elements_interacting:
-                elem_interact.draw(projection, view, ModelMat,
-                              shaders=self.shaders, win=self.win,
-                              view_vector=view_vec)
+                if id(elem_interact) in hidden:
+                    self.cull_stats.culled += 1
+                    continue
+                with PROFILER.detail(type(elem_interact).__name__):
+                    elem_interact.draw(projection, view, ModelMat,
+                                  shaders=self.shaders, win=self.win,
+                                  view_vector=view_vec, frustum=frustum,
+                                  cull_stats=self.cull_stats,
+                                  distance=self.trackball.distance,
+                                  interpolation=interpolation, queue=self.queue)
+            self.refit_movers()
 
+            PROFILER.phase('ui')
 
             if self.is_charging_geyser:
-                charge = min(self.vitesse_charge*(glfw.get_time() - self.offset_time_for_loading), 50)  / 50
+                charge = min(self.vitesse_charge*(get_time() - self.offset_time_for_loading), 50)  / 50
             else:
                 charge = 0
 
@@ -123,38 +296,64 @@ class Viewer:
                 elem_ui.set_charge(charge)
                 elem_ui.draw(projection, view, ModelMat,
                               shaders=self.shaders, win=self.win,
-                              view_vector=view_vec)
-            # flush render commands, and swap draw buffers
-            glfw.swap_buffers(self.win)
+                              view_vector=view_vec, queue=self.queue)
 
-            # Poll for and process events
-            glfw.poll_events()
+            # draw the frame sorted by state
+            PROFILER.phase('flush')
+            self.queue.flush()
+
+            # events polled from now on happen before the next frame
+            PROFILER.phase('swap')
+            self.frame += 1
+            self.end_frame()
+            PROFILER.end_frame()
+            GL_CALLS.end_frame()
 
     def add(self, *drawables):
-        """ add objects to draw in this window """
+        """ add objects to draw in this window, simulated if they have an
+            simulate(dt) method """
         self.drawables.extend(drawables)
+        for drawable in drawables:
+            if hasattr(drawable, 'simulate'):
+                self.simulation.add(drawable)
 
     def set_skybox(self, drawable):
         self.skybox = drawable
 
     def add_element_interacting(self, elem_interact):
         self.elements_interacting += [elem_interact]
+        if hasattr(elem_interact, 'simulate'):
+            self.simulation.add(elem_interact)
 
     def add_UI(self, mesh):
         self.elements_UI += [mesh]
 
     def on_key(self, _win, key, _scancode, action, _mods):
-        """ 'Q' or 'Escape' quits """
+        self.key(key, action)
+
+    def key(self, key, action):
+        """ 'Q' or 'Escape' quits, 'S' prints last frame statistics, 'P'
+            starts profiling frames, then prints their profile """
         if action == glfw.PRESS or action == glfw.REPEAT:
             if key == glfw.KEY_ESCAPE or key == glfw.KEY_Q:
-                glfw.set_window_should_close(self.win, True)
+                self.close()
+            if key == glfw.KEY_S and action == glfw.PRESS:
+                print('Culling: %s\nRender queue: %s\nGL state: %s' % (
+                    self.cull_stats, self.queue.stats, STATE))
+            if key == glfw.KEY_P and action == glfw.PRESS:
+                if PROFILER.enabled:
+                    PROFILER.disable()
+                    print(PROFILER.summary())
+                else:
+                    PROFILER.frames.clear()
+                    PROFILER.enable(detailed=True)
             if key == glfw.KEY_SPACE and action == glfw.PRESS:
-                self.offset_time_for_loading = glfw.get_time()
+                self.offset_time_for_loading = get_time()
                 self.is_charging_geyser = True
 
         elif action == glfw.RELEASE:
             if key == glfw.KEY_SPACE and self.is_charging_geyser:
                 self.is_charging_geyser = False
-                charge = min(20 + self.vitesse_charge*(glfw.get_time() - self.offset_time_for_loading), 70)
+                charge = min(20 + self.vitesse_charge*(get_time() - self.offset_time_for_loading), 70)
                 for elem_interact in self.elements_interacting:
                     elem_interact.new_geyser(charge)